@@ -0,0 +1,118 @@
+"""Synthetic course corpora for benchmarking ingestion and querying.
+
+Documents are generated deterministically from a seed: each file covers a few
+topics with definitions, examples and a repeated page header, roughly like a
+lecture handout. Files are written as PDF and/or markdown.
+"""
+import random
+from pathlib import Path
+from typing import Dict, List
+
+TOPICS = [
+    "recursion", "induction", "invariants", "sorting", "hashing", "graphs",
+    "dynamic programming", "concurrency", "testing", "type systems",
+    "memory management", "complexity", "networking", "databases", "compilers",
+]
+VERBS = ["describes", "defines", "guarantees", "reduces", "relates", "extends", "bounds", "simplifies"]
+NOUNS = [
+    "the base case", "a loop invariant", "the running time", "a counterexample", "the proof obligation",
+    "the data structure", "a test oracle", "the call stack", "an edge case", "the specification",
+]
+HEADER = "CS 360 Course Notes - Department of Computer Science - For enrolled students only"
+LINES_PER_PAGE = 40
+LINE_WIDTH = 90
+
+
+def sentence(rng: random.Random, topic: str) -> str:
+    return f"In {topic}, {rng.choice(NOUNS)} {rng.choice(VERBS)} {rng.choice(NOUNS)}."
+
+
+def generate_document(rng: random.Random, index: int, pages: int) -> List[List[str]]:
+    """Returns the lines of each page of one synthetic handout."""
+    topics = rng.sample(TOPICS, k=min(3, len(TOPICS)))
+    result = []
+    for page in range(pages):
+        topic = topics[page % len(topics)]
+        lines = [HEADER, f"Handout {index + 1}, page {page + 1}: {topic.title()}", ""]
+        while len(lines) < LINES_PER_PAGE:
+            paragraph = " ".join(sentence(rng, topic) for _ in range(rng.randint(3, 6)))
+            lines.extend(wrap(paragraph))
+            lines.append("")
+        result.append(lines[:LINES_PER_PAGE])
+    return result
+
+
+def wrap(text: str, width: int = LINE_WIDTH) -> List[str]:
+    lines, current = [], ""
+    for word in text.split():
+        if current and len(current) + 1 + len(word) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        lines.append(current)
+    return lines
+
+
+def pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: Path, pages: List[List[str]]):
+    """Writes a minimal text-only PDF with one Helvetica text stream per page."""
+    objects: List[bytes] = []
+    page_count = len(pages)
+    # 1: catalog, 2: page tree, 3: font, then (page, content) pairs
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(page_count))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, lines in enumerate(pages):
+        text = "\n".join(f"({pdf_escape(line)}) Tj T*" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 760 Td\n{text}\nET".encode("latin-1", "replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    path.write_bytes(bytes(output))
+
+
+def write_markdown(path: Path, pages: List[List[str]]):
+    sections = []
+    for lines in pages:
+        sections.append(f"## {lines[1]}\n\n" + "\n".join(lines[2:]))
+    path.write_text(f"# {pages[0][0]}\n\n" + "\n\n".join(sections) + "\n", encoding="utf-8")
+
+
+def generate_corpus(directory: Path, files: int, pages_per_file: int, file_format: str = "mixed", seed: int = 0) -> List[Dict]:
+    """Writes `files` synthetic handouts into `directory` and describes what was written."""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    written = []
+    for index in range(files):
+        pages = generate_document(rng, index, pages_per_file)
+        if file_format == "pdf" or (file_format == "mixed" and index % 2 == 0):
+            path = directory / f"handout_{index + 1:04d}.pdf"
+            write_pdf(path, pages)
+        else:
+            path = directory / f"handout_{index + 1:04d}.md"
+            write_markdown(path, pages)
+        written.append({"path": path, "pages": len(pages), "bytes": path.stat().st_size})
+    return written
+
+
+def sample_questions(rng: random.Random, count: int) -> List[str]:
+    return [f"What {rng.choice(VERBS[:4])} {rng.choice(NOUNS)} in {rng.choice(TOPICS)}?" for _ in range(count)]
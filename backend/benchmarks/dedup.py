@@ -0,0 +1,104 @@
+"""Index size and ingest cost of near-duplicate chunk elimination.
+
+Generates a synthetic course corpus in which a fraction of the handouts is uploaded
+twice (like a slide deck and its handout) and every page repeats the same header,
+then ingests it through DocumentProcessor.add_source into two notebooks, one with
+dedup off and one with it on. Reports the stored chunk counts, the reduction, the
+time spent in dedup and its share of the total ingest time. Run from the backend
+directory:
+
+    python -m benchmarks.dedup --files 20 --pages-per-file 5 --duplicate-fraction 0.3 --output dedup-results.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.corpus import generate_corpus
+
+
+def stage_seconds(name: str) -> float:
+    from metrics import STAGE_SECONDS, label_key
+
+    entry = STAGE_SECONDS.values.get(label_key({"stage": name}))
+    return entry[1] if entry else 0.0
+
+
+def ingest(processor, notebook_id: str, paths: List[str], dedup: bool) -> Dict:
+    import database_manager
+    from vector_stores import get_vector_store
+
+    database_manager.DEDUP_ENABLED = dedup
+    processor.create_new_notebook_folder_path(notebook_id)
+    dedup_before = stage_seconds("dedup")
+    started = time.perf_counter()
+    for path in paths:
+        processor.add_source(notebook_id, path)
+    elapsed = time.perf_counter() - started
+    dedup_seconds = stage_seconds("dedup") - dedup_before
+    return {
+        "dedup": dedup,
+        "stored_chunks": get_vector_store(f"data/{notebook_id}/chroma")._collection.count(),
+        "ingest_seconds": round(elapsed, 3),
+        "dedup_seconds": round(dedup_seconds, 3),
+        "dedup_share_of_ingest": round(dedup_seconds / elapsed, 4) if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure chunk reduction and overhead of ingest-time dedup.")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--pages-per-file", type=int, default=5)
+    parser.add_argument("--duplicate-fraction", type=float, default=0.3, help="Share of files uploaded a second time.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="dedup-results.json")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+    output_path = Path(args.output).resolve()
+
+    # Mirror the repository layout: sources are resolved as ../frontend/public/<path>
+    workdir = Path(tempfile.mkdtemp(prefix="exam-ai-dedup-"))
+    backend_workdir = workdir / "backend"
+    backend_workdir.mkdir()
+    uploads = workdir / "frontend" / "public" / "uploads"
+    corpus = generate_corpus(uploads, args.files, args.pages_per_file, "pdf", args.seed)
+    paths = [f"uploads/{item['path'].name}" for item in corpus]
+    rng = random.Random(args.seed)
+    for item in rng.sample(corpus, k=int(len(corpus) * args.duplicate_fraction)):
+        copy = item["path"].with_name(f"slides_{item['path'].name}")
+        shutil.copy(item["path"], copy)
+        paths.append(f"uploads/{copy.name}")
+
+    cwd = os.getcwd()
+    os.chdir(backend_workdir)
+    try:
+        from database_manager import DocumentProcessor
+
+        processor = DocumentProcessor("data")
+        processor.embeddings.embed_query("warm-up")
+        baseline = ingest(processor, "dedup-off", paths, dedup=False)
+        deduplicated = ingest(processor, "dedup-on", paths, dedup=True)
+    finally:
+        os.chdir(cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "config": vars(args),
+        "uploads": len(paths),
+        "baseline": baseline,
+        "dedup": deduplicated,
+        "index_reduction": round(1 - deduplicated["stored_chunks"] / max(baseline["stored_chunks"], 1), 4),
+        "ingest_speedup": round(baseline["ingest_seconds"] / max(deduplicated["ingest_seconds"], 1e-9), 3),
+    }
+    print(json.dumps(results, indent=2))
+    output_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Parity and throughput of the embedding backends.
+
+Embeds the same synthetic sentences with sentence-transformers on PyTorch and with
+the ONNX Runtime backend (fp32 and int8), reports the cosine similarity of each ONNX
+vector to its PyTorch counterpart, then measures throughput in sentences/s for each
+backend and thread count. Exits non-zero when a backend's worst-case cosine falls
+below --min-cosine (ONNX_PARITY_MIN_COSINE, the tolerance every export is checked
+against, see embeddings.check_onnx_parity). Run from the backend directory:
+
+    python -m benchmarks.embedding_backends --sentences 2000 --threads 1 4 --output embedding-results.json
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+import embeddings
+from benchmarks.corpus import TOPICS, sentence
+
+
+def make_sentences(count: int, seed: int) -> List[str]:
+    """Chunk-like texts of one to ten sentences, so batches mix short and long inputs."""
+    rng = random.Random(seed)
+    return [" ".join(sentence(rng, rng.choice(TOPICS)) for _ in range(rng.randint(1, 10))) for _ in range(count)]
+
+
+def load_backend(name: str, args, onnx_dir: str):
+    if name == "torch":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(model_name=args.model, encode_kwargs={"batch_size": args.batch_size})
+    return embeddings.OnnxEmbeddings(
+        model_name=args.model,
+        model_dir=onnx_dir,
+        quantize=name == "onnx-int8",
+        batch_size=args.batch_size,
+    )
+
+
+def cosine_parity(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    return {
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "p01_cosine": round(float(np.quantile(cosines, 0.01)), 6),
+        "min_cosine": round(float(cosines.min()), 6),
+    }
+
+
+def throughput(backend, texts: List[str], repeats: int) -> float:
+    backend.embed_documents(texts[:8])
+    best = 0.0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        backend.embed_documents(texts)
+        best = max(best, len(texts) / (time.perf_counter() - started))
+    return round(best, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends for parity and sentences/s.")
+    parser.add_argument("--model", default=embeddings.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--onnx-dir", help="Exported model directory; a temporary one is used by default.")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx-fp32", "onnx-int8"],
+                        choices=["torch", "onnx-fp32", "onnx-int8"])
+    parser.add_argument("--sentences", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=embeddings.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-cosine", type=float, default=embeddings.ONNX_PARITY_MIN_COSINE,
+                        help="Worst-case cosine to the torch vectors that passes.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="embedding-results.json")
+    args = parser.parse_args()
+
+    onnx_dir = args.onnx_dir or tempfile.mkdtemp(prefix="exam-ai-onnx-")
+    texts = make_sentences(args.sentences, args.seed)
+    backends = {name: load_backend(name, args, onnx_dir) for name in args.backends}
+
+    results = {"config": vars(args), "parity": {}, "throughput": {}}
+    vectors = {name: np.asarray(backend.embed_documents(texts), dtype=np.float32) for name, backend in backends.items()}
+    failed = []
+    if "torch" in vectors:
+        for name in vectors:
+            if name != "torch":
+                results["parity"][name] = cosine_parity(vectors["torch"], vectors[name])
+                if results["parity"][name]["min_cosine"] < args.min_cosine:
+                    failed.append(name)
+                print(json.dumps({"parity": name, **results["parity"][name]}))
+
+    for threads in args.threads:
+        embeddings.configure_threads(threads)
+        for name in args.backends:
+            # A fresh ONNX backend so its session is created with the new thread count
+            backend = backends[name] if name == "torch" else load_backend(name, args, onnx_dir)
+            rate = throughput(backend, texts, args.repeats)
+            results["throughput"].setdefault(name, {})[str(threads)] = rate
+            print(json.dumps({"backend": name, "threads": threads, "sentences_per_second": rate}))
+
+    Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    if failed:
+        print(f"Parity below {args.min_cosine} for: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
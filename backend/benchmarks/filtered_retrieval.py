@@ -0,0 +1,150 @@
+"""Latency of metadata-filtered retrieval on a large notebook.
+
+Fills a notebook with synthetic chunks spread over many source files and pages
+(random unit vectors, so no embedding model is needed), then times vector searches
+scoped to one source, to a page range of one source, and unscoped, three ways:
+
+    scope_cache      QueryEngine's path: small scopes searched in memory (filters.ScopeCache)
+    index_filtered   Chroma `where` on every query
+    post_filtered    unscoped search for k * overfetch results, filtered afterwards
+
+"short_results" counts queries that came back with fewer than k chunks, and the
+scope cache's first query (which loads the scope) is reported separately. Run from
+the backend directory:
+
+    python -m benchmarks.filtered_retrieval --chunks 100000 --sources 50 --queries 200 --output filter-results.json
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.run_benchmarks import percentiles
+from filters import SOURCE_PREFIX, ScopeCache, build_filter
+
+DIMENSION = 384
+
+
+def source_name(index: int) -> str:
+    return f"uploads/handout_{index + 1:04d}.pdf"
+
+
+def fill_notebook(collection, chunks: int, sources: int, pages: int, batch_size: int, rng: np.random.Generator):
+    for start in range(0, chunks, batch_size):
+        count = min(batch_size, chunks - start)
+        vectors = rng.standard_normal((count, DIMENSION)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        positions = np.arange(start, start + count)
+        collection.add(
+            ids=[f"chunk-{position}" for position in positions],
+            embeddings=vectors,
+            documents=[f"chunk {position}" for position in positions],
+            metadatas=[
+                {"source": SOURCE_PREFIX + source_name(int(position) % sources), "page": int(position // sources) % pages}
+                for position in positions
+            ],
+        )
+
+
+def timed(search: Callable[[List[float]], int], queries: np.ndarray, k: int) -> Dict:
+    latencies, short = [], 0
+    for vector in queries:
+        started = time.perf_counter()
+        found = search(vector.tolist())
+        latencies.append(time.perf_counter() - started)
+        short += found < k
+    return {"first_ms": round(latencies[0] * 1000, 3), "latency": percentiles(latencies), "short_results": short}
+
+
+def in_scope(metadata: Dict, where: Optional[Dict]) -> bool:
+    if not where:
+        return True
+    (field, condition), = where.items()
+    if field == "$and":
+        return all(in_scope(metadata, clause) for clause in condition)
+    if field == "$or":
+        return any(in_scope(metadata, clause) for clause in condition)
+    (operator, value), = condition.items()
+    actual = metadata.get(field)
+    if operator == "$in":
+        return actual in value
+    if operator == "$gte":
+        return actual is not None and actual >= value
+    if operator == "$lte":
+        return actual is not None and actual <= value
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark filtered retrieval against post-filtering.")
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--sources", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=40, help="Pages per source.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--overfetch", type=int, default=20, help="Post-filtering searches k * overfetch results.")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="filter-results.json")
+    args = parser.parse_args()
+
+    from langchain_community.vectorstores import Chroma
+
+    rng = np.random.default_rng(args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="exam-ai-filter-"))
+    try:
+        persist_directory = str(workdir / "chroma")
+        collection = Chroma(persist_directory=persist_directory)._collection
+        started = time.perf_counter()
+        fill_notebook(collection, args.chunks, args.sources, args.pages, args.batch_size, rng)
+        fill_seconds = time.perf_counter() - started
+        queries = rng.standard_normal((args.queries, DIMENSION)).astype(np.float32)
+
+        scopes = {
+            "unscoped": None,
+            "one_source": build_filter({"sources": [source_name(0)]}),
+            "one_source_pages": build_filter({"sources": [source_name(0)], "pages": [1, 5]}),
+        }
+        results = {"config": vars(args), "fill_seconds": round(fill_seconds, 3), "scopes": {}}
+        for name, where in scopes.items():
+            matching = len(collection.get(where=where, include=[])["ids"]) if where else args.chunks
+
+            scope_cache = ScopeCache()
+
+            def scope_cached(vector, where=where):
+                if where is None:
+                    return index_filtered(vector)
+                ids, _ = scope_cache.search(collection, persist_directory, [vector], args.k, where)[0]
+                collection.get(ids=ids, include=["documents", "metadatas"])
+                return len(ids)
+
+            def index_filtered(vector, where=where):
+                found = collection.query(query_embeddings=[vector], n_results=args.k, where=where,
+                                         include=["documents", "metadatas", "distances"])
+                return len(found["ids"][0])
+
+            def post_filtered(vector, where=where):
+                found = collection.query(query_embeddings=[vector], n_results=args.k * args.overfetch,
+                                         include=["documents", "metadatas", "distances"])
+                return min(args.k, sum(in_scope(metadata, where) for metadata in found["metadatas"][0]))
+
+            results["scopes"][name] = {
+                "matching_chunks": matching,
+                "selectivity": round(matching / args.chunks, 5),
+                "scope_cache": timed(scope_cached, queries, args.k),
+                "index_filtered": timed(index_filtered, queries, args.k),
+                "post_filtered": timed(post_filtered, queries, args.k),
+            }
+            print(json.dumps({"scope": name, **results["scopes"][name]}))
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
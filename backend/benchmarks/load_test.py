@@ -0,0 +1,238 @@
+"""Websocket load generator for a running backend.
+
+Opens many concurrent /query/, /ws and /add_source/ sessions following a ramp of
+concurrency stages, each session sending a weighted mix of messages separated by
+exponentially distributed think time. Every stage records throughput, latency
+percentiles and error rate; the saturation point is the last stage that still
+added throughput without breaking the latency SLO or error budget.
+
+    python -m benchmarks.load_test --url ws://localhost:8000 --notebook <id> \\
+        --ramp step --start 10 --end 500 --step 50 --stage-seconds 30 \\
+        --mix question=0.85,generate_document=0.05,chat=0.05,add_source=0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import websockets
+
+from benchmarks.corpus import sample_questions
+from benchmarks.run_benchmarks import percentiles
+
+# Which endpoint each message kind is sent over
+ENDPOINTS = {
+    "question": "/query/",
+    "generate_document": "/query/",
+    "chat": "/ws",
+    "add_source": "/add_source/",
+}
+DOCUMENT_TYPES = ["exam", "study_guide", "briefing", "faq", "timeline"]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, weight = part.split("=")
+        if kind not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown message kind: {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def build_stages(args) -> List[Tuple[int, float]]:
+    """Returns (concurrent sessions, duration in seconds) for each stage of the ramp."""
+    if args.ramp == "custom":
+        stages = []
+        for part in args.stages.split(","):
+            users, seconds = part.split(":")
+            stages.append((int(users), float(seconds)))
+        return stages
+    if args.ramp == "exponential":
+        stages, users = [], args.start
+        while users <= args.end:
+            stages.append((users, args.stage_seconds))
+            users *= 2
+        return stages
+    return [(users, args.stage_seconds) for users in range(args.start, args.end + 1, args.step)]
+
+
+def is_error(reply) -> bool:
+    """True for an error reply; chat and add_source answer with plain text, which never is one."""
+    if not isinstance(reply, str):
+        return False
+    try:
+        parsed = json.loads(reply)
+    except ValueError:
+        return False
+    return isinstance(parsed, dict) and "error" in parsed
+
+
+def raise_file_limit():
+    """Thousands of sockets need more descriptors than the usual default of 1024."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.rng = random.Random(args.seed)
+        self.questions = sample_questions(self.rng, 200)
+        self.stage = 0
+        # stage -> kind -> list of (latency seconds, ok)
+        self.samples: Dict[int, Dict[str, List[Tuple[float, bool]]]] = defaultdict(lambda: defaultdict(list))
+        self.connect_errors: Dict[int, int] = defaultdict(int)
+
+    def make_message(self, kind: str) -> str:
+        if kind == "question":
+            return json.dumps({"message": self.rng.choice(self.questions)})
+        if kind == "generate_document":
+            return json.dumps({
+                "type": "generate_document",
+                "document_type": self.rng.choice(DOCUMENT_TYPES),
+                "format": "",
+                "classId": self.args.notebook,
+            })
+        if kind == "add_source":
+            return json.dumps({"file_path": self.rng.choice(self.args.source_paths)})
+        return self.rng.choice(self.questions)
+
+    async def session(self, kind: str):
+        """One client connection sending messages of a single kind until cancelled."""
+        url = self.args.url.rstrip("/") + ENDPOINTS[kind]
+        try:
+            async with websockets.connect(url, open_timeout=self.args.timeout, max_size=None) as websocket:
+                if kind != "chat":
+                    await websocket.send(json.dumps({"data": self.args.notebook}))
+                while True:
+                    await asyncio.sleep(self.rng.expovariate(1.0 / self.args.think_time) if self.args.think_time > 0 else 0)
+                    stage = self.stage
+                    sent = time.perf_counter()
+                    ok = True
+                    try:
+                        await websocket.send(self.make_message(kind))
+                        reply = await asyncio.wait_for(websocket.recv(), timeout=self.args.timeout)
+                        ok = not is_error(reply)
+                    except (asyncio.TimeoutError, websockets.ConnectionClosed):
+                        ok = False
+                    self.samples[stage][kind].append((time.perf_counter() - sent, ok))
+                    if not ok:
+                        return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.connect_errors[self.stage] += 1
+
+    def pick_kind(self) -> str:
+        kinds = list(self.mix)
+        return self.rng.choices(kinds, weights=[self.mix[kind] for kind in kinds])[0]
+
+    async def run(self) -> Dict:
+        stages = build_stages(self.args)
+        tasks: List[asyncio.Task] = []
+        report = []
+        for index, (users, seconds) in enumerate(stages):
+            self.stage = index
+            tasks = [task for task in tasks if not task.done()]
+            # Grow or shrink to the target concurrency; finished sessions are replaced
+            while len(tasks) < users:
+                tasks.append(asyncio.create_task(self.session(self.pick_kind())))
+            for task in tasks[users:]:
+                task.cancel()
+            tasks = tasks[:users]
+
+            started = time.perf_counter()
+            while time.perf_counter() - started < seconds:
+                await asyncio.sleep(0.5)
+                for position, task in enumerate(tasks):
+                    if task.done():
+                        tasks[position] = asyncio.create_task(self.session(self.pick_kind()))
+            report.append(self.stage_report(index, users, time.perf_counter() - started))
+            print(json.dumps(report[-1]))
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return {"config": {k: v for k, v in vars(self.args).items()}, "stages": report, "saturation": self.saturation(report)}
+
+    def stage_report(self, index: int, users: int, seconds: float) -> Dict:
+        by_kind = {}
+        all_latencies, total, failed = [], 0, 0
+        for kind, samples in self.samples[index].items():
+            latencies = [latency for latency, ok in samples if ok]
+            errors = sum(1 for _, ok in samples if not ok)
+            by_kind[kind] = {**percentiles(latencies), "errors": errors}
+            all_latencies.extend(latencies)
+            total += len(samples)
+            failed += errors
+        return {
+            "stage": index,
+            "sessions": users,
+            "seconds": round(seconds, 3),
+            "messages": total,
+            "throughput_per_second": round((total - failed) / seconds, 3) if seconds else 0.0,
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            "connect_errors": self.connect_errors[index],
+            "latency": percentiles(all_latencies),
+            "by_kind": by_kind,
+        }
+
+    def saturation(self, report: List[Dict]) -> Optional[Dict]:
+        """Last stage that still scaled: more sessions bought more throughput within the SLO."""
+        best = None
+        for stage in report:
+            p95 = stage["latency"].get("p95_ms", 0.0)
+            if stage["error_rate"] > self.args.max_error_rate or p95 > self.args.slo_ms:
+                break
+            if stage["messages"] == 0 or stage["connect_errors"] > stage["sessions"] * self.args.max_error_rate:
+                break
+            if best is not None and stage["throughput_per_second"] < best["throughput_per_second"] * (1 + self.args.min_gain):
+                break
+            best = stage
+        if best is None:
+            return None
+        return {
+            "sessions": best["sessions"],
+            "throughput_per_second": best["throughput_per_second"],
+            "p95_ms": best["latency"].get("p95_ms"),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ramp concurrent websocket sessions against a running backend.")
+    parser.add_argument("--url", default="ws://localhost:8000")
+    parser.add_argument("--notebook", required=True, help="Notebook id sent as the first message of each session.")
+    parser.add_argument("--source-paths", nargs="*", default=["uploads/CS 360 Testing Handout.pdf"],
+                        help="Paths (relative to frontend/public) used by add_source sessions.")
+    parser.add_argument("--mix", default="question=0.9,generate_document=0.05,chat=0.05")
+    parser.add_argument("--ramp", choices=["step", "exponential", "custom"], default="step")
+    parser.add_argument("--start", type=int, default=10)
+    parser.add_argument("--end", type=int, default=200)
+    parser.add_argument("--step", type=int, default=10)
+    parser.add_argument("--stages", default="", help="Custom ramp as sessions:seconds pairs, e.g. 10:30,100:60.")
+    parser.add_argument("--stage-seconds", type=float, default=30.0)
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean seconds between messages of a session.")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--slo-ms", type=float, default=5000.0, help="p95 latency above which a stage is saturated.")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--min-gain", type=float, default=0.05, help="Minimum relative throughput gain per stage.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load-test-results.json")
+    args = parser.parse_args()
+
+    raise_file_limit()
+    results = asyncio.run(LoadTest(args).run())
+    Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(json.dumps({"saturation": results["saturation"], "output": args.output}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
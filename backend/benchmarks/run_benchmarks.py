@@ -0,0 +1,199 @@
+"""End-to-end benchmark of ingestion, querying and document generation.
+
+Generates a synthetic course corpus, starts the deterministic LLM stub in-process,
+then drives the real FastAPI websocket endpoints (/create, /add_source/, /query/)
+through Starlette's TestClient. Throughput, latency percentiles and peak RSS are
+written as JSON. Run from the backend directory:
+
+    python -m benchmarks.run_benchmarks --files 20 --pages-per-file 5 --queries 50 --output results.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.corpus import generate_corpus, sample_questions
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DOCUMENT_TYPES = ["exam", "study_guide", "briefing", "faq", "timeline"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_llm_stub(latency_ms: float, seed: int) -> str:
+    """Runs llm_stub on a background thread and returns its OpenAI-compatible base URL."""
+    import uvicorn
+    import llm_stub
+
+    random.seed(seed)
+    llm_stub.settings.update(latency_ms=latency_ms, jitter_ms=0.0, rate_limit=0.0)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(llm_stub.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/openai/v1"
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summarises latencies given in seconds as milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_ingest(client, notebook_id: str, corpus: List[Dict]) -> Dict:
+    latencies = []
+    started = time.perf_counter()
+    with client.websocket_connect("/add_source/") as websocket:
+        websocket.send_text(json.dumps({"data": notebook_id}))
+        for item in corpus:
+            sent = time.perf_counter()
+            websocket.send_text(json.dumps({"file_path": f"uploads/{item['path'].name}"}))
+            websocket.receive_text()
+            latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(item["bytes"] for item in corpus)
+    total_pages = sum(item["pages"] for item in corpus)
+    return {
+        "files": len(corpus),
+        "pages": total_pages,
+        "bytes": total_bytes,
+        "seconds": round(elapsed, 3),
+        "files_per_second": round(len(corpus) / elapsed, 3),
+        "pages_per_second": round(total_pages / elapsed, 3),
+        "latency": percentiles(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_messages(client, notebook_id: str, messages: List[Dict]) -> Dict:
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    with client.websocket_connect("/query/") as websocket:
+        websocket.send_text(json.dumps({"data": notebook_id}))
+        for message in messages:
+            sent = time.perf_counter()
+            websocket.send_text(json.dumps(message))
+            reply = json.loads(websocket.receive_text())
+            latencies.append(time.perf_counter() - sent)
+            if "error" in reply:
+                errors += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "messages": len(messages),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(len(messages) / elapsed, 3) if elapsed else 0.0,
+        "latency": percentiles(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, queries and document generation end to end.")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--pages-per-file", type=int, default=5)
+    parser.add_argument("--format", choices=["pdf", "md", "mixed"], default="mixed")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--documents", type=int, default=5)
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+    output_path = Path(args.output).resolve()
+
+    # Mirror the repository layout: the server resolves sources as ../frontend/public/<path>
+    workdir = Path(tempfile.mkdtemp(prefix="exam-ai-bench-"))
+    backend_workdir = workdir / "backend"
+    backend_workdir.mkdir()
+    corpus = generate_corpus(workdir / "frontend" / "public" / "uploads", args.files, args.pages_per_file, args.format, args.seed)
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    stub_url = start_llm_stub(args.stub_latency_ms, args.seed)
+    os.environ.update({
+        "GROQ_BASE_URL": stub_url,
+        "GROQ_API_KEY": "benchmark",
+        "LOCAL_LLM_BASE_URL": "",
+        "LLM_REQUESTS_PER_MINUTE": "1000000",
+        "LLM_TOKENS_PER_MINUTE": "1000000000",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    os.chdir(backend_workdir)
+
+    try:
+        started = time.perf_counter()
+        import main as server
+        from fastapi.testclient import TestClient
+        import llm_stub
+        startup_seconds = time.perf_counter() - started
+
+        client = TestClient(server.app)
+        notebook_id = f"benchmark-{args.seed}"
+        with client.websocket_connect(f"/create/{notebook_id}"):
+            pass
+
+        rng = random.Random(args.seed)
+        results = {
+            "config": vars(args),
+            "startup_seconds": round(startup_seconds, 3),
+            "ingest": run_ingest(client, notebook_id, corpus),
+        }
+        results["query"] = run_messages(client, notebook_id, [
+            {"message": question} for question in sample_questions(rng, args.queries)
+        ])
+        results["generate_document"] = run_messages(client, notebook_id, [
+            {"type": "generate_document", "document_type": DOCUMENT_TYPES[i % len(DOCUMENT_TYPES)], "format": "", "classId": notebook_id}
+            for i in range(args.documents)
+        ])
+        results["llm_calls"] = dict(llm_stub.stats)
+        results["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(json.dumps({
+        "ingest_pages_per_second": results["ingest"]["pages_per_second"],
+        "query_p50_ms": results["query"]["latency"].get("p50_ms"),
+        "query_p95_ms": results["query"]["latency"].get("p95_ms"),
+        "generate_document_p50_ms": results["generate_document"]["latency"].get("p50_ms"),
+        "peak_rss_mb": results["peak_rss_mb"],
+        "output": str(output_path),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Throughput scaling of serve.py across worker counts.
+
+Builds a small notebook, then for each worker count starts `serve.py` against the
+LLM stub and drives it with benchmarks.load_test at a fixed number of concurrent
+/query/ sessions. Reports throughput, p95 latency and scaling efficiency relative
+to one worker. Run from the backend directory:
+
+    python -m benchmarks.scaling --workers 1 2 4 --sessions 32 --seconds 20
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict
+
+import httpx
+
+from benchmarks.run_benchmarks import BACKEND_DIR, free_port, start_llm_stub
+from benchmarks.startup import NOTEBOOK_ID, setup_notebook
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with status {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"serve.py did not start within {timeout}s")
+
+
+def run_load(port: int, args, output: Path) -> Dict:
+    """One warm-up stage then the measured stage, at the same concurrency."""
+    stages = f"{args.sessions}:{args.warmup_seconds},{args.sessions}:{args.seconds}"
+    subprocess.run([
+        sys.executable, "-m", "benchmarks.load_test",
+        "--url", f"ws://127.0.0.1:{port}",
+        "--notebook", NOTEBOOK_ID,
+        "--ramp", "custom", "--stages", stages,
+        "--mix", "question=1",
+        "--think-time", "0",
+        "--output", str(output),
+    ], cwd=BACKEND_DIR, check=True, stdout=subprocess.DEVNULL)
+    return json.loads(output.read_text(encoding="utf-8"))["stages"][-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure query throughput as serve.py workers are added.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--sessions", type=int, default=32, help="Concurrent /query/ sessions.")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--warmup-seconds", type=float, default=5.0)
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="scaling-results.json")
+    args = parser.parse_args()
+
+    output_path = Path(args.output).resolve()
+    workdir = Path(tempfile.mkdtemp(prefix="exam-ai-scaling-"))
+    backend_workdir = workdir / "backend"
+    backend_workdir.mkdir()
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.update({
+        "GROQ_BASE_URL": start_llm_stub(args.stub_latency_ms, args.seed),
+        "GROQ_API_KEY": "benchmark",
+        "LOCAL_LLM_BASE_URL": "",
+        "LLM_REQUESTS_PER_MINUTE": "1000000000",
+        "LLM_TOKENS_PER_MINUTE": "1000000000000",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    os.chdir(backend_workdir)
+    python_path = os.pathsep.join(filter(None, [str(BACKEND_DIR), os.getenv("PYTHONPATH")]))
+
+    results = {"config": vars(args), "runs": []}
+    try:
+        setup_notebook(workdir, args.files, args.seed)
+        for workers in args.workers:
+            port = free_port()
+            process = subprocess.Popen(
+                [sys.executable, str(BACKEND_DIR / "serve.py"), "--workers", str(workers), "--port", str(port)],
+                env={**os.environ, "PYTHONPATH": python_path},
+            )
+            try:
+                wait_until_ready(f"http://127.0.0.1:{port}/", process, args.startup_timeout)
+                stage = run_load(port, args, workdir / f"load-{workers}.json")
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+            run = {
+                "workers": workers,
+                "throughput_per_second": stage["throughput_per_second"],
+                "p95_ms": stage["latency"].get("p95_ms"),
+                "error_rate": stage["error_rate"],
+            }
+            baseline = results["runs"][0] if results["runs"] else run
+            run["efficiency"] = round(
+                run["throughput_per_second"] / (baseline["throughput_per_second"] * workers / baseline["workers"]), 3
+            ) if baseline["throughput_per_second"] else 0.0
+            results["runs"].append(run)
+            print(json.dumps(run))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(json.dumps({"output": str(output_path)}))
+
+
+if __name__ == "__main__":
+    main()
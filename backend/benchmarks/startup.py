@@ -0,0 +1,136 @@
+"""Cold-start benchmark: import time, startup time and first-request latency.
+
+Builds a small notebook once, then starts the backend in fresh interpreters for
+each warm-up mode (WARMUP=off|background|eager) and records how long `import main`
+takes, how long the startup hooks take, and the latency of the first and second
+/query/ messages. Run from the backend directory:
+
+    python -m benchmarks.startup --runs 3 --idle-seconds 0 --output startup-results.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.corpus import generate_corpus, sample_questions
+from benchmarks.run_benchmarks import BACKEND_DIR, percentiles, start_llm_stub
+
+NOTEBOOK_ID = "startup-benchmark"
+WARMUP_MODES = ["off", "background", "eager"]
+
+
+def setup_notebook(workdir: Path, files: int, seed: int):
+    """Ingests a small corpus into the notebook every measured run queries."""
+    corpus = generate_corpus(workdir / "frontend" / "public" / "uploads", files, 2, "pdf", seed)
+    from fastapi.testclient import TestClient
+    import main as server
+
+    client = TestClient(server.app)
+    with client.websocket_connect(f"/create/{NOTEBOOK_ID}"):
+        pass
+    with client.websocket_connect("/add_source/") as websocket:
+        websocket.send_text(json.dumps({"data": NOTEBOOK_ID}))
+        for item in corpus:
+            websocket.send_text(json.dumps({"file_path": f"uploads/{item['path'].name}"}))
+            websocket.receive_text()
+
+
+def measure(idle_seconds: float, seed: int) -> Dict:
+    """Runs in a fresh interpreter: everything heavy is paid for inside the timings."""
+    import random
+
+    started = time.perf_counter()
+    import main as server
+    imported = time.perf_counter()
+    from fastapi.testclient import TestClient
+
+    questions = sample_questions(random.Random(seed), 2)
+    latencies = []
+    # Entering the client runs the startup hooks, including the warm-up
+    with TestClient(server.app) as client:
+        ready = time.perf_counter()
+        time.sleep(idle_seconds)
+        with client.websocket_connect("/query/") as websocket:
+            websocket.send_text(json.dumps({"data": NOTEBOOK_ID}))
+            for question in questions:
+                sent = time.perf_counter()
+                websocket.send_text(json.dumps({"message": question}))
+                websocket.receive_text()
+                latencies.append(time.perf_counter() - sent)
+    return {
+        "import_seconds": round(imported - started, 3),
+        "startup_seconds": round(ready - imported, 3),
+        "first_query_seconds": round(latencies[0], 3),
+        "second_query_seconds": round(latencies[1], 3),
+        "ready_to_first_answer_seconds": round(ready - started + idle_seconds + latencies[0], 3),
+    }
+
+
+def run_child(args) -> Dict:
+    command = [sys.executable, "-m", "benchmarks.startup", "--child", "--idle-seconds", str(args.idle_seconds), "--seed", str(args.seed)]
+    python_path = os.pathsep.join(filter(None, [str(BACKEND_DIR), os.getenv("PYTHONPATH")]))
+    env = {**os.environ, "PYTHONPATH": python_path, "WARMUP": args.mode}
+    output = subprocess.run(command, env=env, cwd=args.backend_workdir, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarise(runs: List[Dict]) -> Dict:
+    return {key: percentiles([run[key] for run in runs]) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure backend import time and first-request latency per warm-up mode.")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters started per warm-up mode.")
+    parser.add_argument("--modes", nargs="*", default=WARMUP_MODES, choices=WARMUP_MODES)
+    parser.add_argument("--idle-seconds", type=float, default=0.0,
+                        help="Pause between startup and the first request, giving background warm-up time to run.")
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="startup-results.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.idle_seconds, args.seed)))
+        return
+
+    output_path = Path(args.output).resolve()
+    workdir = Path(tempfile.mkdtemp(prefix="exam-ai-startup-"))
+    backend_workdir = workdir / "backend"
+    backend_workdir.mkdir()
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.update({
+        "GROQ_BASE_URL": start_llm_stub(args.stub_latency_ms, args.seed),
+        "GROQ_API_KEY": "benchmark",
+        "LOCAL_LLM_BASE_URL": "",
+        "LLM_REQUESTS_PER_MINUTE": "1000000",
+        "LLM_TOKENS_PER_MINUTE": "1000000000",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "WARMUP": "off",
+    })
+    os.chdir(backend_workdir)
+
+    try:
+        setup_notebook(workdir, args.files, args.seed)
+        results = {"config": dict(vars(args)), "modes": {}}
+        for mode in args.modes:
+            args.mode, args.backend_workdir = mode, backend_workdir
+            runs = [run_child(args) for _ in range(args.runs)]
+            results["modes"][mode] = {"runs": runs, "summary": summarise(runs)}
+            print(json.dumps({"mode": mode, **{key: value.get("p50_ms") for key, value in results["modes"][mode]["summary"].items()}}))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output_path.write_text(json.dumps(results, indent=2, default=str), encoding="utf-8")
+    print(json.dumps({"output": str(output_path)}))
+
+
+if __name__ == "__main__":
+    main()
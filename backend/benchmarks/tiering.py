@@ -0,0 +1,132 @@
+"""Storage savings and rehydration latency of cold-notebook archiving.
+
+Fills notebooks with synthetic course text and random unit vectors (so no embedding
+model is needed), archives them with tiering.evict_notebook, and times the first
+query three ways: against an open store, after the store was closed (files still
+expanded on disk) and after the notebook was archived (rehydration included).
+Reports bytes on disk per tier and the compression ratio. Run from the backend
+directory:
+
+    python -m benchmarks.tiering --notebooks 3 --chunks 5000 --output tiering-results.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+from benchmarks.corpus import TOPICS, sentence
+from benchmarks.run_benchmarks import percentiles
+
+DIMENSION = 384
+SENTENCES_PER_CHUNK = 6
+
+
+def fill_notebook(persist_directory: str, chunks: int, batch_size: int, seed: int):
+    from langchain_community.vectorstores import Chroma
+
+    rng = np.random.default_rng(seed)
+    text_rng = random.Random(seed)
+    collection = Chroma(persist_directory=persist_directory)._collection
+    for start in range(0, chunks, batch_size):
+        count = min(batch_size, chunks - start)
+        vectors = rng.standard_normal((count, DIMENSION)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[f"chunk-{position}" for position in range(start, start + count)],
+            embeddings=vectors,
+            documents=[
+                " ".join(sentence(text_rng, text_rng.choice(TOPICS)) for _ in range(SENTENCES_PER_CHUNK))
+                for _ in range(count)
+            ],
+            metadatas=[{"source": f"uploads/handout_{position % 20:02d}.pdf", "page": position // 20 % 40}
+                       for position in range(start, start + count)],
+        )
+
+
+def first_query(persist_directory: str, vector: List[float], before: Callable[[], None]) -> float:
+    """Time from request to results, including whatever `before` leaves to be done."""
+    from langchain_community.vectorstores import Chroma
+    from tiering import hot_notebook
+    from vector_stores import close_vector_store
+
+    before()
+    started = time.perf_counter()
+    with hot_notebook(persist_directory):
+        Chroma(persist_directory=persist_directory)._collection.query(query_embeddings=[vector], n_results=3)
+    elapsed = time.perf_counter() - started
+    close_vector_store(persist_directory)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure archive size and rehydration latency of cold notebooks.")
+    parser.add_argument("--notebooks", type=int, default=3)
+    parser.add_argument("--chunks", type=int, default=5000, help="Chunks per notebook.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="tiering-results.json")
+    args = parser.parse_args()
+    output_path = Path(args.output).resolve()
+
+    workdir = Path(tempfile.mkdtemp(prefix="exam-ai-tiering-"))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from langchain_community.vectorstores import Chroma
+        from tiering import evict_notebook, rehydrate, tier_stats
+
+        directories = [f"data/notebook-{index}/chroma" for index in range(args.notebooks)]
+        for index, persist_directory in enumerate(directories):
+            fill_notebook(persist_directory, args.chunks, args.batch_size, args.seed + index)
+        hot = tier_stats("data")
+
+        vector = np.random.default_rng(args.seed).standard_normal(DIMENSION).tolist()
+        open_latencies, closed_latencies, rehydrate_latencies, evictions = [], [], [], []
+        for persist_directory in directories:
+            def warm():
+                Chroma(persist_directory=persist_directory)._collection.query(query_embeddings=[vector], n_results=3)
+
+            def archive():
+                evictions.append(evict_notebook(persist_directory, cold_after=0))
+
+            open_latencies.append(first_query(persist_directory, vector, warm))
+            closed_latencies.append(first_query(persist_directory, vector, lambda: None))
+            rehydrate_latencies.append(first_query(persist_directory, vector, archive))
+        # Leave everything archived to measure the cold tier
+        for persist_directory in directories:
+            evict_notebook(persist_directory, cold_after=0)
+        cold = tier_stats("data")
+        rehydrate_only = []
+        for persist_directory in directories:
+            rehydrate_only.append(rehydrate(persist_directory)["seconds"])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "config": vars(args),
+        "hot_bytes": hot["hot"]["bytes"],
+        "cold_bytes": cold["cold"]["bytes"],
+        "saved_bytes": cold["saved_bytes"],
+        "compression_ratio": round(hot["hot"]["bytes"] / max(cold["cold"]["bytes"], 1), 3),
+        "eviction": percentiles([result["seconds"] for result in evictions]),
+        "rehydration": percentiles(rehydrate_only),
+        "first_query": {
+            "store_open": percentiles(open_latencies),
+            "store_closed": percentiles(closed_latencies),
+            "archived": percentiles(rehydrate_latencies),
+        },
+    }
+    print(json.dumps(results, indent=2))
+    output_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
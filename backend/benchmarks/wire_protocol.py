@@ -0,0 +1,117 @@
+"""Bytes on the wire and serialisation CPU of the websocket encodings.
+
+Builds synthetic /query/ responses (answers with follow-up questions and sources,
+and generated documents of a few sizes) and sends each kind as a sequence of
+messages on one connection, encoded as the legacy indented JSON and as MessagePack
+(see protocol.py). Each is measured with and without permessage-deflate, using the
+websockets library's own extension with context takeover as uvicorn negotiates it.
+Reports frame bytes per message, server encode and client decode time, and the
+time deflate adds. Run from the backend directory:
+
+    python -m benchmarks.wire_protocol --messages 50 --output wire-results.json
+"""
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import msgpack
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+
+from benchmarks.corpus import TOPICS, sample_questions, sentence
+from protocol import MSGPACK_SUBPROTOCOL, encode
+
+DOCUMENT_KILOBYTES = [4, 16, 64]
+
+
+def answer(rng: random.Random) -> Dict:
+    return {
+        "response": " ".join(sentence(rng, rng.choice(TOPICS)) for _ in range(rng.randint(4, 10))),
+        "questions": sample_questions(rng, 3),
+        "sources": [{"source": f"uploads/handout_{rng.randint(1, 20):02d}.pdf", "page": rng.randint(1, 40)}
+                    for _ in range(3)],
+    }
+
+
+def document(rng: random.Random, kilobytes: int) -> Dict:
+    lines = ["# Practice Exam", ""]
+    number = 1
+    while sum(len(line) + 1 for line in lines) < kilobytes * 1024:
+        topic = rng.choice(TOPICS)
+        lines.append(f"## Question {number}")
+        lines.append(f"{sentence(rng, topic)} Explain \"why\" in 2-3 sentences.")
+        lines.extend(f"- ({letter}) {sentence(rng, topic)}" for letter in "abcd")
+        lines.append(f"**Answer:** {sentence(rng, topic)}")
+        lines.append("")
+        number += 1
+    return {"type": "exam", "content": "\n".join(lines), "title": "Exam Document"}
+
+
+def frame_size(payload: bytes) -> int:
+    # Server frames are unmasked: 2 header bytes plus a 2 or 8 byte extended length
+    extra = 0 if len(payload) < 126 else 2 if len(payload) < 1 << 16 else 8
+    return 2 + extra + len(payload)
+
+
+def measure(messages: List[Dict], subprotocol, decode: Callable, deflate: bool) -> Dict:
+    extension = PerMessageDeflate(False, False, 15, 15) if deflate else None
+    encode_seconds = decode_seconds = deflate_seconds = 0.0
+    wire_bytes = 0
+    for message in messages:
+        started = time.perf_counter()
+        data = encode(message, subprotocol)
+        encode_seconds += time.perf_counter() - started
+        payload = data if isinstance(data, bytes) else data.encode("utf-8")
+        if extension is not None:
+            started = time.perf_counter()
+            opcode = Opcode.BINARY if isinstance(data, bytes) else Opcode.TEXT
+            payload = extension.encode(Frame(opcode, payload)).data
+            deflate_seconds += time.perf_counter() - started
+        wire_bytes += frame_size(payload)
+        started = time.perf_counter()
+        decode(data)
+        decode_seconds += time.perf_counter() - started
+    count = len(messages)
+    return {
+        "bytes_per_message": round(wire_bytes / count),
+        "encode_us": round(encode_seconds / count * 1e6, 1),
+        "decode_us": round(decode_seconds / count * 1e6, 1),
+        "deflate_us": round(deflate_seconds / count * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare websocket encodings by bytes on the wire and CPU.")
+    parser.add_argument("--messages", type=int, default=50, help="Messages of each kind per connection.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="wire-results.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    kinds = {"answer": [answer(rng) for _ in range(args.messages)]}
+    for kilobytes in DOCUMENT_KILOBYTES:
+        kinds[f"document_{kilobytes}kb"] = [document(rng, kilobytes) for _ in range(max(1, args.messages // 5))]
+    encodings = {
+        "json": (None, json.loads),
+        "msgpack": (MSGPACK_SUBPROTOCOL, lambda data: msgpack.unpackb(data, raw=False)),
+    }
+
+    results = {"config": vars(args), "kinds": {}}
+    for kind, messages in kinds.items():
+        results["kinds"][kind] = {}
+        for name, (subprotocol, decode) in encodings.items():
+            for deflate in (False, True):
+                label = f"{name}+deflate" if deflate else name
+                results["kinds"][kind][label] = measure(messages, subprotocol, decode, deflate)
+        baseline = results["kinds"][kind]["json"]["bytes_per_message"]
+        for entry in results["kinds"][kind].values():
+            entry["bytes_vs_json"] = round(entry["bytes_per_message"] / baseline, 3)
+        print(json.dumps({"kind": kind, **results["kinds"][kind]}))
+    Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Bulk build of a vector store from a directory of source documents.
+
+Replaces create_database.py and add_additional.py. Documents are loaded and split
+by DocumentProcessor in a pool of worker processes while the main process embeds
+and writes batches. Every build goes into a fresh version directory next to the
+served path, which is a symlink switched atomically once the build is complete,
+so readers never see a half-built store:
+
+    AllDocsDB/chroma -> chroma.versions/v1718000000   (served)
+    AllDocsDB/chroma.versions/v1718000000/build-manifest.json
+
+The manifest records the hash and chunk ids of every ingested file and is saved
+after each batch. Files that fail to load or split are recorded with the error and
+tried again by the next build. A build that is interrupted resumes where it stopped, and by
+default a new build starts from a copy of the live version and only re-ingests
+files that were added, changed or removed. Run from the backend directory:
+
+    python build_corpus.py --source aptos-core-pdf-md-mdx-files --output AllDocsDB/chroma --workers 8
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from database_manager import MAX_BATCH_SIZE, DocumentProcessor
+from query_data import CHROMA_PATH
+from vector_stores import bump_notebook_version, close_vector_store, get_vector_store
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MANIFEST_FILE = "build-manifest.json"
+# Points at the version directory of a build in progress, so it can be resumed
+BUILDING_FILE = "BUILDING"
+KEEP_VERSIONS = 2
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_and_split(path: str) -> Tuple[List, Optional[str]]:
+    """Runs in a worker process: parse one file and split it into chunks, or say why it failed."""
+    processor = DocumentProcessor("")
+    try:
+        documents = processor.load_single_document(Path(path), raise_errors=True)
+        return (processor.split_text(documents) if documents else []), None
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}"
+
+
+def chunk_ids(relative_path: str, digest: str, count: int) -> List[str]:
+    # Deterministic ids make re-adding a batch after a crash an overwrite, not a duplicate
+    prefix = hashlib.sha1(f"{relative_path}\0{digest}".encode("utf-8")).hexdigest()[:16]
+    return [f"{prefix}-{i}" for i in range(count)]
+
+
+class CorpusBuilder:
+    def __init__(self, source: str, output: str, workers: int, batch_size: int = MAX_BATCH_SIZE,
+                 full: bool = False, keep_versions: int = KEEP_VERSIONS):
+        self.source = Path(source)
+        self.output = Path(output)
+        self.versions = self.output.with_name(f"{self.output.name}.versions")
+        self.workers = workers
+        self.batch_size = batch_size
+        self.full = full
+        self.keep_versions = keep_versions
+
+    def scan(self) -> Dict[str, Path]:
+        """Supported files under the source directory, keyed by their relative path."""
+        files = {}
+        for path in sorted(self.source.rglob("*")):
+            if path.is_file() and path.suffix.lower() in DocumentProcessor.SUPPORTED_FORMATS:
+                files[path.relative_to(self.source).as_posix()] = path
+        return files
+
+    def live_directory(self) -> Optional[Path]:
+        return self.output.resolve() if self.output.exists() else None
+
+    @staticmethod
+    def read_manifest(directory: Path) -> Dict:
+        path = directory / MANIFEST_FILE
+        if path.exists():
+            return json.loads(path.read_text(encoding="utf-8"))
+        return {"files": {}, "complete": False}
+
+    @staticmethod
+    def save_manifest(directory: Path, manifest: Dict):
+        path = directory / MANIFEST_FILE
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def prepare(self) -> Tuple[Path, Dict]:
+        """Returns the version directory to build into and its manifest, resuming if possible."""
+        self.versions.mkdir(parents=True, exist_ok=True)
+        building = self.versions / BUILDING_FILE
+        if building.exists():
+            directory = self.versions / building.read_text(encoding="utf-8").strip()
+            if directory.is_dir():
+                manifest = self.read_manifest(directory)
+                logger.info("Resuming build in %s (%d files already done)", directory, len(manifest["files"]))
+                return directory, manifest
+
+        directory = self.versions / f"v{time.time_ns()}"
+        live = self.live_directory()
+        if live is not None and not self.full and (live / MANIFEST_FILE).exists():
+            logger.info("Starting incremental build from %s", live)
+            shutil.copytree(live, directory)
+            manifest = self.read_manifest(directory)
+            manifest["complete"] = False
+        else:
+            directory.mkdir()
+            manifest = {"files": {}, "complete": False}
+        manifest["started"] = time.time()
+        self.save_manifest(directory, manifest)
+        building.write_text(directory.name, encoding="utf-8")
+        return directory, manifest
+
+    @staticmethod
+    def changes(manifest: Dict, hashes: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Files removed since the manifest was written, and files that are new, modified or failed."""
+        removed = [relative_path for relative_path in manifest["files"] if relative_path not in hashes]
+        changed = [relative_path for relative_path, digest in hashes.items()
+                   if manifest["files"].get(relative_path, {}).get("sha256") != digest
+                   or "error" in manifest["files"][relative_path]]
+        return removed, changed
+
+    def run(self) -> Dict:
+        started = time.perf_counter()
+        files = self.scan()
+        hashes = {relative_path: file_hash(path) for relative_path, path in files.items()}
+
+        live = self.live_directory()
+        if live is not None and not self.full and not (self.versions / BUILDING_FILE).exists():
+            live_manifest = self.read_manifest(live)
+            if live_manifest["complete"] and self.changes(live_manifest, hashes) == ([], []):
+                logger.info("%s is up to date with %s", self.output, self.source)
+                return {"version": live.name, "files": len(files), "ingested_files": 0, "removed_files": 0,
+                        "chunks_added": 0, "seconds": round(time.perf_counter() - started, 3)}
+
+        directory, manifest = self.prepare()
+        db = get_vector_store(str(directory))
+        removed, changed = self.changes(manifest, hashes)
+
+        # Drop the chunks of files that are gone or will be re-ingested
+        stale_ids = []
+        for relative_path in removed + changed:
+            stale_ids.extend(manifest["files"].pop(relative_path, {}).get("ids", []))
+        if stale_ids:
+            for start in range(0, len(stale_ids), self.batch_size * 10):
+                db.delete(ids=stale_ids[start:start + self.batch_size * 10])
+            self.save_manifest(directory, manifest)
+        logger.info("%d files: %d to ingest, %d removed, %d unchanged",
+                    len(files), len(changed), len(removed), len(files) - len(changed))
+
+        pending = [(relative_path, files[relative_path], hashes[relative_path]) for relative_path in changed]
+        chunk_count = self.ingest(db, directory, manifest, pending)
+        failed = sorted(relative_path for relative_path, entry in manifest["files"].items() if "error" in entry)
+        if failed:
+            logger.warning("%d files failed and will be retried by the next build: %s", len(failed), ", ".join(failed))
+
+        manifest["complete"] = True
+        manifest["finished"] = time.time()
+        self.save_manifest(directory, manifest)
+        close_vector_store(str(directory))
+        self.swap(directory)
+        (self.versions / BUILDING_FILE).unlink(missing_ok=True)
+        self.prune(directory)
+
+        elapsed = time.perf_counter() - started
+        result = {
+            "version": directory.name,
+            "files": len(files),
+            "ingested_files": len(changed),
+            "removed_files": len(removed),
+            "failed_files": len(failed),
+            "chunks_added": chunk_count,
+            "seconds": round(elapsed, 3),
+        }
+        logger.info("Build finished: %s", result)
+        return result
+
+    def ingest(self, db, directory: Path, manifest: Dict, pending: List[Tuple[str, Path, str]]) -> int:
+        """Loads files in worker processes and writes them in batches, checkpointing after each."""
+        batch: List = []
+        batch_files: Dict[str, Dict] = {}
+        total = 0
+
+        def flush():
+            nonlocal batch, batch_files, total
+            if not batch_files:
+                return
+            if batch:
+                ids = [chunk_id for entry in batch_files.values() for chunk_id in entry["ids"]]
+                for start in range(0, len(batch), self.batch_size):
+                    db.add_documents(batch[start:start + self.batch_size], ids=ids[start:start + self.batch_size])
+                total += len(batch)
+            manifest["files"].update(batch_files)
+            self.save_manifest(directory, manifest)
+            logger.info("Checkpoint: %d files, %d chunks written", len(manifest["files"]), total)
+            batch, batch_files = [], {}
+
+        def handle(relative_path: str, digest: str, loaded: Tuple[List, Optional[str]]):
+            chunks, error = loaded
+            if error is not None:
+                logger.error("Error ingesting %s: %s", relative_path, error)
+                batch_files[relative_path] = {"sha256": digest, "ids": [], "error": error}
+                return
+            ids = chunk_ids(relative_path, digest, len(chunks))
+            batch.extend(chunks)
+            batch_files[relative_path] = {"sha256": digest, "ids": ids}
+            if len(batch) >= self.batch_size:
+                flush()
+
+        def result(future: Future) -> Tuple[List, Optional[str]]:
+            try:
+                return future.result()
+            except Exception as e:
+                # e.g. a worker killed by a parser crash
+                return [], f"{type(e).__name__}: {e}"
+
+        if self.workers <= 1:
+            for relative_path, path, digest in pending:
+                handle(relative_path, digest, load_and_split(str(path)))
+        else:
+            # Spawned rather than forked: the parent already has Chroma's threads running
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                # Bounded look-ahead keeps parsed-but-unwritten documents from piling up in memory
+                in_flight: Deque[Tuple[str, str, Future]] = deque()
+                for relative_path, path, digest in pending:
+                    in_flight.append((relative_path, digest, pool.submit(load_and_split, str(path))))
+                    if len(in_flight) >= self.workers * 2:
+                        done_path, done_digest, future = in_flight.popleft()
+                        handle(done_path, done_digest, result(future))
+                while in_flight:
+                    done_path, done_digest, future = in_flight.popleft()
+                    handle(done_path, done_digest, result(future))
+        flush()
+        return total
+
+    def swap(self, directory: Path):
+        """Points the served path at the finished version in one rename."""
+        if self.output.exists() and not self.output.is_symlink():
+            # A store from the old scripts: keep it as a version so it can be pruned later
+            legacy = self.versions / f"legacy-{time.time_ns()}"
+            logger.info("Moving existing store %s to %s", self.output, legacy)
+            os.rename(self.output, legacy)
+        link = self.output.with_name(f"{self.output.name}.swap")
+        link.unlink(missing_ok=True)
+        os.symlink(os.path.relpath(directory, self.output.parent), link)
+        os.replace(link, self.output)
+        close_vector_store(str(self.output))
+        # Serving processes reopen the store when they see the new version
+        bump_notebook_version(str(self.output))
+        logger.info("%s now serves %s", self.output, directory.name)
+
+    def prune(self, live: Path):
+        versions = sorted(
+            (path for path in self.versions.iterdir() if path.is_dir() and path != live),
+            key=lambda path: path.stat().st_mtime,
+        )
+        for path in versions[:max(0, len(versions) - (self.keep_versions - 1))]:
+            logger.info("Removing old version %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update a vector store from a directory of documents.")
+    parser.add_argument("--source", required=True, help="Directory of documents, searched recursively.")
+    parser.add_argument("--output", default=CHROMA_PATH, help="Path the store is served from.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes loading and splitting documents.")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE, help="Chunks embedded and written per checkpoint.")
+    parser.add_argument("--full", action="store_true", help="Rebuild from scratch instead of updating the live version.")
+    parser.add_argument("--keep-versions", type=int, default=KEEP_VERSIONS, help="Finished versions kept on disk, including the live one.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    builder = CorpusBuilder(args.source, args.output, args.workers, args.batch_size, args.full, args.keep_versions)
+    print(json.dumps(builder.run()))
+
+
+if __name__ == "__main__":
+    main()
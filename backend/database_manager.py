@@ -1,51 +1,76 @@
-from langchain_community.document_loaders import DirectoryLoader, TextLoader, UnstructuredMarkdownLoader, CSVLoader, JSONLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema import Document
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_groq import ChatGroq
+import importlib
 import os
 import shutil
 from dotenv import load_dotenv
-from typing import List, Dict, Callable
-import numpy as np
+from typing import TYPE_CHECKING, List, Dict, Callable, Tuple
 from pathlib import Path
 import json
+import logging
 import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dedup import DEDUP_ENABLED, DedupIndex
+from embeddings import get_embeddings
+from filters import ScopeCache, build_filter, filter_key
+from llm_router import get_router
+from map_reduce import MapReduceGenerator
+from metrics import ERRORS, log_sampled, stage
+from retrieval_cache import RETRIEVAL_PRECOMPUTE, RetrievalCache, RetrievalResult
+from speculative import SPECULATIVE_FOLLOWUPS, SpeculativeAnswers
+from tiering import hot_notebook, notebook_exists
+from topic_index import TOPIC_LOCK_FILE, TopicIndex
+from vector_stores import get_vector_store, mark_vector_store_written, notebook_lock, notebook_write_lock
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 # Load environment variables
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 # Constants
 # CHROMA_PATH = "AllDocsDB/chroma"
 # DATA_PATH = "aptos-core-pdf-md-mdx-files"
 MAX_BATCH_SIZE = 160
+# "map_reduce" summarises the whole notebook, "retrieval" uses the top matching chunks only
+GENERATION_MODE = os.getenv("GENERATION_MODE", "map_reduce")
 
 class DocumentProcessor:
+    # Loader classes live in langchain_community.document_loaders and are imported on first use
     SUPPORTED_FORMATS = {
-        '.txt': TextLoader,
-        '.md': UnstructuredMarkdownLoader,
-        '.mdx': TextLoader,
-        '.csv': CSVLoader,
-        '.json': JSONLoader,
-        '.pdf': PyPDFLoader
+        '.txt': 'TextLoader',
+        '.md': 'UnstructuredMarkdownLoader',
+        '.mdx': 'TextLoader',
+        '.csv': 'CSVLoader',
+        '.json': 'JSONLoader',
+        '.pdf': 'PyPDFLoader'
     }
 
-    def __init__(self, data_path: str):
+    def __init__(self, data_path: str, llm=None):
         self.data_path = data_path
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
+        # Without an LLM the ingest-time topic index is not maintained
+        self.topic_generator = MapReduceGenerator(llm) if llm is not None else None
+        # Topic summaries take LLM calls, so they are made after the upload is acknowledged
+        self.topic_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="topic-index")
 
     def get_loader_for_file(self, file_path: Path) -> Callable:
         """Returns appropriate loader for the file type."""
         file_extension = file_path.suffix.lower()
         if file_extension not in self.SUPPORTED_FORMATS:
             raise ValueError(f"Unsupported file format: {file_extension}")
-        return self.SUPPORTED_FORMATS[file_extension]
+        loaders = importlib.import_module("langchain_community.document_loaders")
+        return getattr(loaders, self.SUPPORTED_FORMATS[file_extension])
+
+    @property
+    def embeddings(self):
+        return get_embeddings()
 
-    def load_single_document(self, file_path: Path) -> List[Document]:
-        """Loads a single document using the appropriate loader."""
+    def load_single_document(self, file_path: Path, raise_errors: bool = False) -> List['Document']:
+        """Loads a single document using the appropriate loader.
+
+        Errors are logged and give an empty list unless `raise_errors` is set.
+        """
         file_path = Path(file_path)
         try:
             loader_class = self.get_loader_for_file(file_path)
@@ -53,6 +78,8 @@ class DocumentProcessor:
             if file_path.suffix.lower() == '.json':
                 loader = loader_class(file_path=str(file_path), jq_schema='.', text_content=False)
             elif file_path.suffix.lower() == '.pdf':
+                from langchain_core.documents import Document
+
                 loader = loader_class(str(file_path))
                 # Extract all pages from the PDF
                 documents = []
@@ -66,21 +93,23 @@ class DocumentProcessor:
                             'page': page.metadata.get('page', 1)
                         }
                     ))
-                print(f"Loaded PDF: {file_path} - {len(documents)} pages")
+                logger.info("Loaded PDF: %s - %d pages", file_path, len(documents))
                 return documents
             else:
                 loader = loader_class(str(file_path))
             
             if file_path.suffix.lower() != '.pdf':
                 documents = loader.load()
-                print(f"Loaded: {file_path}")
+                logger.info("Loaded: %s", file_path)
                 return documents
                 
         except Exception as e:
-            print(f"Error loading {file_path}: {str(e)}")
+            if raise_errors:
+                raise
+            logger.error("Error loading %s: %s", file_path, e)
             return []
 
-    def load_documents(self) -> List[Document]:
+    def load_documents(self) -> List['Document']:
         """Loads all supported documents from the data directory."""
         documents = []
         for file_format in self.SUPPORTED_FORMATS.keys():
@@ -90,13 +119,15 @@ class DocumentProcessor:
                 if loaded_docs:
                     documents.extend(loaded_docs)
                     if file_path.suffix.lower() == '.pdf':
-                        print(f"Successfully loaded PDF {file_path} with {len(loaded_docs)} pages")
+                        logger.info("Successfully loaded PDF %s with %d pages", file_path, len(loaded_docs))
         
-        print(f"Successfully loaded {len(documents)} documents total.")
+        logger.info("Successfully loaded %d documents total.", len(documents))
         return documents
 
-    def split_text(self, documents: List[Document]) -> List[Document]:
+    def split_text(self, documents: List['Document']) -> List['Document']:
         """Splits documents into smaller chunks."""
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=100,
             chunk_overlap=30,
@@ -104,7 +135,7 @@ class DocumentProcessor:
             add_start_index=True,
         )
         chunks = text_splitter.split_documents(documents)
-        print(f"Split {len(documents)} documents into {len(chunks)} chunks.")
+        logger.info("Split %d documents into %d chunks.", len(documents), len(chunks))
         return chunks
 
     # def split_text(self, documents: List[Document]) -> List[Document]:
@@ -128,43 +159,35 @@ class DocumentProcessor:
     #         add_start_index=True,
     #     )
 
-    def process_in_batches(self, chunks: List[Document], batch_size: int):
+    def process_in_batches(self, chunks: List['Document'], batch_size: int):
         """Generator function to process documents in batches."""
         for i in range(0, len(chunks), batch_size):
             yield chunks[i:i + batch_size]
 
-    def save_to_chroma(self, chunks: List[Document], persist_directory: str):
+    def save_to_chroma(self, chunks: List['Document'], persist_directory: str):
         """Saves document embeddings to ChromaDB with batch processing."""
-        if os.path.exists(persist_directory):
-            print(f"Loading existing ChromaDB from {persist_directory}")
-            db = Chroma(
-                persist_directory=persist_directory,
-                embedding_function=self.embeddings
-            )
-        else:
-            db = None
+        if not chunks:
+            return None, []
+        # Opens the existing database, or creates it on the first batch
+        db = get_vector_store(persist_directory)
 
         total_processed = 0
+        ids = []
 
         # Process documents in batches
         for batch in self.process_in_batches(chunks, MAX_BATCH_SIZE):
-            if db is None:
-                # Create a new database if it doesn't exist
-                db = Chroma.from_documents(
-                    batch,
-                    self.embeddings,
-                    persist_directory=persist_directory
-                )
-            else:
-                # Add documents to the existing database
-                db.add_documents(batch)
+            batch_ids = [str(uuid.uuid4()) for _ in batch]
+            db.add_documents(batch, ids=batch_ids)
             
+            ids.extend(batch_ids)
             total_processed += len(batch)
-            print(f"Processed {total_processed}/{len(chunks)} chunks...")
+            logger.debug("Processed %d/%d chunks...", total_processed, len(chunks))
 
         if db:
             db.persist()
-            print(f"Successfully saved {len(chunks)} chunks to {persist_directory}.")
+            mark_vector_store_written(persist_directory)
+            logger.info("Successfully saved %d chunks to %s.", len(chunks), persist_directory)
+        return db, ids
 
     def create_new_notebook_folder_path(self, folder_name: str):
         data_folder = Path(self.data_path)
@@ -175,21 +198,61 @@ class DocumentProcessor:
         # return str(new_folder_path)
 
     def add_source(self, notebook_id, path):
+        started = time.perf_counter()
         new_file_path = f"../frontend/public/{path}"
         new_folder_path = f"data/{notebook_id}/chroma"
         documents = self.load_single_document(new_file_path)
         chunks = self.split_text(documents)
-        self.save_to_chroma(chunks, new_folder_path)
+        # Restores the notebook if it was archived; other workers may be ingesting into it too
+        with hot_notebook(new_folder_path), notebook_write_lock(new_folder_path):
+            dedup_index, signatures = None, None
+            if DEDUP_ENABLED and chunks:
+                with stage("dedup"):
+                    dedup_index = DedupIndex.load(new_folder_path)
+                    chunks, signatures, dedup_stats = dedup_index.deduplicate(get_vector_store(new_folder_path), chunks)
+            db, ids = self.save_to_chroma(chunks, new_folder_path)
+            if dedup_index is not None:
+                dedup_index.add(ids, signatures)
+                dedup_index.save()
+                if dedup_stats["merged_into_existing"] and not ids:
+                    # Only metadata changed; still let other workers see it
+                    mark_vector_store_written(new_folder_path)
+                elapsed = time.perf_counter() - started
+                logger.info(
+                    "Dedup kept %d of %d chunks from %s (%.0f%% fewer) in %.3fs, %.1f%% of the ingest time",
+                    dedup_stats["kept"], dedup_stats["chunks"], path, dedup_stats["reduction"] * 100,
+                    dedup_stats["seconds"], dedup_stats["seconds"] / max(elapsed, 1e-9) * 100,
+                )
+        if ids and self.topic_generator:
+            self.topic_executor.submit(self.update_topic_index, ids, new_folder_path)
+
+    def update_topic_index(self, ids: List[str], persist_directory: str):
+        """Folds freshly ingested chunks into the notebook's precomputed topic summaries."""
+        try:
+            with hot_notebook(persist_directory), notebook_lock(persist_directory, TOPIC_LOCK_FILE):
+                TopicIndex.load(persist_directory).update(get_vector_store(persist_directory), ids, self.topic_generator)
+        except Exception as e:
+            # The index is an optimisation; ingestion itself has already succeeded
+            ERRORS.inc(component="topic_index")
+            logger.exception("Error updating topic index for %s: %s", persist_directory, e)
 
 class QueryEngine:
     def __init__(self):
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
-        self.llm = ChatGroq(
-            model_name="llama-3.3-70b-versatile",
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
+        # Short Q&A, document generation and summaries are routed to different models
+        self.router = get_router()
+        self.llm = self.router.route("query")
+        self.document_llm = self.router.route("document")
+        self.map_reduce = MapReduceGenerator(self.router.route("summary"))
+        self.retrieval_cache = RetrievalCache()
+        self.scope_cache = ScopeCache()
+        # Answers to suggested follow-ups generated ahead of the click, when enabled
+        self.speculative = None
+        if SPECULATIVE_FOLLOWUPS:
+            self.speculative = SpeculativeAnswers(self.answer_in_background, self.router.saturation)
+
+    @property
+    def embeddings(self):
+        return get_embeddings()
 
     def extract_json_from_text(self, text):
         """Extract JSON from text, even if it's within markdown code blocks"""
@@ -254,54 +317,190 @@ class QueryEngine:
         }
 
    
-    def query(self, query: str, persist_directory: str, collection_name: str = None):
+    def query(self, query: str, persist_directory: str, collection_name: str = None, conversation_id: str = None,
+              where: Dict = None):
         """Queries GroqCloud's LLM with context from the vector store."""
+        response_json = self.query_response(query, persist_directory, conversation_id=conversation_id, where=where)
+        return json.dumps(response_json, ensure_ascii=False, indent=2)
+
+    def query_response(self, query: str, persist_directory: str, conversation_id: str = None,
+                       where: Dict = None) -> Dict:
+        """query() before serialisation, so the caller can pick the wire encoding."""
         try:
-            # Check if this is a document generation request
-            if isinstance(query, dict) and "type" in query and query["type"] == "generate_document":
-                return self.generate_document(query, persist_directory)
-                
-            # Regular query processing
-            db = Chroma(
-                persist_directory=persist_directory,
-                embedding_function=self.embeddings
-            )
-            def normalize_scores(results):
-                docs_with_scores = []
-                for doc, score in results:
-                    # Convert negative cosine similarity to 0-1 range
-                    normalized_score = (score + 1) / 2
-                    docs_with_scores.append((doc, normalized_score))
-                return docs_with_scores
-            
-            raw_results = db.similarity_search_with_relevance_scores(query, k=3)
-            docs = normalize_scores(raw_results)
-        
-            if not docs:
-                print("No documents found with the given relevance score threshold.")
-                # Return a default JSON response when no context is found
-                return json.dumps({
-                    "response": "I couldn't find specific information to answer your question. Could you please provide more details or ask a different question?",
-                    "questions": [
-                        "Can you rephrase your question?",
-                        "What specific aspect are you interested in learning about?",
-                        "Would you like information on a related topic instead?"
-                    ]
-                }, ensure_ascii=False, indent=2)
-            
+            if not notebook_exists(persist_directory):
+                # Opening a store would create its directory under data/
+                return {"error": "Notebook not found", "response": "This notebook does not exist.", "questions": []}
+            # Restores the notebook first if it was archived (see tiering.py)
+            with hot_notebook(persist_directory):
+                # Check if this is a document generation request
+                if isinstance(query, dict) and "type" in query and query["type"] == "generate_document":
+                    return self.generate_document(query, persist_directory)
+
+                answered = None
+                if conversation_id and self.speculative:
+                    answered = self.speculative.take(conversation_id, persist_directory, query, where)
+                if answered is None:
+                    answered = self.answer(query, persist_directory, where)
+                response_json, grounded = answered
+
+                if grounded:
+                    # Students often click a suggestion next, so have its search results ready
+                    db = get_vector_store(persist_directory)
+                    self.precompute_retrieval(db, persist_directory, response_json["questions"], k=3, where=where)
+                    if conversation_id and self.speculative:
+                        self.speculative.schedule(conversation_id, persist_directory, response_json["questions"], where)
+
+                return response_json
+
+        except Exception as e:
+            ERRORS.inc(component="query")
+            logger.exception("Error while querying: %s", e)
+            # Return a fallback response in case of any error
+            return {
+                "response": f"I encountered an error while processing your question. Please try again later.",
+                "questions": [
+                    "Can you try asking another question?",
+                    "Would you like to know about something else?",
+                    "Can you provide more details about what you're looking for?"
+                ]
+            }
+
+    def answer_in_background(self, query: str, persist_directory: str, where: Dict = None) -> Tuple[Dict, bool]:
+        """answer() for speculative follow-ups, which run outside of query()."""
+        with hot_notebook(persist_directory):
+            return self.answer(query, persist_directory, where)
+
+    def answer(self, query: str, persist_directory: str, where: Dict = None) -> Tuple[Dict, bool]:
+        """Returns the answer JSON and whether it was grounded in chunks from the notebook.
+
+        `where` restricts retrieval to some sources or pages (see filters.py).
+        """
+        db = get_vector_store(persist_directory)
+        def normalize_scores(results):
+            docs_with_scores = []
+            for doc, score in results:
+                # Convert negative cosine similarity to 0-1 range
+                normalized_score = (score + 1) / 2
+                docs_with_scores.append((doc, normalized_score))
+            return docs_with_scores
+
+        # Embed once and reuse the vector for both the chunk search and the topic lookup
+        raw_results, query_embedding = self.retrieve(db, query, persist_directory, k=3, where=where)
+        docs = normalize_scores(raw_results)
+
+        if not docs:
+            log_sampled(logger, logging.DEBUG, "No documents found for query in %s", persist_directory)
+            # Return a default JSON response when no context is found
+            return {
+                "response": "I couldn't find specific information to answer your question. Could you please provide more details or ask a different question?",
+                "questions": [
+                    "Can you rephrase your question?",
+                    "What specific aspect are you interested in learning about?",
+                    "Would you like information on a related topic instead?"
+                ]
+            }, False
+
+        with stage("prompt_build"):
             context = "\n\n".join([doc.page_content for doc, score in docs])
-            sources = [f"{doc.metadata.get('source', 'Unknown')} (Page {doc.metadata.get('page', 1) + 1})" for doc, score in docs]            
-            
-            prompt = f"""You are a chatbot to answer questions to help students learn.
+            sources = [
+                f"{doc.metadata.get('source', 'Unknown')} (Page {doc.metadata['page'] + 1})"
+                if isinstance(doc.metadata.get('page'), int) else doc.metadata.get('source', 'Unknown')
+                for doc, score in docs
+            ]
+            # Topic summaries cover the whole notebook, which would leak outside a scoped question
+            overview = self.topic_overview(query_embedding, persist_directory) if where is None else ""
+            prompt = self.build_query_prompt(query, context, overview)
+
+        with stage("llm", route="query"):
+            llm_response = self.llm.invoke(prompt)
+
+        with stage("json_parse"):
+            response_json = self.parse_query_response(llm_response.content)
+        response_json["sources"] = list(dict.fromkeys(sources))
+        return response_json, True
+
+    def search_by_vectors(self, db, persist_directory: str, embeddings: List[List[float]], k: int,
+                          where: Dict = None) -> List[Tuple[RetrievalResult, List[Tuple]]]:
+        """Same as similarity_search_with_relevance_scores, for already embedded queries.
+
+        Queries the collection directly because the LangChain wrapper drops chunk ids,
+        which the retrieval cache stores instead of the chunks themselves.
+        """
+        from langchain_core.documents import Document
+
+        scoped = self.scope_cache.search(db._collection, persist_directory, embeddings, k, where) if where else None
+        if scoped is not None:
+            # Small scope searched in memory; fetch just the winning chunks
+            found = db._collection.get(ids=list({chunk_id for ids, _ in scoped for chunk_id in ids}),
+                                       include=["documents", "metadatas"])
+            by_id = dict(zip(found["ids"], zip(found["documents"], found["metadatas"])))
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            for ids, distances in scoped:
+                results["ids"].append(ids)
+                results["documents"].append([by_id[chunk_id][0] for chunk_id in ids])
+                results["metadatas"].append([by_id[chunk_id][1] for chunk_id in ids])
+                results["distances"].append(distances)
+        else:
+            results = db._collection.query(
+                query_embeddings=embeddings,
+                n_results=k,
+                where=where,
+                include=["documents", "metadatas", "distances"],
+            )
+        relevance_score_fn = db._select_relevance_score_fn()
+        searches = []
+        for embedding, ids, texts, metadatas, distances in zip(
+            embeddings, results["ids"], results["documents"], results["metadatas"], results["distances"]
+        ):
+            scores = [relevance_score_fn(distance) for distance in distances]
+            docs = [
+                (Document(page_content=text, metadata=metadata or {}), score)
+                for text, metadata, score in zip(texts, metadatas, scores)
+            ]
+            searches.append((RetrievalResult(list(ids), scores, list(embedding)), docs))
+        return searches
+
+    def retrieve(self, db, query: str, persist_directory: str, k: int,
+                 where: Dict = None) -> Tuple[List[Tuple], List[float]]:
+        """Returns the top chunks with relevance scores and the query embedding, from the cache when possible."""
+        key = self.retrieval_cache.key(persist_directory, query, k, filter_key(where))
+        cached = self.retrieval_cache.get(key)
+        if cached is not None:
+            with stage("retrieval_cache"):
+                docs = self.retrieval_cache.documents(db, cached)
+            if docs is not None:
+                return docs, cached.embedding
+        with stage("embedding"):
+            query_embedding = self.embeddings.embed_query(query)
+        with stage("vector_search"):
+            result, docs = self.search_by_vectors(db, persist_directory, [query_embedding], k, where)[0]
+        self.retrieval_cache.put(key, result)
+        return docs, query_embedding
+
+    def precompute_retrieval(self, db, persist_directory: str, questions: List[str], k: int, where: Dict = None):
+        """Embeds and searches the suggested follow-up questions in the background."""
+        if not RETRIEVAL_PRECOMPUTE:
+            return
+
+        def search(queries: List[str]) -> List[RetrievalResult]:
+            vectors = self.embeddings.embed_documents(queries)
+            return [result for result, _ in self.search_by_vectors(db, persist_directory, vectors, k, where)]
+
+        keys = [self.retrieval_cache.key(persist_directory, question, k, filter_key(where)) for question in questions]
+        self.retrieval_cache.precompute(keys, questions, search)
+
+    def build_query_prompt(self, query: str, context: str, overview: str = "") -> str:
+        """Builds the question-answering prompt that asks for the JSON answer format."""
+        prompt = f"""You are a chatbot to answer questions to help students learn.
             Based on the following context, please answer the question. You only help with course material related things.
-            
+            {overview}
     Context:
     {context}
 
     Question: {query}
 
     Answer:"""
-            prompt += '''Generate a response to the following user query in clear and concise language.
+        prompt += '''Generate a response to the following user query in clear and concise language.
 
     Then, create exactly three follow-up questions that help the user can ask the bot again to better understand the topic.
 
@@ -319,106 +518,60 @@ class QueryEngine:
     ```
 
     IMPORTANT: Do not include any text, explanations, or content outside of the JSON structure.'''
+        return prompt
 
-            llm_response = self.llm.invoke(prompt)
-            
-            # Extract and validate JSON from the response
-            try:
-                # First try direct JSON parsing
-                response_json = json.loads(llm_response.content)
-            except json.JSONDecodeError:
-                # If that fails, use our extraction function
-                response_json = self.extract_json_from_text(llm_response.content)
-            
-            # Ensure the JSON has the expected structure
-            if not isinstance(response_json, dict):
-                response_json = {
-                    "response": "Error parsing response. Please try asking your question again.",
-                    "questions": [
-                        "Could you rephrase your question?",
-                        "What specific information are you looking for?",
-                        "Would you like to explore a different topic?"
-                    ]
-                }
-            
-            # Check for response key (note the field is "response" not "answer" in this case)
-            if "response" not in response_json:
-                response_json["response"] = "The system generated an incomplete response. Please try again."
-            
-            # Check for questions key
-            if "questions" not in response_json or not isinstance(response_json["questions"], list) or len(response_json["questions"]) != 3:
-                response_json["questions"] = [
-                    "Can you tell me more about this topic?",
-                    "What are the key concepts related to this?",
-                    "How can I apply this information?"
-                ]
-            
-            # Return the guaranteed valid JSON as a string
-            return json.dumps(response_json, ensure_ascii=False, indent=2)
-
-        except Exception as e:
-            print(f"Error while querying: {e}")
-            # Return a fallback JSON response in case of any error
-            return json.dumps({
-                "response": f"I encountered an error while processing your question. Please try again later.",
+    def parse_query_response(self, text: str) -> Dict:
+        """Extracts the answer JSON from the LLM output, repairing it into the expected shape."""
+        # Extract and validate JSON from the response
+        try:
+            # First try direct JSON parsing
+            response_json = json.loads(text)
+        except json.JSONDecodeError:
+            # If that fails, use our extraction function
+            response_json = self.extract_json_from_text(text)
+        
+        # Ensure the JSON has the expected structure
+        if not isinstance(response_json, dict):
+            response_json = {
+                "response": "Error parsing response. Please try asking your question again.",
                 "questions": [
-                    "Can you try asking another question?",
-                    "Would you like to know about something else?",
-                    "Can you provide more details about what you're looking for?"
+                    "Could you rephrase your question?",
+                    "What specific information are you looking for?",
+                    "Would you like to explore a different topic?"
                 ]
-            }, ensure_ascii=False, indent=2)
-
-    def generate_document(self, query_data: dict, persist_directory: str):
-        """Generate study materials based on document type and context."""
-        try:
-            document_type = query_data.get("document_type", "")
-            format_instructions = query_data.get("format", "")
-            class_id = query_data.get("classId", "")
-            
-            # Get context from the vector store
-            db = Chroma(
-                persist_directory=persist_directory,
-                embedding_function=self.embeddings
-            )
-
-            def normalize_scores(results):
-                docs_with_scores = []
-                for doc, score in results:
-                    # Convert cosine similarity to 0-1 range
-                    normalized_score = (score + 1) / 2
-                    docs_with_scores.append((doc, normalized_score))
-                return docs_with_scores
-            
-            # Retrieve relevant documents from the vector store (more context for document generation)
-            try:
-                # Try getting documents with relevance scores
-                raw_results = db.similarity_search_with_relevance_scores(document_type, k=5)
-                docs_with_scores = normalize_scores(raw_results)
-                print(docs_with_scores)
-                
-                # Filter docs with reasonable relevance (above 0.4 normalized score)
-                relevant_docs = [(doc, score) for doc, score in docs_with_scores if score > 0.4]
-                
-                # If no relevant docs found, fall back to regular search
-                if not relevant_docs:
-                    print("No highly relevant documents found, using regular search.")
-                    docs = db.similarity_search(document_type, k=5)
-                    docs_with_scores = [(doc, 0.5) for doc in docs]  # Assign default score
-                else:
-                    docs_with_scores = relevant_docs
-                    
-            except Exception as search_error:
-                print(f"Error during similarity search: {search_error}")
-                # Fall back to regular search without scores
-                docs = db.similarity_search(document_type, k=5)
-                docs_with_scores = [(doc, 0.5) for doc in docs]  # Assign default score
-            
-            # Extract context from documents
-            context = "\n\n".join([doc.page_content for doc, _ in docs_with_scores])
-            
-            # Create prompts based on document type
-            if document_type == "exam":
-                prompt = f"""You are an expert educator tasked with creating an exam for students.
+            }
+        
+        # Check for response key (note the field is "response" not "answer" in this case)
+        if "response" not in response_json:
+            response_json["response"] = "The system generated an incomplete response. Please try again."
+        
+        # Check for questions key
+        if "questions" not in response_json or not isinstance(response_json["questions"], list) or len(response_json["questions"]) != 3:
+            response_json["questions"] = [
+                "Can you tell me more about this topic?",
+                "What are the key concepts related to this?",
+                "How can I apply this information?"
+            ]
+        return response_json
+
+    def topic_overview(self, query_embedding: List[float], persist_directory: str) -> str:
+        """Returns the precomputed summary of the topic closest to the query, if the notebook has one."""
+        index = TopicIndex.load(persist_directory)
+        if not index.topics:
+            return ""
+        topics = index.nearest_topics(query_embedding)
+        summaries = "\n\n".join(topic["summary"] for topic in topics if topic.get("summary"))
+        if not summaries:
+            return ""
+        return f"""
+    Topic overview:
+    {summaries}
+"""
+
+    def build_document_prompt(self, document_type: str, context: str, format_instructions: str = "") -> str:
+        """Builds the generation prompt for the requested document type."""
+        if document_type == "exam":
+            prompt = f"""You are an expert educator tasked with creating an exam for students.
                 
     Context about the class material:
     {context}
@@ -430,8 +583,8 @@ class QueryEngine:
 
     Include an answer key at the bottom.
     """
-            elif document_type == "study_guide":
-                prompt = f"""You are an expert educator tasked with creating a study guide for students. You only help with course material related things. Don't talk about grading or anything non-academic related things.
+        elif document_type == "study_guide":
+            prompt = f"""You are an expert educator tasked with creating a study guide for students. You only help with course material related things. Don't talk about grading or anything non-academic related things.
                 
     Context about the class material:
     {context}
@@ -442,8 +595,8 @@ class QueryEngine:
     3. Practice questions with answers
     4. Study tips and strategies
     """
-            elif document_type == "briefing":
-                prompt = f"""You are an expert educator tasked with creating a briefing document. You only help with course material related things. Don't talk about grading or anything non-academic related things.
+        elif document_type == "briefing":
+            prompt = f"""You are an expert educator tasked with creating a briefing document. You only help with course material related things. Don't talk about grading or anything non-academic related things.
                 
     Context about the class material:
     {context}
@@ -454,8 +607,8 @@ class QueryEngine:
     3. Important relationships and connections
     4. Recommendations for further study
     """
-            elif document_type == "faq":
-                prompt = f"""You are an expert educator tasked with creating a FAQ document. 
+        elif document_type == "faq":
+            prompt = f"""You are an expert educator tasked with creating a FAQ document. 
                 
     Context about the class material:
     {context}
@@ -466,8 +619,8 @@ class QueryEngine:
     3. Challenging concepts explained clearly
     4. Application questions and answers
     """
-            elif document_type == "timeline":
-                prompt = f"""You are an expert educator tasked with creating a timeline document. You only help with course material related things. Don't talk about grading or anything non-academic related things.
+        elif document_type == "timeline":
+            prompt = f"""You are an expert educator tasked with creating a timeline document. You only help with course material related things. Don't talk about grading or anything non-academic related things.
                 
     Context about the class material:
     {context}
@@ -478,17 +631,78 @@ class QueryEngine:
     3. How concepts build upon each other
     4. Context for why each point matters
     """
-            else:
-                prompt = f"""You are an expert educator tasked with creating educational material. 
+        else:
+            prompt = f"""You are an expert educator tasked with creating educational material. 
                 
     Context about the class material:
     {context}
 
     Create helpful educational content based on this material.
     """
+        return prompt
+
+    def retrieve_document_context(self, db, document_type: str, where: Dict = None) -> str:
+        """Retrieves the top matching chunks for a document type as generation context."""
+        def normalize_scores(results):
+            docs_with_scores = []
+            for doc, score in results:
+                # Convert cosine similarity to 0-1 range
+                normalized_score = (score + 1) / 2
+                docs_with_scores.append((doc, normalized_score))
+            return docs_with_scores
+        
+        # Retrieve relevant documents from the vector store (more context for document generation)
+        try:
+            # Try getting documents with relevance scores
+            raw_results = db.similarity_search_with_relevance_scores(document_type, k=5, filter=where)
+            docs_with_scores = normalize_scores(raw_results)
             
-            llm_response = self.llm.invoke(prompt)
-            print(llm_response)
+            # Filter docs with reasonable relevance (above 0.4 normalized score)
+            relevant_docs = [(doc, score) for doc, score in docs_with_scores if score > 0.4]
+            
+            # If no relevant docs found, fall back to regular search
+            if not relevant_docs:
+                log_sampled(logger, logging.DEBUG, "No highly relevant documents found, using regular search.")
+                docs = db.similarity_search(document_type, k=5, filter=where)
+                docs_with_scores = [(doc, 0.5) for doc in docs]  # Assign default score
+            else:
+                docs_with_scores = relevant_docs
+                
+        except Exception as search_error:
+            logger.warning("Error during similarity search: %s", search_error)
+            # Fall back to regular search without scores
+            docs = db.similarity_search(document_type, k=5, filter=where)
+            docs_with_scores = [(doc, 0.5) for doc in docs]  # Assign default score
+        
+        # Extract context from documents
+        return "\n\n".join([doc.page_content for doc, _ in docs_with_scores])
+
+    def generate_document(self, query_data: dict, persist_directory: str) -> Dict:
+        """Generate study materials based on document type and context."""
+        try:
+            document_type = query_data.get("document_type", "")
+            format_instructions = query_data.get("format", "")
+            class_id = query_data.get("classId", "")
+            # Optionally scoped to some sources or pages
+            where = build_filter(query_data)
+            
+            # Get context from the vector store
+            db = get_vector_store(persist_directory)
+
+            mode = query_data.get("mode", GENERATION_MODE)
+            context = ""
+            with stage("document_context", mode=mode):
+                if mode == "map_reduce":
+                    # Cover every chunk of the notebook (or scope); unchanged clusters come from the summary cache
+                    context = self.map_reduce.build_context(db, persist_directory, where)
+                if not context:
+                    context = self.retrieve_document_context(db, document_type, where)
+            
+            with stage("prompt_build"):
+                prompt = self.build_document_prompt(document_type, context, format_instructions)
+            
+            with stage("llm", route="document"):
+                llm_response = self.document_llm.invoke(prompt)
             # Format response as JSON with type and content
             response_json = {
                 "type": document_type,
@@ -496,12 +710,13 @@ class QueryEngine:
                 "title": f"{document_type.capitalize()} Document"
             }
             
-            return json.dumps(response_json, ensure_ascii=False, indent=2)
+            return response_json
             
         except Exception as e:
-            print(f"Error generating document: {e}")
-            return json.dumps({
+            ERRORS.inc(component="generate_document")
+            logger.exception("Error generating document: %s", e)
+            return {
                 "type": query_data.get("document_type", "document"),
                 "content": f"Error generating document: {str(e)}",
                 "title": "Error Document"
-            }, ensure_ascii=False, indent=2)
\ No newline at end of file
+            }
\ No newline at end of file
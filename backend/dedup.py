@@ -0,0 +1,265 @@
+"""Near-duplicate chunk elimination at ingest, using MinHash signatures and LSH.
+
+Course uploads repeat a lot of text: the same slides in a deck and its handout, and
+the same header on every PDF page. Each chunk gets a MinHash signature of its word
+shingles. Chunks whose estimated Jaccard similarity to an already stored chunk (or an
+earlier chunk of the same upload) reaches DEDUP_THRESHOLD are not embedded again:
+the kept chunk records where the copies came from instead, in two metadata fields:
+
+    duplicates   number of copies collapsed into this chunk
+    also_in      JSON list of {"source", "page"} of those copies (first MAX_MERGED_SOURCES)
+
+plus one `also_in_<hash>` key per other source holding the copy's page, which source
+and page filters match on (see filters.py).
+
+Signatures live in data/<notebook>/dedup.npz next to the vector store.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from filters import ALSO_IN_PREFIX, NO_PAGE, also_in_key
+from metrics import DEDUP_CHUNKS
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+# Estimated Jaccard similarity of word shingles at which two chunks count as the same
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+DEDUP_INDEX_FILE = "dedup.npz"
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs above ~0.7 similarity almost always share a band
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_WORDS = 3
+MAX_MERGED_SOURCES = 32
+# Chunks hashed per numpy pass, bounding the (permutations x shingles) matrix
+SIGNATURE_BLOCK = 1000
+
+# Fixed seed: signatures must stay comparable across processes and restarts
+_rng = np.random.default_rng(0x5EED)
+# Multiply-shift hashing: h(x) = ((a * x + b) mod 2^64) >> 32 with odd a
+HASH_A = _rng.integers(0, 2 ** 64, NUM_PERMUTATIONS, dtype=np.uint64, endpoint=False) | np.uint64(1)
+HASH_B = _rng.integers(0, 2 ** 64, NUM_PERMUTATIONS, dtype=np.uint64, endpoint=False)
+BAND_MULTIPLIERS = _rng.integers(0, 2 ** 64, LSH_ROWS, dtype=np.uint64, endpoint=False) | np.uint64(1)
+# Recently used notebooks' indexes, reused while their file is unchanged
+CACHED_INDEXES = 8
+
+
+def shingles(text: str) -> List[int]:
+    words = re.sub(r"[^\w\s]", " ", text.casefold()).split()
+    if len(words) < SHINGLE_WORDS:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return [zlib.crc32(gram.encode("utf-8")) for gram in set(grams)]
+
+
+def minhash_signatures(texts: List[str]) -> np.ndarray:
+    """Returns one uint32 signature row per text."""
+    signatures = np.empty((len(texts), NUM_PERMUTATIONS), dtype=np.uint32)
+    for start in range(0, len(texts), SIGNATURE_BLOCK):
+        hashed = [shingles(text) for text in texts[start:start + SIGNATURE_BLOCK]]
+        offsets = np.cumsum([0] + [len(values) for values in hashed[:-1]])
+        values = np.fromiter((value for row in hashed for value in row), dtype=np.uint64)
+        # uint64 arithmetic wraps, which is the "mod 2^64" of the hash family
+        permuted = (HASH_A[:, None] * values[None, :] + HASH_B[:, None]) >> np.uint64(32)
+        signatures[start:start + len(hashed)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return signatures
+
+
+def band_hashes(signatures: np.ndarray) -> np.ndarray:
+    """One uint64 hash per band of each signature, shape (len(signatures), LSH_BANDS)."""
+    rows = signatures.reshape(len(signatures), LSH_BANDS, LSH_ROWS).astype(np.uint64)
+    return (rows * BAND_MULTIPLIERS).sum(axis=2, dtype=np.uint64)
+
+
+def record_source(target: Dict, key: str, page: int):
+    # Keep the first page the text appears on in that source
+    if key not in target or target[key] == NO_PAGE or NO_PAGE < page < target[key]:
+        target[key] = page
+
+
+def merge_metadata(target: Dict, duplicate: Dict):
+    """Records `duplicate` as another place the text of `target` appears."""
+    if duplicate.get("source") is not None and duplicate.get("source") != target.get("source"):
+        page = duplicate.get("page")
+        record_source(target, also_in_key(str(duplicate["source"])), page if isinstance(page, int) else NO_PAGE)
+    for key, page in duplicate.items():
+        if key.startswith(ALSO_IN_PREFIX):
+            record_source(target, key, page)
+    target.pop(also_in_key(str(target.get("source"))), None)
+    merged = json.loads(target.get("also_in", "[]"))
+    target["duplicates"] = target.get("duplicates", 0) + 1 + duplicate.get("duplicates", 0)
+    origin = {"source": duplicate.get("source"), "page": duplicate.get("page")}
+    copies = [origin] + json.loads(duplicate.get("also_in", "[]"))
+    for copy in copies:
+        if len(merged) >= MAX_MERGED_SOURCES:
+            break
+        if copy not in merged and copy != {"source": target.get("source"), "page": target.get("page")}:
+            merged.append(copy)
+    target["also_in"] = json.dumps(merged)
+
+
+class LSHTable:
+    """Signatures plus the band buckets that find candidate matches for a new one."""
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.signatures: List[np.ndarray] = []
+        # One dict per band: band hash -> positions of the signatures in that bucket
+        self.buckets: List[Dict[int, List[int]]] = [{} for _ in range(LSH_BANDS)]
+
+    def add(self, key: str, signature: np.ndarray, hashes: List[int]):
+        position = len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(signature)
+        for buckets, band_hash in zip(self.buckets, hashes):
+            buckets.setdefault(band_hash, []).append(position)
+
+    def add_all(self, keys: List[str], signatures: np.ndarray):
+        for key, signature, hashes in zip(keys, signatures, band_hashes(signatures).tolist()):
+            self.add(key, signature, hashes)
+
+    def match(self, signature: np.ndarray, hashes: List[int]) -> Optional[str]:
+        """Key of the most similar entry at or above DEDUP_THRESHOLD, if any."""
+        candidates = set()
+        for buckets, band_hash in zip(self.buckets, hashes):
+            candidates.update(buckets.get(band_hash, ()))
+        best, best_similarity = None, DEDUP_THRESHOLD
+        for position in candidates:
+            similarity = float(np.mean(self.signatures[position] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = position, similarity
+        return self.keys[best] if best is not None else None
+
+
+_indexes: "OrderedDict[str, Tuple[int, DedupIndex]]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+class DedupIndex:
+    """Per-notebook MinHash signatures of every stored chunk, keyed by chunk id."""
+
+    def __init__(self, persist_directory: str):
+        self.path = Path(persist_directory).parent / DEDUP_INDEX_FILE
+        self.table = LSHTable()
+
+    @classmethod
+    def load(cls, persist_directory: str) -> "DedupIndex":
+        index = cls(persist_directory)
+        if not index.path.exists():
+            return index
+        modified = index.path.stat().st_mtime_ns
+        with _indexes_lock:
+            cached = _indexes.get(str(index.path))
+            if cached is not None and cached[0] == modified:
+                _indexes.move_to_end(str(index.path))
+                return cached[1]
+        try:
+            with np.load(index.path) as data:
+                index.table.add_all(data["ids"].tolist(), data["signatures"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable dedup index %s: %s", index.path, e)
+            index.table = LSHTable()
+        index.remember()
+        return index
+
+    def remember(self):
+        with _indexes_lock:
+            _indexes[str(self.path)] = (self.path.stat().st_mtime_ns, self)
+            _indexes.move_to_end(str(self.path))
+            while len(_indexes) > CACHED_INDEXES:
+                _indexes.popitem(last=False)
+
+    def save(self):
+        tmp_path = self.path.with_name(f"{self.path.stem}.tmp.npz")
+        signatures = np.asarray(self.table.signatures, dtype=np.uint32).reshape(-1, NUM_PERMUTATIONS)
+        np.savez(tmp_path, ids=np.asarray(self.table.keys, dtype=str), signatures=signatures)
+        os.replace(tmp_path, self.path)
+        self.remember()
+
+    def add(self, ids: List[str], signatures: np.ndarray):
+        self.table.add_all(list(ids), signatures)
+
+    def forget(self, ids: Iterable[str]):
+        forgotten = set(ids)
+        keep = [position for position, chunk_id in enumerate(self.table.keys) if chunk_id not in forgotten]
+        table = LSHTable()
+        if keep:
+            table.add_all([self.table.keys[position] for position in keep],
+                          np.asarray([self.table.signatures[position] for position in keep]))
+        self.table = table
+
+    def deduplicate(self, db, chunks: List['Document']) -> Tuple[List['Document'], np.ndarray, Dict]:
+        """Drops near-duplicate chunks, folding their sources into the chunk that is kept.
+
+        Returns the chunks to store, their signatures (for `add` once they have ids) and
+        stats. Duplicates of chunks already in `db` update those chunks' metadata in place.
+        """
+        started = time.perf_counter()
+        signatures = minhash_signatures([chunk.page_content for chunk in chunks])
+        hashes = band_hashes(signatures).tolist()
+        # Resolve matches against stored chunks before touching any metadata, so chunks
+        # deleted behind the index's back can be forgotten and the lookup simply redone
+        while True:
+            matches = [self.table.match(signature, hashes[position]) for position, signature in enumerate(signatures)]
+            matched = list(dict.fromkeys(match for match in matches if match is not None))
+            found = db.get(ids=matched, include=["metadatas"]) if matched else {"ids": [], "metadatas": []}
+            missing = set(matched) - set(found["ids"])
+            if not missing:
+                break
+            logger.warning("Dedup index of %s lists %d missing chunks", self.path, len(missing))
+            self.forget(missing)
+
+        batch = LSHTable()
+        kept: List[int] = []
+        existing: Dict[str, List[Dict]] = {}
+        for position, (chunk, signature) in enumerate(zip(chunks, signatures)):
+            if matches[position] is not None:
+                existing.setdefault(matches[position], []).append(chunk.metadata)
+                continue
+            match = batch.match(signature, hashes[position])
+            if match is not None:
+                merge_metadata(chunks[int(match)].metadata, chunk.metadata)
+                continue
+            kept.append(position)
+            batch.add(str(position), signature, hashes[position])
+
+        if existing:
+            metadatas = []
+            for chunk_id, metadata in zip(found["ids"], found["metadatas"]):
+                metadata = dict(metadata or {})
+                for duplicate in existing[chunk_id]:
+                    merge_metadata(metadata, duplicate)
+                metadatas.append(metadata)
+            db._collection.update(ids=found["ids"], metadatas=metadatas)
+
+        merged = len(chunks) - len(kept)
+        DEDUP_CHUNKS.inc(len(kept), outcome="kept")
+        DEDUP_CHUNKS.inc(merged, outcome="merged")
+        stats = {
+            "chunks": len(chunks),
+            "kept": len(kept),
+            "merged_in_upload": merged - sum(len(copies) for copies in existing.values()),
+            "merged_into_existing": sum(len(copies) for copies in existing.values()),
+            "reduction": round(merged / len(chunks), 4) if chunks else 0.0,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+        return [chunks[position] for position in kept], signatures[kept], stats
@@ -0,0 +1,248 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# "torch" runs sentence-transformers, "onnx" runs an exported int8 model on ONNX Runtime
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Intra-op threads used for inference; 0 leaves the runtime's default (one per core)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Where the exported ONNX model and tokenizer are cached
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "models/all-MiniLM-L6-v2-onnx")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "true").lower() == "true"
+# all-MiniLM-L6-v2 was trained on, and sentence-transformers truncates to, 256 tokens
+EMBEDDING_MAX_TOKENS = 256
+ONNX_INPUTS = ["input_ids", "attention_mask", "token_type_ids"]
+# Worst-case cosine to the sentence-transformers vectors an exported model must reach.
+# The fp32 graph only differs by float rounding; int8 weights cost a little more.
+ONNX_FP32_MIN_COSINE = 0.9999
+ONNX_PARITY_MIN_COSINE = float(os.getenv("ONNX_PARITY_MIN_COSINE", "0.98"))
+# Checked on every export: short and long inputs, symbols, and one past the token limit
+PARITY_SENTENCES = [
+    "What is a binary search tree?",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The derivative of sin(x) is cos(x), and the integral of 1/x is ln|x| + C.",
+    "In 1789 the French Revolution began with the storming of the Bastille.",
+    "Explain the difference between mitosis and meiosis in two sentences.",
+    "A hash table gives O(1) average lookups; collisions are handled by chaining or open addressing.",
+    "Supply and demand curves intersect at the market equilibrium price and quantity.",
+    "Newton's second law: F = ma.",
+    "Page 4",
+    " ".join(["Unit testing checks each module in isolation before integration testing combines them."] * 30),
+]
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+_threads = EMBEDDING_THREADS
+
+
+def configure_threads(threads: int):
+    """Sets the inference thread count, e.g. to one worker's share of the cores."""
+    global _threads
+    _threads = threads
+    # Only touch torch if a model has loaded it; the ONNX backend does not need it
+    if threads > 0 and "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+
+def export_onnx_model(model_name: str = EMBEDDING_MODEL_NAME, model_dir: str = ONNX_MODEL_DIR,
+                      quantize: bool = ONNX_QUANTIZE) -> Path:
+    """Exports the transformer to ONNX (and int8) once; later starts reuse the files."""
+    output_dir = Path(model_dir)
+    model_path = output_dir / ("model.int8.onnx" if quantize else "model.onnx")
+    if model_path.exists() and (output_dir / "tokenizer.json").exists():
+        return model_path
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    logger.info("Exporting %s to ONNX in %s", model_name, output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["An example sentence to trace the model with."], return_tensors="pt")
+    input_names = [name for name in ONNX_INPUTS if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+
+    tmp_path = output_dir / f"model.{os.getpid()}.tmp.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            str(tmp_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            dynamo=False,
+        )
+    tokenizer.save_pretrained(str(output_dir))
+    quantized_path = output_dir / f"model.int8.{os.getpid()}.tmp.onnx"
+    try:
+        # A model that fails its parity check is never cached, so the next start retries
+        check_onnx_parity(model_name, model_dir, tmp_path, ONNX_FP32_MIN_COSINE)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(str(tmp_path), str(quantized_path), weight_type=QuantType.QInt8)
+            check_onnx_parity(model_name, model_dir, quantized_path, ONNX_PARITY_MIN_COSINE)
+            os.replace(quantized_path, model_path)
+            os.replace(tmp_path, output_dir / "model.onnx")
+        else:
+            os.replace(tmp_path, model_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        quantized_path.unlink(missing_ok=True)
+    return model_path
+
+
+def check_onnx_parity(model_name: str, model_dir: str, model_path: Path, min_cosine: float) -> float:
+    """Worst-case cosine between an ONNX model's vectors and sentence-transformers' on PyTorch.
+
+    Raises ValueError when it is below `min_cosine`.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(model_name, device="cpu").encode(PARITY_SENTENCES, normalize_embeddings=True)
+    candidate = OnnxEmbeddings(model_name, model_dir, model_path=model_path).encode(PARITY_SENTENCES)
+    worst = float((np.asarray(reference, dtype=np.float32) * candidate).sum(axis=1).min())
+    logger.info("ONNX parity of %s: worst-case cosine %.6f (minimum %.4f)", model_path.name, worst, min_cosine)
+    if worst < min_cosine:
+        raise ValueError(f"{model_path.name} differs from {model_name} on PyTorch: "
+                         f"worst-case cosine {worst:.6f} is below {min_cosine}")
+    return worst
+
+
+class OnnxEmbeddings:
+    """all-MiniLM-L6-v2 on ONNX Runtime, with the same mean pooling and normalisation.
+
+    Texts are sorted by token count and batched so each batch is padded only to its
+    own longest text, instead of running every text at the longest length.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, model_dir: str = ONNX_MODEL_DIR,
+                 quantize: bool = ONNX_QUANTIZE, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 model_path: Optional[Path] = None):
+        from tokenizers import Tokenizer
+
+        # An explicit model_path skips the export, e.g. to check a freshly exported file
+        self.model_path = model_path or export_onnx_model(model_name, model_dir, quantize)
+        self.tokenizer = Tokenizer.from_file(str(Path(model_dir) / "tokenizer.json"))
+        self.tokenizer.enable_truncation(EMBEDDING_MAX_TOKENS)
+        self.tokenizer.no_padding()
+        self.batch_size = batch_size
+        self.session_pid: Optional[int] = None
+        self.session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created per process: ONNX Runtime's thread pool does not survive a fork (see serve.py)
+        with self.session_lock:
+            if self.session_pid != os.getpid():
+                import onnxruntime
+
+                options = onnxruntime.SessionOptions()
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                if _threads > 0:
+                    options.intra_op_num_threads = _threads
+                options.inter_op_num_threads = 1
+                self._session = onnxruntime.InferenceSession(str(self.model_path), options, providers=["CPUExecutionProvider"])
+                self.input_names = {model_input.name for model_input in self._session.get_inputs()}
+                self.session_pid = os.getpid()
+            return self._session
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        session = self.session
+        encodings = self.tokenizer.encode_batch(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(encodings[i].ids))
+        result: Optional[np.ndarray] = None
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            length = max(len(encodings[i].ids) for i in indices)
+            input_ids = np.zeros((len(indices), length), dtype=np.int64)
+            attention_mask = np.zeros((len(indices), length), dtype=np.int64)
+            for row, i in enumerate(indices):
+                ids = encodings[i].ids
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = session.run(None, feeds)[0]
+
+            mask = attention_mask[:, :, None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            if result is None:
+                result = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            result[indices] = pooled
+        return result if result is not None else np.empty((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+def create_embeddings(backend: str = EMBEDDING_BACKEND):
+    if backend == "onnx":
+        return OnnxEmbeddings()
+    if backend == "torch":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        model = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_NAME,
+            encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE},
+        )
+        configure_threads(_threads)
+        return model
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def get_embeddings():
+    """Returns the process-wide embedding model, loading it on first use.
+
+    Loading sentence-transformers takes several seconds, so it is deferred until the
+    first request (or the startup warm-up) instead of happening at import time.
+    """
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            logger.info("Loading embedding model %s (%s backend)", EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+            _embeddings = create_embeddings()
+        return _embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the exported ONNX model against sentence-transformers.")
+    parser.add_argument("command", choices=["check-parity"])
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--min-cosine", type=float, default=ONNX_PARITY_MIN_COSINE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    model_path = export_onnx_model(args.model, args.model_dir, ONNX_QUANTIZE)
+    try:
+        check_onnx_parity(args.model, args.model_dir, model_path, args.min_cosine)
+    except ValueError as e:
+        logger.error("%s", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
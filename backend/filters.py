@@ -0,0 +1,179 @@
+"""Metadata filters that scope retrieval to some source files and/or a page range.
+
+Question and generate_document messages on /query/ may carry:
+
+    "sources": ["uploads/chapter3.pdf", ...]   paths as sent to /add_source/
+    "pages": [first, last]                     1-based and inclusive
+
+They become a Chroma `where` clause, resolved through Chroma's SQLite metadata index
+so only chunks inside the scope are scored, rather than filtering the top results of
+an unscoped search (which often leaves fewer than k). Only PDFs have pages, so a page
+range excludes other formats.
+
+Dedup (see dedup.py) keeps one copy of text repeated across sources, so a chunk can
+belong to sources other than its own `source`. Each of those is recorded as an
+`also_in_<hash>` key holding the copy's page (-1 without one), and a source scope
+matches either field. A text repeated on several pages of one source is matched by
+the first of those pages.
+
+Chroma pays for the metadata lookup and a filtered HNSW walk on every query, which
+for a narrow scope costs more than the search itself. A scoped conversation asks
+many questions of the same scope, so ScopeCache keeps the ids and embeddings of
+small scopes in memory per notebook version and searches them exactly with numpy;
+larger scopes go through Chroma's `where`.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from metrics import CACHE_HITS, CACHE_MISSES
+from vector_stores import notebook_version
+
+# Load environment variables
+load_dotenv()
+
+# Constants
+# add_source stores sources relative to the backend directory
+SOURCE_PREFIX = "../frontend/public/"
+# Metadata keys naming other sources a deduplicated chunk appears in
+ALSO_IN_PREFIX = "also_in_"
+# Page recorded for copies from sources without pages
+NO_PAGE = -1
+# Scopes with at most this many chunks are searched in memory
+SCOPE_MAX_CHUNKS = int(os.getenv("SCOPE_MAX_CHUNKS", "5000"))
+# Total chunks held by all cached scopes (384 float32 dimensions is 1.5 KB each)
+SCOPE_CACHE_CHUNKS = int(os.getenv("SCOPE_CACHE_CHUNKS", "50000"))
+
+
+class FilterError(ValueError):
+    pass
+
+
+def also_in_key(source: str) -> str:
+    """Metadata key marking a chunk as also appearing in `source`."""
+    return ALSO_IN_PREFIX + hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+
+
+def all_of(clauses: List[Dict]) -> Dict:
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def build_filter(message: Dict) -> Optional[Dict]:
+    """Returns the `where` clause for a message's sources and pages, or None when unscoped."""
+    clauses, values, page_range = [], [], None
+    sources = message.get("sources")
+    if sources:
+        if isinstance(sources, str):
+            sources = [sources]
+        if not all(isinstance(source, str) and source for source in sources):
+            raise FilterError("sources must be a list of file paths")
+        # Accept both the upload path and the stored path, e.g. for notebooks built by build_corpus.py
+        values = list(dict.fromkeys(
+            value for source in sources
+            for value in (source, source if source.startswith(SOURCE_PREFIX) else SOURCE_PREFIX + source)
+        ))
+        clauses.append({"source": {"$in": values}})
+
+    pages = message.get("pages")
+    if pages:
+        if (not isinstance(pages, (list, tuple)) or len(pages) != 2
+                or not all(isinstance(page, int) and page >= 1 for page in pages) or pages[0] > pages[1]):
+            raise FilterError("pages must be [first, last] with 1 <= first <= last")
+        # Page metadata is 0-based
+        page_range = (pages[0] - 1, pages[1] - 1)
+        clauses.append({"page": {"$gte": page_range[0]}})
+        clauses.append({"page": {"$lte": page_range[1]}})
+
+    if not clauses:
+        return None
+    if not values:
+        return all_of(clauses)
+    # Chunks kept from another source that also appear in a scoped one
+    copies = []
+    for value in values:
+        key = also_in_key(value)
+        if page_range is None:
+            copies.append({key: {"$gte": NO_PAGE}})
+        else:
+            copies.append({"$and": [{key: {"$gte": page_range[0]}}, {key: {"$lte": page_range[1]}}]})
+    return {"$or": [all_of(clauses)] + copies}
+
+
+def filter_key(where: Optional[Dict]) -> Optional[str]:
+    """Hashable form of a `where` clause, for cache keys."""
+    return json.dumps(where, sort_keys=True) if where else None
+
+
+class Scope(NamedTuple):
+    ids: List[str]
+    embeddings: np.ndarray
+
+
+def distances(space: str, embeddings: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Chroma's distance for the collection's space, shape (queries, embeddings)."""
+    if space == "cosine":
+        normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        normalized_queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        return 1.0 - normalized_queries @ normalized.T
+    if space == "ip":
+        return 1.0 - queries @ embeddings.T
+    # Chroma reports squared L2
+    return (
+        (queries ** 2).sum(axis=1, keepdims=True)
+        - 2.0 * queries @ embeddings.T
+        + (embeddings ** 2).sum(axis=1)[None, :]
+    )
+
+
+class ScopeCache:
+    def __init__(self, max_chunks: int = SCOPE_MAX_CHUNKS, cache_chunks: int = SCOPE_CACHE_CHUNKS):
+        self.max_chunks = max_chunks
+        self.cache_chunks = cache_chunks
+        # None marks a scope too large to hold, so it is not looked up again
+        self.entries: "OrderedDict[Tuple, Optional[Scope]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, collection, persist_directory: str, where: Dict) -> Optional[Scope]:
+        key = (persist_directory, notebook_version(persist_directory), filter_key(where))
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                CACHE_HITS.inc(cache="scope")
+                return self.entries[key]
+        CACHE_MISSES.inc(cache="scope")
+        found = collection.get(where=where, include=["embeddings"], limit=self.max_chunks + 1)
+        scope = None
+        if len(found["ids"]) <= self.max_chunks:
+            embeddings = found["embeddings"] if found["embeddings"] is not None else []
+            scope = Scope(list(found["ids"]), np.asarray(embeddings, dtype=np.float32).reshape(len(found["ids"]), -1))
+        with self.lock:
+            self.entries[key] = scope
+            held = sum(len(entry.ids) for entry in self.entries.values() if entry is not None)
+            while held > self.cache_chunks and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                held -= len(evicted.ids) if evicted is not None else 0
+        return scope
+
+    def search(self, collection, persist_directory: str, queries: List[List[float]], k: int,
+               where: Dict) -> Optional[List[Tuple[List[str], List[float]]]]:
+        """Exact top-k ids and distances per query within the scope, or None if it is too large."""
+        scope = self.get(collection, persist_directory, where)
+        if scope is None:
+            return None
+        if not scope.ids:
+            return [([], []) for _ in queries]
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        matrix = distances(space, scope.embeddings, np.asarray(queries, dtype=np.float32))
+        count = min(k, len(scope.ids))
+        results = []
+        for row in matrix:
+            top = np.argpartition(row, count - 1)[:count]
+            top = top[np.argsort(row[top])]
+            results.append(([scope.ids[i] for i in top], [float(row[i]) for i in top]))
+        return results
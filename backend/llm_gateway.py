@@ -0,0 +1,312 @@
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from metrics import CACHE_HITS, LLM_RETRIES
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "6000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# Completion tokens reserved up front; corrected from the reported usage afterwards
+EXPECTED_COMPLETION_TOKENS = 512
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# Fraction of each quota that batch calls (summaries) leave for interactive ones
+LLM_BATCH_RESERVE = float(os.getenv("LLM_BATCH_RESERVE", "0.3"))
+
+
+class LLMGatewayError(Exception):
+    """Raised when a completion cannot be obtained after all retries."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMResponse:
+    """Minimal stand-in for LangChain's AIMessage so callers can keep using `.content`."""
+
+    def __init__(self, content: str, usage: Optional[Dict] = None, model: str = ""):
+        self.content = content
+        self.usage = usage or {}
+        self.model = model
+
+    def __repr__(self):
+        return f"LLMResponse(model={self.model!r}, content={self.content!r})"
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0, deadline: Optional[float] = None, reserve: float = 0.0) -> Optional[float]:
+        """Blocks until `amount` tokens are available and returns the time spent waiting.
+
+        Returns None without taking anything if they would only be available after
+        `deadline` (a time.monotonic() value). With a `reserve`, waits until that many
+        tokens would still be left, so callers without one go first.
+        """
+        # A request larger than the whole bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        reserve = min(reserve, self.capacity - amount)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens - amount >= reserve:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount + reserve - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + delay > deadline:
+                return None
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount: float):
+        """Debits (or credits, if negative) tokens after the real cost is known."""
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+    def available(self) -> float:
+        with self.lock:
+            self.refill()
+            return self.tokens
+
+    @property
+    def saturation(self) -> float:
+        """Fraction of the bucket currently used up (1.0 means callers will have to wait)."""
+        with self.lock:
+            self.refill()
+            return 1.0 - max(self.tokens, 0.0) / self.capacity
+
+
+# One pooled HTTP client per upstream so every gateway reuses keep-alive connections
+_clients: Dict[str, httpx.Client] = {}
+_clients_lock = threading.Lock()
+
+
+def get_http_client(base_url: str) -> httpx.Client:
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = httpx.Client(
+                base_url=base_url,
+                timeout=LLM_TIMEOUT_SECONDS,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                ),
+            )
+        return _clients[base_url]
+
+
+class LLMGateway:
+    """Shared client for an OpenAI-compatible chat completions endpoint.
+
+    Requests are rate limited by request and token buckets matching the provider quota,
+    retried with jittered exponential backoff on 429/5xx, and identical prompts that are
+    already in flight are coalesced into a single upstream call.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str = GROQ_BASE_URL,
+        api_key: Optional[str] = None,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        max_retries: int = LLM_MAX_RETRIES,
+        temperature: float = 0.7,
+        share: Optional[float] = None,
+    ):
+        self.model_name = model_name
+        self.base_url = base_url
+        self.api_key = api_key if api_key is not None else os.getenv("GROQ_API_KEY", "")
+        self.max_retries = max_retries
+        self.temperature = temperature
+        self.client = get_http_client(base_url)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.set_share(rate_limit_share() if share is None else share)
+        self.in_flight: Dict[str, Future] = {}
+        self.in_flight_lock = threading.Lock()
+
+    def set_share(self, share: float):
+        """Limits this gateway to `share` of the quota, e.g. when several processes split it."""
+        self.request_bucket = TokenBucket(self.requests_per_minute * share)
+        self.token_bucket = TokenBucket(self.tokens_per_minute * share)
+
+    def estimate_tokens(self, prompt: str) -> float:
+        return len(prompt) / 4 + EXPECTED_COMPLETION_TOKENS
+
+    @property
+    def saturation(self) -> float:
+        """Fraction of the request or token quota currently used up, whichever is higher."""
+        return max(self.request_bucket.saturation, self.token_bucket.saturation)
+
+    def reserves(self, batch: bool) -> Tuple[float, float]:
+        """Request and token quota that a call must leave untouched."""
+        if not batch:
+            return 0.0, 0.0
+        return LLM_BATCH_RESERVE * self.request_bucket.capacity, LLM_BATCH_RESERVE * self.token_bucket.capacity
+
+    def is_saturated(self, prompt: str, batch: bool = False) -> bool:
+        """True when sending `prompt` now would have to wait for the rate limiter."""
+        request_reserve, token_reserve = self.reserves(batch)
+        estimate = min(self.estimate_tokens(prompt), self.token_bucket.capacity)
+        return (self.request_bucket.available() < 1 + request_reserve
+                or self.token_bucket.available() < estimate + token_reserve)
+
+    def invoke(self, prompt: str, deadline: Optional[float] = None, batch: bool = False) -> LLMResponse:
+        """Returns the completion for `prompt`, sharing the result with identical concurrent calls.
+
+        With a `deadline` (time.monotonic()), waits for the rate limiter and retries only
+        while they can start before it, so the caller can fall back to another backend.
+        `batch` calls only use the quota above LLM_BATCH_RESERVE, so they never hold up
+        interactive ones.
+        """
+        key = hashlib.sha1(f"{self.model_name}\0{self.temperature}\0{prompt}".encode("utf-8")).hexdigest()
+        with self.in_flight_lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+
+        if not leader:
+            CACHE_HITS.inc(cache="llm_coalesced")
+            return future.result()
+
+        try:
+            future.set_result(self.complete(prompt, deadline, batch))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+        return future.result()
+
+    def complete(self, prompt: str, deadline: Optional[float] = None, batch: bool = False) -> LLMResponse:
+        """Performs one rate-limited completion with retries."""
+        estimated_tokens = self.estimate_tokens(prompt)
+        request_reserve, token_reserve = self.reserves(batch)
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature,
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+        last_error: Optional[LLMGatewayError] = None
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket.acquire(1, deadline, request_reserve) is None:
+                raise LLMGatewayError(f"{self.base_url} request quota is used up until past the deadline", status_code=429)
+            if self.token_bucket.acquire(estimated_tokens, deadline, token_reserve) is None:
+                self.request_bucket.adjust(-1)
+                raise LLMGatewayError(f"{self.base_url} token quota is used up until past the deadline", status_code=429)
+            try:
+                response = self.client.post("/chat/completions", json=payload, headers=headers)
+            except httpx.TransportError as e:
+                last_error = LLMGatewayError(f"Transport error calling {self.base_url}: {e}")
+                retry_after = None
+            else:
+                if response.status_code == 200:
+                    data = response.json()
+                    usage = data.get("usage") or {}
+                    if "total_tokens" in usage:
+                        self.token_bucket.adjust(usage["total_tokens"] - estimated_tokens)
+                    return LLMResponse(
+                        data["choices"][0]["message"]["content"],
+                        usage=usage,
+                        model=data.get("model", self.model_name),
+                    )
+                last_error = LLMGatewayError(
+                    f"{self.base_url} returned {response.status_code}: {response.text[:200]}",
+                    status_code=response.status_code,
+                )
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise last_error
+                retry_after = self.parse_retry_after(response)
+
+            if attempt < self.max_retries:
+                delay = self.backoff_delay(attempt, retry_after)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    break
+                LLM_RETRIES.inc(status=str(last_error.status_code or "transport"))
+                logger.debug("Retrying %s after error: %s", self.base_url, last_error)
+                time.sleep(delay)
+        raise last_error
+
+    @staticmethod
+    def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def parse_retry_after(response: httpx.Response) -> Optional[float]:
+        value = response.headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+_gateways: Dict[Tuple[str, str], LLMGateway] = {}
+_gateways_lock = threading.Lock()
+# Fraction of every per-minute budget this process may use
+_share = 1.0
+
+
+def configure_rate_limits(share: float):
+    """Sets this process's share of every LLM quota, e.g. one of several workers' (see serve.py)."""
+    global _share
+    with _gateways_lock:
+        _share = share
+        for gateway in _gateways.values():
+            gateway.set_share(share)
+
+
+def rate_limit_share() -> float:
+    return _share
+
+
+def get_gateway(model_name: str, base_url: str = GROQ_BASE_URL, **kwargs) -> LLMGateway:
+    """Returns the process-wide gateway for a model so quotas are shared by all callers."""
+    with _gateways_lock:
+        key = (base_url, model_name)
+        if key not in _gateways:
+            _gateways[key] = LLMGateway(model_name, base_url=base_url, **kwargs)
+        return _gateways[key]
@@ -0,0 +1,222 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from llm_gateway import GROQ_BASE_URL, LLMGateway, LLMGatewayError, LLMResponse, get_gateway
+from metrics import ERRORS, LLM_FALLBACKS, LLM_SECONDS
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+LLM_QUERY_MODEL = os.getenv("LLM_QUERY_MODEL", "llama-3.1-8b-instant")
+LLM_DOCUMENT_MODEL = os.getenv("LLM_DOCUMENT_MODEL", "llama-3.3-70b-versatile")
+LLM_SUMMARY_MODEL = os.getenv("LLM_SUMMARY_MODEL", LLM_QUERY_MODEL)
+LLM_QUERY_SLO_SECONDS = float(os.getenv("LLM_QUERY_SLO_SECONDS", "4"))
+LLM_DOCUMENT_SLO_SECONDS = float(os.getenv("LLM_DOCUMENT_SLO_SECONDS", "45"))
+LLM_SUMMARY_SLO_SECONDS = float(os.getenv("LLM_SUMMARY_SLO_SECONDS", "15"))
+# Any OpenAI-compatible local server, e.g. `llama-server -m model.gguf --port 8080`; empty disables it
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "local")
+LOCAL_LLM_REQUESTS_PER_MINUTE = float(os.getenv("LOCAL_LLM_REQUESTS_PER_MINUTE", "600"))
+LOCAL_LLM_TOKENS_PER_MINUTE = float(os.getenv("LOCAL_LLM_TOKENS_PER_MINUTE", "1000000"))
+LATENCY_WINDOW = 50
+# How often a backend that is missing its SLO still gets a request to re-measure it
+PROBE_INTERVAL_SECONDS = 30.0
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Backend:
+    """One gateway as seen by a route, with its recent latencies."""
+
+    def __init__(self, name: str, gateway: LLMGateway):
+        self.name = name
+        self.gateway = gateway
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.last_probe = 0.0
+        self.lock = threading.Lock()
+
+    def p95(self) -> float:
+        with self.lock:
+            return percentile(list(self.latencies), 0.95)
+
+    def record(self, latency: float):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def should_probe(self) -> bool:
+        """Lets one request through periodically so a recovered backend gets noticed."""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_probe >= PROBE_INTERVAL_SECONDS:
+                self.last_probe = now
+                return True
+            return False
+
+
+class Route:
+    """Ordered fallback chain of backends sharing one latency SLO.
+
+    A `batch` route shares its models' quotas with interactive routes but only uses
+    what they leave (see LLM_BATCH_RESERVE).
+    """
+
+    def __init__(self, name: str, backends: List[Backend], slo_seconds: float, batch: bool = False):
+        self.name = name
+        self.backends = backends
+        self.slo_seconds = slo_seconds
+        self.batch = batch
+        self.latencies = deque(maxlen=LATENCY_WINDOW * 4)
+        self.counts = {"requests": 0, "fallbacks": 0, "errors": 0, "slo_violations": 0}
+        self.served_by: Dict[str, int] = {backend.name: 0 for backend in backends}
+        self.lock = threading.Lock()
+
+    def count(self, key: str):
+        with self.lock:
+            self.counts[key] += 1
+
+    def is_healthy(self, backend: Backend, prompt: str) -> bool:
+        if backend.gateway.is_saturated(prompt, self.batch):
+            return False
+        if backend.p95() > self.slo_seconds:
+            return backend.should_probe()
+        return True
+
+    def saturation(self) -> float:
+        """How full the rate limits of the least loaded backend are."""
+        return min(backend.gateway.saturation for backend in self.backends)
+
+    def invoke(self, prompt: str) -> LLMResponse:
+        """Sends the prompt to the first healthy backend, falling back down the chain on failure."""
+        self.count("requests")
+        started = time.monotonic()
+        healthy = [backend for backend in self.backends if self.is_healthy(backend, prompt)]
+        # If everything is saturated or slow, still try them all in preference order
+        candidates = healthy + [backend for backend in self.backends if backend not in healthy]
+
+        last_error: Optional[Exception] = None
+        for position, backend in enumerate(candidates):
+            if position > 0:
+                self.count("fallbacks")
+                LLM_FALLBACKS.inc(route=self.name, backend=backend.name)
+            # Only the last resort waits out rate limits and retries past the SLO; the
+            # others give up as soon as they could not answer within it
+            deadline = None if position == len(candidates) - 1 else started + self.slo_seconds
+            call_started = time.monotonic()
+            try:
+                response = backend.gateway.invoke(prompt, deadline=deadline, batch=self.batch)
+            except LLMGatewayError as e:
+                logger.warning("LLM route %s: %s failed: %s", self.name, backend.name, e)
+                backend.record(time.monotonic() - call_started)
+                ERRORS.inc(component="llm", backend=backend.name)
+                last_error = e
+                continue
+            backend.record(time.monotonic() - call_started)
+            LLM_SECONDS.observe(time.monotonic() - call_started, route=self.name, backend=backend.name)
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.latencies.append(elapsed)
+                self.served_by[backend.name] += 1
+                if elapsed > self.slo_seconds:
+                    self.counts["slo_violations"] += 1
+            return response
+
+        self.count("errors")
+        raise last_error
+
+    def stats(self) -> Dict:
+        with self.lock:
+            samples = list(self.latencies)
+            return {
+                **self.counts,
+                "slo_seconds": self.slo_seconds,
+                "p50_seconds": percentile(samples, 0.5),
+                "p95_seconds": percentile(samples, 0.95),
+                "served_by": dict(self.served_by),
+                "backend_p95_seconds": {backend.name: backend.p95() for backend in self.backends},
+            }
+
+
+class RoutedLLM:
+    """Binds a route name so callers can keep the `llm.invoke(prompt)` interface."""
+
+    def __init__(self, router: "LLMRouter", route: str):
+        self.router = router
+        self.route = route
+
+    def invoke(self, prompt: str) -> LLMResponse:
+        return self.router.invoke(prompt, route=self.route)
+
+
+class LLMRouter:
+    """Dispatches prompts by workload: short Q&A to a fast model, documents to a large one.
+
+    Each route falls back to the next backend (ultimately the local model, when
+    configured) if its preferred backend is rate limited, failing or missing the SLO.
+    """
+
+    def __init__(self):
+        local = None
+        if LOCAL_LLM_BASE_URL:
+            local = Backend("local", get_gateway(
+                LOCAL_LLM_MODEL,
+                base_url=LOCAL_LLM_BASE_URL,
+                api_key="local",
+                requests_per_minute=LOCAL_LLM_REQUESTS_PER_MINUTE,
+                tokens_per_minute=LOCAL_LLM_TOKENS_PER_MINUTE,
+                max_retries=1,
+            ))
+
+        def chain(*models: str) -> List[Backend]:
+            backends = []
+            for model in dict.fromkeys(models):
+                backends.append(Backend(f"groq:{model}", get_gateway(model, base_url=GROQ_BASE_URL)))
+            if local:
+                backends.append(local)
+            return backends
+
+        self.routes: Dict[str, Route] = {
+            "query": Route("query", chain(LLM_QUERY_MODEL), LLM_QUERY_SLO_SECONDS),
+            "document": Route("document", chain(LLM_DOCUMENT_MODEL, LLM_QUERY_MODEL), LLM_DOCUMENT_SLO_SECONDS),
+            # Map-reduce and topic summaries share the query model's quota, behind questions
+            "summary": Route("summary", chain(LLM_SUMMARY_MODEL), LLM_SUMMARY_SLO_SECONDS, batch=True),
+        }
+
+    def route(self, name: str) -> RoutedLLM:
+        if name not in self.routes:
+            raise ValueError(f"Unknown LLM route: {name}")
+        return RoutedLLM(self, name)
+
+    def invoke(self, prompt: str, route: str = "query") -> LLMResponse:
+        return self.routes[route].invoke(prompt)
+
+    def saturation(self, route: str = "query") -> float:
+        return self.routes[route].saturation()
+
+    def stats(self) -> Dict[str, Dict]:
+        return {name: route.stats() for name, route in self.routes.items()}
+
+
+_router: Optional[LLMRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> LLMRouter:
+    """Returns the process-wide router."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter()
+        return _router
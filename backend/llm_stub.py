@@ -0,0 +1,109 @@
+"""Local stand-in for the Groq chat completions API.
+
+Answers deterministically from the prompt, with configurable latency and a configurable
+fraction of 429 responses, so the LLM gateway and the rest of the backend can be
+exercised without network access or quota. Point the backend at it with
+GROQ_BASE_URL=http://127.0.0.1:8001/openai/v1.
+
+    python llm_stub.py --port 8001 --latency-ms 300 --rate-limit 0.1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+app = FastAPI()
+
+settings = {
+    "latency_ms": 200.0,
+    "jitter_ms": 50.0,
+    "rate_limit": 0.0,
+    "retry_after": 1.0,
+}
+stats = {"requests": 0, "completions": 0, "rate_limited": 0}
+
+
+def stub_completion(prompt: str) -> str:
+    """Builds a deterministic reply shaped like what the real prompts ask for."""
+    digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+    if '"questions"' in prompt:
+        return json.dumps({
+            "response": f"Stub answer {digest}.",
+            "questions": [f"Stub follow-up {digest} #{i}?" for i in range(1, 4)],
+        })
+    return f"# Stub document {digest}\n\n" + "\n".join(
+        f"{i}. Stub point {digest}-{i}" for i in range(1, 11)
+    )
+
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    stats["requests"] += 1
+    body = await request.json()
+    prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+
+    latency = max(0.0, random.gauss(settings["latency_ms"], settings["jitter_ms"])) / 1000
+    await asyncio.sleep(latency)
+
+    if random.random() < settings["rate_limit"]:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after": str(settings["retry_after"])},
+        )
+
+    stats["completions"] += 1
+    content = stub_completion(prompt)
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"stub-{stats['completions']}",
+        "object": "chat.completion",
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stub of the Groq chat completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=settings["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=settings["jitter_ms"])
+    parser.add_argument("--rate-limit", type=float, default=settings["rate_limit"],
+                        help="Fraction of requests answered with 429.")
+    parser.add_argument("--retry-after", type=float, default=settings["retry_after"])
+    args = parser.parse_args()
+
+    settings.update(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_limit=args.rate_limit,
+        retry_after=args.retry_after,
+    )
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
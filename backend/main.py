@@ -1,78 +1,188 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from typing import Dict, List, Tuple
-from query_data import query
-from typing import Dict
-from query_data import query  # Ensure query is now async
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+import asyncio
+from typing import Optional
+from query_data import CHROMA_PATH, query
 import uuid
 from database_manager import DocumentProcessor, QueryEngine
+from embeddings import get_embeddings
+from filters import FilterError, build_filter
+from llm_router import get_router
+import importlib
 import json
+import logging
+import os
+import tempfile
+import threading
 from pathlib import Path
+from protocol import decode, negotiate, receive, send, unpack_text
+from scheduler import Overloaded, get_scheduler
+from sessions import get_session_store
+from snapshot import (InvalidNotebookIdError, NotebookExistsError, SnapshotError, export_notebook, import_notebook,
+                      validate_notebook_id)
+from tiering import TIERING_SWEEP_SECONDS, sweep, tier_stats
+from metrics import REQUESTS, ERRORS, configure_logging, log_sampled, recent_traces, registry, stage, trace
 
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
-processor = DocumentProcessor("data")
-query_engine = QueryEngine()
+# "background" loads models on a thread once the server is up, "eager" finishes loading
+# before the first request is accepted, "off" defers everything to the first request
+WARMUP = os.getenv("WARMUP", "background")
+# Modules imported on first use that are worth pulling in during warm-up
+WARMUP_MODULES = [
+    "langchain_community.vectorstores",
+    "langchain_community.document_loaders",
+    "langchain.text_splitter",
+    "sklearn.cluster",
+]
+
+_query_engine: Optional[QueryEngine] = None
+_processor: Optional[DocumentProcessor] = None
+_engine_lock = threading.Lock()
+# Keeps a reference so the sweep task is not garbage collected
+_background_tasks = set()
+
+
+def get_query_engine() -> QueryEngine:
+    global _query_engine
+    with _engine_lock:
+        if _query_engine is None:
+            _query_engine = QueryEngine()
+        return _query_engine
+
+
+def get_processor() -> DocumentProcessor:
+    global _processor
+    with _engine_lock:
+        if _processor is None:
+            # Share the router so ingestion can keep each notebook's topic index up to date
+            _processor = DocumentProcessor("data", llm=get_router().route("summary"))
+        return _processor
 
-# Dictionary to store active WebSocket connections
-conversations: Dict[str, Tuple[WebSocket, List[str]]] = {}
 
-async def handle_websocket(conversation_id: str, websocket: WebSocket):
-    conversations[conversation_id] = (websocket, [])  # Ensure history is stored 
+def preload():
+    """Loads the embedding model and heavy libraries without running them.
 
+    serve.py calls this before forking workers so they share the loaded weights.
+    """
+    get_query_engine()
+    get_processor()
+    for module in WARMUP_MODULES:
+        importlib.import_module(module)
+    get_embeddings()
+
+
+def warm_up():
+    """Loads the embedding model and heavy libraries so the first request doesn't pay for them."""
     try:
-        while True:
-            data = await websocket.receive_text()
-            print(f"Received message: {data}")
+        with stage("warmup"):
+            preload()
+            get_embeddings().embed_query("warm-up")
+        logger.info("Warm-up finished.")
+    except Exception as e:
+        ERRORS.inc(component="warmup")
+        logger.exception("Warm-up failed: %s", e)
 
-            # Retrieve the history for this conversation
-            _, history = conversations[conversation_id]
+
+@app.on_event("startup")
+async def start_warm_up():
+    if WARMUP == "eager":
+        await asyncio.to_thread(warm_up)
+    elif WARMUP == "background":
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+async def sweep_periodically():
+    """Archives cold notebooks and closes idle vector stores (see tiering.py)."""
+    while True:
+        await asyncio.sleep(TIERING_SWEEP_SECONDS)
+        try:
+            result = await asyncio.to_thread(sweep, "data")
+            logger.info("Tiering sweep archived %d notebooks, closed %d stores",
+                        len(result["evicted"]), result["closed_stores"])
+        except Exception as e:
+            ERRORS.inc(component="tiering")
+            logger.exception("Tiering sweep failed: %s", e)
+
+
+@app.on_event("startup")
+async def start_tiering():
+    if TIERING_SWEEP_SECONDS > 0:
+        task = asyncio.create_task(sweep_periodically())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+# Conversation history lives in a shared store so any worker process can serve it
+sessions = get_session_store()
+
+async def handle_websocket(conversation_id: str, websocket: WebSocket, subprotocol: Optional[str] = None):
+    sessions.open(conversation_id)  # Ensure history is stored 
+
+    try:
+        while True:
+            data = unpack_text(await receive(websocket))
+            REQUESTS.inc(endpoint="ws", kind="chat")
+            log_sampled(logger, logging.DEBUG, "Received message on %s", conversation_id)
 
             # Append user input to history
-            history.append(f"User: {data}")
+            sessions.append(conversation_id, f"User: {data}")
+
+            # Retrieve the history for this conversation
+            history = sessions.history(conversation_id)
 
             # Construct full conversation context
             context = "This is the conversation so far:\n" + "\n".join(history) + "\nNow answer:\n" + data
 
-            # Query the bot with the conversation context
-            bot_response = query(context)
-
-            # Append bot response to history
-            history.append(f"Bot: {bot_response}")
+            # Query the bot with the conversation context, off the event loop like /query/:
+            # the LLM gateway sleeps while it waits for rate limits and retries
+            try:
+                bot_response = await get_scheduler().run("query", CHROMA_PATH, query, context)
+            except Overloaded:
+                bot_response = "The server is busy right now. Please try again in a few seconds."
+            else:
+                # Append bot response to history
+                sessions.append(conversation_id, f"Bot: {bot_response}")
 
-            await websocket.send_text(bot_response)
+            with stage("websocket_send"):
+                await send(websocket, bot_response, subprotocol)
             
     except WebSocketDisconnect:
-        del conversations[conversation_id]
-        print(f"Conversation {conversation_id} closed.")
+        sessions.close(conversation_id)
+        logger.info("Conversation %s closed.", conversation_id)
 
 
 @app.get("/conversation_history/{conversation_id}")
 async def get_conversation_history(conversation_id: str):
-    print("im getting called")
     """Retrieve the stored conversation history for a given conversation ID."""
-    if conversation_id in conversations:
-        _, history = conversations[conversation_id]
+    history = sessions.history(conversation_id)
+    if history is not None:
         return {"conversation_id": conversation_id, "history": history}
     return {"error": "Conversation not found"}
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    print("New WebSocket connection.")
-    await websocket.accept()
+    logger.info("New WebSocket connection.")
+    # JSON text unless the client offers the MessagePack subprotocol (see protocol.py)
+    subprotocol = negotiate(websocket)
+    await websocket.accept(subprotocol=subprotocol)
 
     # Generate a unique conversation ID for the connection
     conversation_id = str(uuid.uuid4())
-    print(f"Conversation ID generated: {conversation_id}")
+    logger.info("Conversation ID generated: %s", conversation_id)
     
-    await handle_websocket(conversation_id, websocket)
+    await handle_websocket(conversation_id, websocket, subprotocol)
 
 @app.websocket("/create/{notebook_id}")
 async def websocket_endpoint(websocket: WebSocket, notebook_id: str):
-    print(f"New WebSocket connection for notebook: {notebook_id}")
+    logger.info("New WebSocket connection for notebook: %s", notebook_id)
     await websocket.accept()
-    processor.create_new_notebook_folder_path(notebook_id)
-    print(f"Conversation ID generated: {notebook_id}")
+    get_processor().create_new_notebook_folder_path(notebook_id)
+    logger.info("Notebook folder created: %s", notebook_id)
     
 @app.websocket("/add_source/")
 async def add_source(websocket: WebSocket):
@@ -81,7 +191,7 @@ async def add_source(websocket: WebSocket):
     try:
         id_message = await websocket.receive_text()
         f_id = json.loads(id_message).get("data")
-        print(f"Received data for {f_id}")
+        logger.info("Adding sources to %s", f_id)
 
         # First message received should be the file path
         
@@ -89,57 +199,151 @@ async def add_source(websocket: WebSocket):
             # Receive data
             file_path_message = await websocket.receive_text()
             file_path = json.loads(file_path_message).get("file_path")
-            print(f"Received file path: {file_path}")
+            logger.info("Received file path: %s", file_path)
+            REQUESTS.inc(endpoint="add_source", kind="source")
 
-            
             # Add source to the notebook
-            processor.add_source(f_id, file_path)
+            # Parsing, embedding and the notebook locks all block, so keep them off the event loop
+            with stage("add_source"):
+                await asyncio.to_thread(get_processor().add_source, f_id, file_path)
 
             await websocket.send_text(f"Source added to {file_path}")
     except WebSocketDisconnect:
-        print(f"Connection closed.")
+        logger.info("Connection closed.")
 
 @app.websocket("/query/")
 async def query_websocket(websocket: WebSocket):
-    await websocket.accept()
+    subprotocol = negotiate(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    # Speculative follow-up answers are kept per connection
+    conversation_id = str(uuid.uuid4())
+    scheduler = get_scheduler()
 
     try:
-        id_message = await websocket.receive_text()
-        f_id = json.loads(id_message).get("data")
-        print(f"Received data for {f_id}")
+        f_id = decode(await receive(websocket)).get("data")
+        logger.info("Query connection opened for %s", f_id)
         
         while True:
             # Receive data
-            message = await websocket.receive_text()
-            parsed_message = json.loads(message)
+            parsed_message = decode(await receive(websocket))
             
             file_path = f"data/{f_id}/chroma"
             
             # Check if this is a document generation request or regular query
-            if "type" in parsed_message and parsed_message["type"] == "generate_document":
-                print(f"Generating document: {parsed_message['document_type']}")
-                response = query_engine.query(parsed_message, file_path)
-            else:
-                # Regular query
-                question = parsed_message.get("message", "")
-                print(f"Received query: {question}")
-                response = query_engine.query(question, file_path)
-            print("wd:", response)
-            await websocket.send_text(response)
+            # The scheduler queues both, questions first, and runs them off the event loop
+            with trace("query"):
+                try:
+                    if "type" in parsed_message and parsed_message["type"] == "generate_document":
+                        REQUESTS.inc(endpoint="query", kind="generate_document")
+                        logger.info("Generating document: %s", parsed_message.get("document_type"))
+                        response = await scheduler.run(
+                            "document", f_id,
+                            lambda: get_query_engine().query_response(parsed_message, file_path),
+                        )
+                    else:
+                        # Regular query
+                        REQUESTS.inc(endpoint="query", kind="question")
+                        question = parsed_message.get("message", "")
+                        log_sampled(logger, logging.DEBUG, "Received query of %d characters for %s", len(question), f_id)
+                        # Optional "sources"/"pages" scope the search (see filters.py)
+                        where = build_filter(parsed_message)
+                        response = await scheduler.run(
+                            "query", f_id,
+                            lambda: get_query_engine().query_response(
+                                question, file_path, conversation_id=conversation_id, where=where),
+                        )
+                except FilterError as e:
+                    response = {"error": str(e), "response": f"Invalid filter: {e}", "questions": []}
+                except Overloaded as e:
+                    response = {
+                        "error": "The server is busy, please try again shortly.",
+                        "response": "The server is busy right now. Please try again in a few seconds.",
+                        "questions": [],
+                        "retry_after": e.retry_after,
+                    }
+                with stage("websocket_send"):
+                    await send(websocket, response, subprotocol)
     except WebSocketDisconnect:
-        print(f"Connection closed.")
+        logger.info("Connection closed.")
     except Exception as e:
-        print(f"Error in websocket: {e}")
+        ERRORS.inc(component="websocket")
+        logger.exception("Error in websocket: %s", e)
         try:
-            error_response = json.dumps({
-                "error": f"An error occurred: {str(e)}"
-            })
-            await websocket.send_text(error_response)
+            await send(websocket, {"error": f"An error occurred: {str(e)}"}, subprotocol)
         except:
             pass
+    finally:
+        if _query_engine is not None and _query_engine.speculative:
+            _query_engine.speculative.discard(conversation_id)
+@app.get("/notebooks/{notebook_id}/snapshot")
+async def export_snapshot(notebook_id: str):
+    """Download a notebook as a snapshot file (see snapshot.py)."""
+    try:
+        validate_notebook_id(notebook_id)
+    except InvalidNotebookIdError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fd, path = tempfile.mkstemp(suffix=".examai")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(export_notebook, notebook_id, path)
+    except SnapshotError as e:
+        os.remove(path)
+        raise HTTPException(status_code=404, detail=str(e))
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        filename=f"{notebook_id}.examai",
+        background=BackgroundTask(os.remove, path),
+    )
+
+@app.post("/notebooks/{notebook_id}/snapshot")
+async def import_snapshot(notebook_id: str, request: Request, replace: bool = False):
+    """Restore a notebook from a snapshot file sent as the raw request body."""
+    try:
+        validate_notebook_id(notebook_id)
+    except InvalidNotebookIdError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fd, path = tempfile.mkstemp(suffix=".examai")
+    try:
+        with os.fdopen(fd, "wb") as upload:
+            async for chunk in request.stream():
+                upload.write(chunk)
+        return await asyncio.to_thread(import_notebook, path, notebook_id, replace=replace)
+    except NotebookExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except SnapshotError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.remove(path)
+
+@app.get("/llm_routes")
+async def get_llm_routes():
+    """Per-route LLM latency, SLO and fallback statistics."""
+    return get_router().stats()
+
+@app.get("/scheduler")
+async def get_scheduler_stats():
+    """Slots in use and queued requests in this worker."""
+    return get_scheduler().stats()
+
+@app.get("/tiering")
+async def get_tiering_stats():
+    """Notebooks and bytes on disk in the hot and cold storage tiers."""
+    return await asyncio.to_thread(tier_stats, "data")
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of the backend's metrics."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+async def get_traces():
+    """Most recent sampled request traces (see TRACE_SAMPLE_RATE)."""
+    return {"traces": list(recent_traces)}
+
 @app.get("/active_conversations")
 async def get_active_conversations():
-    return {"active_conversations": list(conversations.keys())}
+    return {"active_conversations": sessions.active()}
 
 @app.get("/")  # ✅ Keep this here, but don't reassign `app`
 async def root():
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from metrics import CACHE_HITS, CACHE_MISSES
+from vector_stores import notebook_lock
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+CHUNKS_PER_CLUSTER = 25
+MAX_CLUSTERS = int(os.getenv("MAP_REDUCE_MAX_CLUSTERS", "12"))
+MAX_PARALLEL_SUMMARIES = int(os.getenv("MAP_REDUCE_MAX_PARALLEL", "4"))
+# Map calls per generation; past this, the chunks farthest from their topic's centroid are left out
+MAX_MAP_CALLS = int(os.getenv("MAP_REDUCE_MAX_MAP_CALLS", "48"))
+MAX_CLUSTER_CHARS = 6000
+MAX_REDUCE_CHARS = 12000
+SUMMARY_CACHE_FILE = "summaries.json"
+# Summaries kept per notebook; a generation uses at most MAX_MAP_CALLS plus its reduce steps
+SUMMARY_CACHE_ENTRIES = int(os.getenv("MAP_REDUCE_SUMMARY_CACHE_ENTRIES", "500"))
+# Separate from the notebook write lock, which add_source already holds while the topic index saves
+SUMMARY_LOCK_FILE = "summaries.lock"
+
+SUMMARY_PROMPT = """You are an expert educator condensing course material for later use.
+
+Course material excerpts:
+{context}
+
+Write a dense summary of the material above. Keep every definition, key concept, formula,
+example and date that appears, grouped by topic. Do not add information that is not in the excerpts.
+Respond with the summary only."""
+
+
+def cluster_chunks(embeddings: np.ndarray, n_clusters: int) -> List[List[int]]:
+    """Groups chunk indices into topical clusters using k-means on their embeddings."""
+    if len(embeddings) <= n_clusters:
+        return [[i] for i in range(len(embeddings))]
+
+    from sklearn.cluster import KMeans
+
+    # A fixed seed keeps clusters (and therefore cache keys) stable between runs
+    kmeans = KMeans(n_clusters=n_clusters, n_init=4, random_state=0)
+    labels = kmeans.fit_predict(embeddings)
+
+    clusters = []
+    for label in range(n_clusters):
+        members = np.where(labels == label)[0]
+        if len(members) == 0:
+            continue
+        # Order members by distance to the centroid so the most representative come first
+        distances = np.linalg.norm(embeddings[members] - kmeans.cluster_centers_[label], axis=1)
+        clusters.append([int(i) for i in members[np.argsort(distances)]])
+    return clusters
+
+
+def cluster_count(n_chunks: int) -> int:
+    """Number of clusters to split a notebook of n_chunks into."""
+    return min(MAX_CLUSTERS, max(1, math.ceil(n_chunks / CHUNKS_PER_CLUSTER)))
+
+
+def select_representatives(members: List[int], texts: List[str], budget: int = MAX_CLUSTER_CHARS) -> List[int]:
+    """Keeps the chunks closest to the centroid until `budget` characters are used up."""
+    selected, total = [], 0
+    for i in members:
+        if selected and total + len(texts[i]) > budget:
+            break
+        selected.append(i)
+        total += len(texts[i])
+    return selected
+
+
+def map_call_shares(clusters: List[List[int]], texts: List[str], max_calls: int = MAX_MAP_CALLS) -> List[int]:
+    """Map calls each cluster gets: all it needs, or all of `max_calls` shared in proportion to need."""
+    needed = [max(1, math.ceil(sum(len(texts[i]) for i in members) / MAX_CLUSTER_CHARS)) for members in clusters]
+    if sum(needed) <= max_calls:
+        return needed
+    exact = [count * max_calls / sum(needed) for count in needed]
+    shares = [max(1, math.floor(share)) for share in exact]
+    # Largest remainders first, so rounding down does not leave calls unused
+    for k in sorted(range(len(needed)), key=lambda k: exact[k] - shares[k], reverse=True):
+        if sum(shares) >= max_calls:
+            break
+        if shares[k] < needed[k]:
+            shares[k] += 1
+    return shares
+
+
+def split_groups(ordered: List[int], texts: List[str], calls: int) -> List[List[int]]:
+    """Cuts chunks (in reading order) into at most `calls` consecutive groups of similar size.
+
+    Cuts fall at every 1/calls of the characters, so chunks that fit in calls * MAX_CLUSTER_CHARS
+    always fit in `calls` groups; a group may run over by part of one chunk.
+    """
+    total = max(1, sum(len(texts[i]) for i in ordered))
+    groups: List[List[int]] = [[] for _ in range(calls)]
+    offset = 0
+    for i in ordered:
+        # A chunk goes to the group its midpoint falls in
+        groups[min(calls - 1, int((offset + len(texts[i]) / 2) * calls / total))].append(i)
+        offset += len(texts[i])
+    return [group for group in groups if group]
+
+
+def chunk_position(metadata: Dict):
+    """Sort key that restores the original reading order of a chunk."""
+    return (
+        str(metadata.get("source", "")),
+        metadata.get("page", 0) or 0,
+        metadata.get("start_index", 0) or 0,
+    )
+
+
+class SummaryCache:
+    """Stores cluster summaries on disk next to a notebook's vector store.
+
+    Summaries are keyed by the content of the cluster they describe, so they are
+    shared by every document type and become stale automatically when sources change.
+    Stale ones are never asked for again, so only the SUMMARY_CACHE_ENTRIES most
+    recently used are kept.
+    """
+
+    def __init__(self, persist_directory: str):
+        self.persist_directory = persist_directory
+        self.path = Path(persist_directory).parent / SUMMARY_CACHE_FILE
+        self.lock = threading.Lock()
+        self.summaries, self.last_used = self.read()
+
+    def read(self) -> Tuple[Dict[str, str], Dict[str, float]]:
+        """Summaries and when each was last used, from {key: {"summary", "used"}} on disk."""
+        if not self.path.exists():
+            return {}, {}
+        try:
+            entries = json.loads(self.path.read_text(encoding="utf-8"))
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning("Ignoring unreadable summary cache %s: %s", self.path, e)
+            return {}, {}
+        summaries, last_used = {}, {}
+        for key, entry in entries.items():
+            # Files written before use times were tracked hold the summary alone
+            if isinstance(entry, str):
+                entry = {"summary": entry, "used": 0.0}
+            summaries[key] = entry["summary"]
+            last_used[key] = entry.get("used", 0.0)
+        return summaries, last_used
+
+    @staticmethod
+    def key_for(texts: List[str]) -> str:
+        digest = hashlib.sha1()
+        for text in texts:
+            digest.update(text.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is not None:
+                self.last_used[key] = time.time()
+            return summary
+
+    def put(self, key: str, summary: str):
+        with self.lock:
+            self.summaries[key] = summary
+            self.last_used[key] = time.time()
+
+    def save(self, max_entries: int = SUMMARY_CACHE_ENTRIES):
+        """Merges the cache into the file on disk, keeping the `max_entries` most recently used.
+
+        Other threads and worker processes save the same notebook's cache concurrently, so
+        the file is re-read and rewritten under a lock instead of being overwritten.
+        """
+        with self.lock, notebook_lock(self.persist_directory, SUMMARY_LOCK_FILE):
+            summaries, last_used = self.read()
+            summaries.update(self.summaries)
+            for key, used in self.last_used.items():
+                last_used[key] = max(used, last_used.get(key, 0.0))
+            keep = sorted(summaries, key=lambda key: last_used.get(key, 0.0), reverse=True)[:max_entries]
+            entries = {key: {"summary": summaries[key], "used": last_used.get(key, 0.0)} for key in keep}
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.path.parent,
+                                             prefix=f"{self.path.stem}.", suffix=".tmp", delete=False) as tmp_file:
+                json.dump(entries, tmp_file, ensure_ascii=False)
+            os.replace(tmp_file.name, self.path)
+            self.summaries = {key: entries[key]["summary"] for key in keep}
+            self.last_used = {key: entries[key]["used"] for key in keep}
+
+
+class MapReduceGenerator:
+    """Summarises a whole notebook cluster by cluster so generation can cover all of it."""
+
+    def __init__(self, llm, max_workers: int = MAX_PARALLEL_SUMMARIES):
+        self.llm = llm
+        self.max_workers = max_workers
+
+    def load_chunks(self, db, ids: List[str] = None, where: Dict = None):
+        """Reads chunks of a notebook (all of them by default) together with their stored embeddings."""
+        data = db.get(ids=ids, where=where, include=["documents", "metadatas", "embeddings"])
+        texts = data.get("documents") or []
+        metadatas = data.get("metadatas") or [{} for _ in texts]
+        embeddings = np.asarray(data.get("embeddings") if data.get("embeddings") is not None else [], dtype=np.float32)
+        return data.get("ids") or [], texts, metadatas, embeddings
+
+    def build_cluster_texts(self, texts: List[str], metadatas: List[Dict], embeddings: np.ndarray) -> List[List[str]]:
+        """Clusters the chunks and splits each cluster into map groups of texts in reading order.
+
+        A large cluster gets several map calls rather than being cut down to one prompt,
+        so every chunk is summarised unless the notebook needs more than MAX_MAP_CALLS.
+        """
+        clusters = cluster_chunks(embeddings, cluster_count(len(texts)))
+        groups = []
+        for members, calls in zip(clusters, map_call_shares(clusters, texts)):
+            if sum(len(texts[i]) for i in members) > calls * MAX_CLUSTER_CHARS:
+                # Over its share of the budget: the chunks least typical of the topic are left out
+                members = select_representatives(members, texts, calls * MAX_CLUSTER_CHARS)
+            ordered = sorted(members, key=lambda i: chunk_position(metadatas[i]))
+            groups.extend(split_groups(ordered, texts, calls))
+
+        # Present topics in the order they first appear in the material
+        groups.sort(key=lambda group: chunk_position(metadatas[group[0]]))
+        return [[texts[i] for i in group] for group in groups]
+
+    def summarise(self, texts: List[str], cache: SummaryCache) -> str:
+        key = SummaryCache.key_for(texts)
+        summary = cache.get(key)
+        if summary is not None:
+            CACHE_HITS.inc(cache="summary")
+        else:
+            CACHE_MISSES.inc(cache="summary")
+            prompt = SUMMARY_PROMPT.format(context="\n\n".join(texts))
+            summary = self.llm.invoke(prompt).content
+            cache.put(key, summary)
+        return summary
+
+    def summarise_all(self, groups: List[List[str]], cache: SummaryCache) -> List[str]:
+        """Summarises groups concurrently with at most max_workers LLM calls in flight."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda texts: self.summarise(texts, cache), groups))
+
+    def reduce(self, summaries: List[str], cache: SummaryCache) -> List[str]:
+        """Condenses summaries further until they fit in a single generation prompt."""
+        while len(summaries) > 1 and sum(len(s) for s in summaries) > MAX_REDUCE_CHARS:
+            groups, current, size = [], [], 0
+            for summary in summaries:
+                if current and size + len(summary) > MAX_CLUSTER_CHARS:
+                    groups.append(current)
+                    current, size = [], 0
+                current.append(summary)
+                size += len(summary)
+            groups.append(current)
+            if len(groups) == len(summaries):
+                # Every summary is already as large as a group; nothing left to merge
+                break
+            summaries = self.summarise_all(groups, cache)
+        return summaries
+
+    def build_context(self, db, persist_directory: str, where: Dict = None) -> str:
+        """Returns pre-digested context for the notebook's chunks, or those matching `where`.
+
+        Every chunk goes through a map call unless that takes more than MAX_MAP_CALLS, in
+        which case the chunks least typical of their topic are left out (and logged). Map
+        calls over unchanged chunks are served from the summary cache.
+        """
+        cache = SummaryCache(persist_directory)
+        _, texts, metadatas, embeddings = self.load_chunks(db, where=where)
+        if not texts:
+            return ""
+        groups = self.build_cluster_texts(texts, metadatas, embeddings)
+        summaries = self.reduce(self.summarise_all(groups, cache), cache)
+        mapped = sum(len(group) for group in groups)
+        if mapped < len(texts):
+            logger.warning("Map-reduce left out %d of %d chunks to stay within %d map calls.",
+                           len(texts) - mapped, len(texts), MAX_MAP_CALLS)
+        logger.info("Map-reduce summarised %d chunks in %d map calls into %d topic summaries.",
+                    mapped, len(groups), len(summaries))
+        cache.save()
+
+        return "\n\n".join(f"Topic {i + 1}:\n{summary}" for i, summary in enumerate(summaries))
@@ -0,0 +1,337 @@
+"""In-process metrics, request tracing and sampled logging for the backend.
+
+Metrics are rendered in the Prometheus text exposition format on GET /metrics. When
+serve.py runs several workers, each one publishes its values to a shared directory and
+whichever worker answers the scrape reports counters and histograms summed over all of
+them, and gauges per live worker (labelled `worker`).
+Tracing is opt-in (TRACE_SAMPLE_RATE) and keeps the most recent traces in memory.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Constants
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Libraries that log a line for every LLM call at INFO, burying everything else
+QUIET_LOGGERS = ["httpx", "httpcore"]
+# Fraction of hot-path debug messages that are actually emitted
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+# Fraction of requests that record per-stage trace spans
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+MAX_TRACES = 200
+METRIC_PREFIX = "exam_ai_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# How often a worker publishes its metrics for the others to report
+METRICS_PUBLISH_SECONDS = 5.0
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{escape_label(value)}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.values: Dict[LabelKey, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def snapshot(self) -> List:
+        with self.lock:
+            return [[key, value] for key, value in self.values.items()]
+
+    def merge(self, snapshots: Dict[int, List]) -> Dict[LabelKey, float]:
+        """Sums the workers' values."""
+        merged: Dict[LabelKey, float] = {}
+        for entries in snapshots.values():
+            for key, value in entries:
+                key = tuple(tuple(pair) for pair in key)
+                merged[key] = merged.get(key, 0.0) + value
+        return merged
+
+    def render(self, values: Optional[Dict[LabelKey, float]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        if values is None:
+            with self.lock:
+                values = dict(self.values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def merge(self, snapshots: Dict[int, List]) -> Dict[LabelKey, float]:
+        """Keeps each live worker's values apart; a sum of gauges rarely means anything."""
+        merged: Dict[LabelKey, float] = {}
+        for pid, entries in snapshots.items():
+            if not process_alive(pid):
+                continue
+            for key, value in entries:
+                merged[label_key({**dict(key), "worker": pid})] = value
+        return merged
+
+    def render(self, values: Optional[Dict[LabelKey, float]] = None) -> List[str]:
+        lines = super().render(values)
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.buckets = buckets
+        # label key -> (bucket counts, sum, count)
+        self.values: Dict[LabelKey, List] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = label_key(labels)
+        with self.lock:
+            entry = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self) -> List:
+        with self.lock:
+            return [[key, entry] for key, entry in self.values.items()]
+
+    def merge(self, snapshots: Dict[int, List]) -> Dict[LabelKey, List]:
+        """Sums the workers' bucket counts, sums and counts."""
+        merged: Dict[LabelKey, List] = {}
+        for entries in snapshots.values():
+            for key, (bucket_counts, total, count) in entries:
+                key = tuple(tuple(pair) for pair in key)
+                entry = merged.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], bucket_counts)]
+                entry[1] += total
+                entry[2] += count
+        return merged
+
+    def render(self, values: Optional[Dict[LabelKey, List]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        if values is None:
+            with self.lock:
+                values = {key: [list(entry[0]), entry[1], entry[2]] for key, entry in self.values.items()}
+        for key, (bucket_counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{format_labels(key, (('le', str(bound)),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{format_labels(key, (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # Set by configure_multiprocess in each worker of serve.py
+        self.directory: Optional[str] = None
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        metric = Counter(name, documentation)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        metric = Gauge(name, documentation)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def publish(self):
+        """Writes this process's values where the other workers can read them."""
+        data = {metric.name: metric.snapshot() for metric in self.metrics}
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def read_published(self) -> Dict[int, Dict]:
+        published = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    published[int(name[:-len(".json")])] = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.getLogger(__name__).warning("Skipping unreadable metrics file %s: %s", name, e)
+        return published
+
+    def render(self) -> str:
+        lines = []
+        if self.directory is None:
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        else:
+            # Exited workers' counters still count, as they would have in a single process
+            self.publish()
+            published = self.read_published()
+            for metric in self.metrics:
+                lines.extend(metric.render(metric.merge({pid: data.get(metric.name, []) for pid, data in published.items()})))
+        return "\n".join(lines) + "\n"
+
+    def configure_multiprocess(self, directory: str):
+        """Reports metrics summed over every process publishing to `directory`."""
+        self.directory = directory
+        self.publish()
+        threading.Thread(target=self.publish_periodically, name="metrics-publisher", daemon=True).start()
+
+    def publish_periodically(self):
+        while True:
+            time.sleep(METRICS_PUBLISH_SECONDS)
+            try:
+                self.publish()
+            except OSError as e:
+                logging.getLogger(__name__).warning("Could not publish metrics: %s", e)
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("stage_seconds", "Time spent in each stage of request handling.")
+LLM_SECONDS = registry.histogram("llm_seconds", "LLM call latency by route and backend.")
+REQUESTS = registry.counter("requests_total", "Websocket messages handled, by endpoint and kind.")
+ERRORS = registry.counter("errors_total", "Errors by component.")
+CACHE_HITS = registry.counter("cache_hits_total", "Cache hits by cache name.")
+CACHE_MISSES = registry.counter("cache_misses_total", "Cache misses by cache name.")
+LLM_FALLBACKS = registry.counter("llm_fallbacks_total", "Requests served by a fallback LLM backend, by route.")
+LLM_RETRIES = registry.counter("llm_retries_total", "Retried LLM calls by upstream status.")
+QUEUE_DEPTH = registry.gauge("queue_depth", "Requests waiting for a scheduler slot, by kind.")
+QUEUE_WAIT_SECONDS = registry.histogram("queue_wait_seconds", "Time requests waited for a scheduler slot, by kind.")
+REQUESTS_SHED = registry.counter("requests_shed_total", "Requests refused by the scheduler, by kind and reason.")
+DEDUP_CHUNKS = registry.counter("dedup_chunks_total", "Ingested chunks kept or merged into a near-duplicate.")
+SPECULATIVE_ANSWERS = registry.counter("speculative_answers_total", "Speculatively generated follow-up answers by outcome.")
+TIERING_EVICTIONS = registry.counter("tiering_evictions_total", "Cold notebooks archived.")
+TIERING_BYTES_SAVED = registry.counter("tiering_bytes_saved_total", "Bytes freed by archiving cold notebooks.")
+TIERING_NOTEBOOKS = registry.gauge("tiering_notebooks", "Notebooks per storage tier, as of the last sweep.")
+TIERING_BYTES = registry.gauge("tiering_bytes", "Bytes on disk per storage tier, as of the last sweep.")
+REHYDRATION_SECONDS = registry.histogram("rehydration_seconds", "Time to restore an archived notebook.")
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.time()
+        self.spans: List[Dict] = []
+
+    def add_span(self, name: str, start: float, duration: float, **attributes):
+        self.spans.append({
+            "name": name,
+            "offset_ms": round((start - self.started) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            **attributes,
+        })
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started": self.started,
+            "spans": self.spans,
+        }
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+recent_traces = deque(maxlen=MAX_TRACES)
+
+
+@contextmanager
+def trace(name: str):
+    """Records the spans of one request when it is picked by TRACE_SAMPLE_RATE."""
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        yield None
+        return
+    request_trace = Trace(name)
+    token = current_trace.set(request_trace)
+    try:
+        yield request_trace
+    finally:
+        current_trace.reset(token)
+        recent_traces.append(request_trace.to_dict())
+        logging.getLogger(__name__).debug("trace %s %s", request_trace.trace_id, request_trace.spans)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Times a stage into the stage histogram and, when tracing, into the current trace."""
+    start_wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=name)
+        request_trace = current_trace.get()
+        if request_trace is not None:
+            request_trace.add_span(name, start_wall, duration, **attributes)
+
+
+def log_sampled(logger: logging.Logger, level: int, message: str, *args):
+    """Logs a hot-path message for only LOG_SAMPLE_RATE of calls."""
+    if logger.isEnabledFor(level) and random.random() < LOG_SAMPLE_RATE:
+        logger.log(level, message, *args)
+
+
+def configure_logging():
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
@@ -0,0 +1,77 @@
+"""Wire encodings for the /query/ and /ws websockets.
+
+Clients that ask for nothing keep getting the same JSON text frames as before.
+A client can offer the MessagePack subprotocol when it opens the socket:
+
+    new WebSocket(url, ["examai.msgpack"])
+
+If msgpack is installed the server accepts it, and every response is sent as one
+binary frame holding the same object MessagePack-encoded (a dict on /query/, a
+string on /ws). Requests may be sent either way. Compression is left to the
+transport: uvicorn negotiates permessage-deflate with clients that offer it, which
+browsers do (see WS_PER_MESSAGE_DEFLATE in serve.py).
+"""
+import json
+import logging
+from typing import Any, List, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # optional: without it only JSON is offered
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MSGPACK_SUBPROTOCOL = "examai.msgpack"
+
+
+def negotiate(websocket: WebSocket) -> Optional[str]:
+    """The subprotocol to accept from those the client offered, or None for JSON."""
+    offered: List[str] = websocket.scope.get("subprotocols", [])
+    if MSGPACK_SUBPROTOCOL in offered and msgpack is not None:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def encode(payload: Any, subprotocol: Optional[str]) -> Union[str, bytes]:
+    if subprotocol == MSGPACK_SUBPROTOCOL:
+        return msgpack.packb(payload, use_bin_type=True)
+    if isinstance(payload, str):
+        return payload
+    if "error" in payload:
+        # Error frames have always been compact JSON; clients match on their prefix
+        return json.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, indent=2)
+
+
+async def send(websocket: WebSocket, payload: Any, subprotocol: Optional[str]):
+    data = encode(payload, subprotocol)
+    if isinstance(data, bytes):
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)
+
+
+async def receive(websocket: WebSocket) -> Union[str, bytes]:
+    """Next text or binary frame; raises WebSocketDisconnect like receive_text()."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    return message["text"] if message.get("text") is not None else message["bytes"]
+
+
+def decode(data: Union[str, bytes]) -> Any:
+    """Parses a structured request: JSON text, or MessagePack in a binary frame."""
+    if isinstance(data, bytes):
+        if msgpack is None:
+            raise ValueError("Binary frames need the examai.msgpack subprotocol")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def unpack_text(data: Union[str, bytes]) -> str:
+    """A plain-text request (the /ws chat), sent as text or as a MessagePack string."""
+    return decode(data) if isinstance(data, bytes) else data
@@ -1,20 +1,20 @@
 import asyncio
 import argparse
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_groq import ChatGroq
-from langchain.prompts import ChatPromptTemplate
+from llm_router import get_router
+from metrics import log_sampled
+from vector_stores import get_vector_store
+import logging
 import os
 from dotenv import load_dotenv
-import sys
 
 # Load environment variables
 load_dotenv()
+logger = logging.getLogger(__name__)
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 if not GROQ_API_KEY:
-    print("Error: GROQ_API_KEY not found in environment variables")
-    sys.exit(1)
+    # Not fatal at import time: a local fallback model may still serve requests
+    logger.warning("GROQ_API_KEY not found in environment variables")
 
 CHROMA_PATH = "AllDocsDB/chroma"
 
@@ -28,36 +28,22 @@ Answer the question based only on the following context:
 Answer the question based on the above context in a concise manner: {question}
 """
 
-def query_groq(prompt, model_name="mixtral-8x7b-32768"):
-    """Separate function to handle Groq API calls"""
+def query_groq(prompt, route="query"):
+    """Separate function to handle LLM calls through the shared router"""
     try:
-        model = ChatGroq(
-            model_name=model_name,
-            groq_api_key=GROQ_API_KEY
-        )
-        return model.invoke(prompt)
+        return get_router().invoke(prompt, route=route)
     except Exception as e:
-        available_models = [
-            "mixtral-8x7b-32768",
-            "llama2-70b-4096",
-            "gemma-7b-it"
-        ]
-        error_msg = f"\nError accessing Groq API: {str(e)}"
-        error_msg += "\n\nAvailable Groq models include:"
-        for model in available_models:
-            error_msg += f"\n- {model}"
+        error_msg = f"\nError accessing the LLM route '{route}': {str(e)}"
+        error_msg += "\n\nConfigured backends:"
+        for backend in get_router().routes[route].backends:
+            error_msg += f"\n- {backend.name}"
         raise Exception(error_msg)
 
 def query(query_text=""):
-    embedding_function = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
-    )
-    embedding_function = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
-    )
-    
+    from langchain.prompts import ChatPromptTemplate
+
     # Use asyncio to run the Chroma similarity search asynchronously (if possible, offload to thread)
-    db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
+    db = get_vector_store(CHROMA_PATH)
 
     # Perform similarity search (This might be blocking and should be async or offloaded)
     results = db.similarity_search_with_relevance_scores(query_text, k=3, score_threshold=.5)
@@ -86,10 +72,10 @@ Your response **must** be formatted as **valid JSON** with the **exact** structu
     "<follow_up_question_3>"
   ]
 }'''
-    print("\nGenerated Prompt:", prompt)
+    log_sampled(logger, logging.DEBUG, "Generated prompt of %d characters", len(prompt))
 
 
-    response_text = query_groq(prompt, model_name="mixtral-8x7b-32768")
+    response_text = query_groq(prompt)
 
     # Extract sources from metadata
     sources = [doc.metadata.get("source", "Unknown") for doc, _ in results]
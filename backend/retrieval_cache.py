@@ -0,0 +1,113 @@
+"""Exact-match cache of vector search results, keyed by notebook version and query.
+
+Entries hold only chunk ids, relevance scores and the query embedding, so a hit
+skips both embedding and the vector search and costs one lookup by id. Writing to
+a notebook bumps its version (see vector_stores.py), which retires old entries.
+"""
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from metrics import CACHE_HITS, CACHE_MISSES, ERRORS
+from vector_stores import notebook_version
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "4096"))
+# Search the suggested follow-up questions in the background after each answer
+RETRIEVAL_PRECOMPUTE = os.getenv("RETRIEVAL_PRECOMPUTE", "true").lower() == "true"
+# Precompute jobs beyond this many waiting are dropped rather than queued
+MAX_PENDING_PRECOMPUTES = 32
+
+
+class RetrievalResult(NamedTuple):
+    ids: List[str]
+    scores: List[float]
+    embedding: List[float]
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query.casefold()).strip(" ?!.")
+
+
+class RetrievalCache:
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, RetrievalResult]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-precompute")
+        self.pending = 0
+
+    def key(self, persist_directory: str, query: str, k: int, filters: Hashable = None) -> Tuple:
+        return (persist_directory, notebook_version(persist_directory), normalize_query(query), k, filters)
+
+    def get(self, key: Tuple) -> Optional[RetrievalResult]:
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+        if result is None:
+            CACHE_MISSES.inc(cache="retrieval")
+        else:
+            CACHE_HITS.inc(cache="retrieval")
+        return result
+
+    def put(self, key: Tuple, result: RetrievalResult):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def contains(self, key: Tuple) -> bool:
+        with self.lock:
+            return key in self.entries
+
+    @staticmethod
+    def documents(db, result: RetrievalResult) -> Optional[List[Tuple]]:
+        """Loads the cached chunks by id as (document, score) pairs, or None if any are gone."""
+        from langchain_core.documents import Document
+
+        if not result.ids:
+            return []
+        found = db.get(ids=result.ids, include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: Document(page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        if len(by_id) != len(result.ids):
+            return None
+        return [(by_id[chunk_id], score) for chunk_id, score in zip(result.ids, result.scores)]
+
+    def precompute(self, keys: List[Tuple], queries: List[str], search: Callable[[List[str]], List[RetrievalResult]]):
+        """Runs `search` for the queries not yet cached on a background thread."""
+        missing = [(key, query) for key, query in zip(keys, queries) if not self.contains(key)]
+        if not missing:
+            return
+        with self.lock:
+            if self.pending >= MAX_PENDING_PRECOMPUTES:
+                return
+            self.pending += 1
+
+        def run():
+            try:
+                results = search([query for _, query in missing])
+                for (key, _), result in zip(missing, results):
+                    self.put(key, result)
+            except Exception as e:
+                ERRORS.inc(component="retrieval_precompute")
+                logger.warning("Precomputing follow-up retrieval failed: %s", e)
+            finally:
+                with self.lock:
+                    self.pending -= 1
+
+        self.executor.submit(run)
@@ -0,0 +1,244 @@
+"""Admission control in front of QueryEngine.
+
+Every /query/ request takes a slot before it runs, so a class generating documents
+in bulk cannot take over the LLM quota and the worker threads:
+
+- Interactive questions are always dispatched before document generation, and
+  documents may hold at most SCHEDULER_MAX_DOCUMENT_SLOTS of the slots.
+- Speculative answers to suggested follow-ups (see speculative.py) go last and may
+  hold at most SCHEDULER_MAX_SPECULATIVE_SLOTS.
+- Within each kind, notebooks take turns, and a notebook runs at most
+  SCHEDULER_NOTEBOOK_SLOTS requests at once.
+- Queues are bounded: a notebook over its quota is refused, a full queue sheds
+  queued lower-priority requests to make room for higher ones, and requests that
+  wait longer than their kind's limit are dropped.
+
+Limits apply per worker process (see serve.py).
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Optional
+
+from dotenv import load_dotenv
+
+from metrics import QUEUE_DEPTH, QUEUE_WAIT_SECONDS, REQUESTS_SHED
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", "4"))
+SCHEDULER_MAX_DOCUMENT_SLOTS = int(os.getenv("SCHEDULER_MAX_DOCUMENT_SLOTS", "2"))
+SCHEDULER_MAX_SPECULATIVE_SLOTS = int(os.getenv("SCHEDULER_MAX_SPECULATIVE_SLOTS", "1"))
+SCHEDULER_NOTEBOOK_SLOTS = int(os.getenv("SCHEDULER_NOTEBOOK_SLOTS", "2"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "64"))
+SCHEDULER_NOTEBOOK_QUEUE = int(os.getenv("SCHEDULER_NOTEBOOK_QUEUE", "16"))
+QUERY_MAX_WAIT_SECONDS = float(os.getenv("QUERY_MAX_WAIT_SECONDS", "15"))
+DOCUMENT_MAX_WAIT_SECONDS = float(os.getenv("DOCUMENT_MAX_WAIT_SECONDS", "120"))
+# Dispatch order: earlier kinds always go first
+KINDS = ["query", "document", "speculative"]
+
+
+def decrement(counter: Counter, key: str):
+    # Drop keys at zero so connections and notebooks that come and go do not accumulate
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being run."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, kind: str, notebook: str):
+        self.kind = kind
+        self.notebook = notebook
+        self.enqueued = time.monotonic()
+        self.granted = asyncio.get_running_loop().create_future()
+
+
+class Scheduler:
+    def __init__(self, slots: int = SCHEDULER_SLOTS, max_document_slots: int = SCHEDULER_MAX_DOCUMENT_SLOTS,
+                 max_speculative_slots: int = SCHEDULER_MAX_SPECULATIVE_SLOTS,
+                 notebook_slots: int = SCHEDULER_NOTEBOOK_SLOTS, max_queue: int = SCHEDULER_MAX_QUEUE,
+                 notebook_queue: int = SCHEDULER_NOTEBOOK_QUEUE):
+        self.slots = slots
+        self.kind_slots = {
+            "query": slots,
+            "document": min(max_document_slots, slots),
+            "speculative": min(max_speculative_slots, slots),
+        }
+        # A speculative answer is only useful before the student asks the next question
+        self.max_wait = {"query": QUERY_MAX_WAIT_SECONDS, "document": DOCUMENT_MAX_WAIT_SECONDS,
+                         "speculative": QUERY_MAX_WAIT_SECONDS}
+        self.notebook_slots = notebook_slots
+        self.max_queue = max_queue
+        self.notebook_queue = notebook_queue
+        # Set on first use, so threads can submit work with submit()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # kind -> notebook -> FIFO of tickets; the notebook order rotates for round-robin
+        self.waiting: Dict[str, "OrderedDict[str, Deque[Ticket]]"] = {kind: OrderedDict() for kind in KINDS}
+        self.running = 0
+        self.running_by_kind: Counter = Counter()
+        self.running_by_notebook: Counter = Counter()
+        self.queued_by_notebook: Counter = Counter()
+
+    @property
+    def queued(self) -> int:
+        return sum(self.queued_by_notebook.values())
+
+    async def run(self, kind: str, notebook: str, func: Callable, *args, **kwargs) -> Any:
+        """Waits for a slot, then runs the blocking `func` on a worker thread."""
+        self.loop = asyncio.get_running_loop()
+        ticket = self.admit(kind, notebook)
+        try:
+            await self.wait(ticket)
+        except BaseException:
+            self.abandon(ticket)
+            raise
+        # The slot is held until the thread finishes, even if this request is cancelled
+        job = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+        job.add_done_callback(lambda _: self.release(ticket))
+        return await asyncio.shield(job)
+
+    def submit(self, kind: str, notebook: str, func: Callable, *args, **kwargs) -> Future:
+        """run() for callers on other threads, e.g. follow-up work started by a request.
+
+        Cancelling the returned future gives up the request's place in the queue, but a
+        job that has already started runs to completion.
+        """
+        if self.loop is None or self.loop.is_closed():
+            raise RuntimeError("The scheduler is not running on an event loop")
+        return asyncio.run_coroutine_threadsafe(self.run(kind, notebook, func, *args, **kwargs), self.loop)
+
+    def admit(self, kind: str, notebook: str) -> Ticket:
+        if self.queued_by_notebook[notebook] >= self.notebook_queue:
+            self.shed(kind, "notebook_quota")
+        if self.queued >= self.max_queue and not self.displace(kind):
+            self.shed(kind, "queue_full")
+
+        ticket = Ticket(kind, notebook)
+        self.waiting[kind].setdefault(notebook, deque()).append(ticket)
+        self.queued_by_notebook[notebook] += 1
+        self.dispatch()
+        return ticket
+
+    async def wait(self, ticket: Ticket):
+        if not ticket.granted.done():
+            await asyncio.wait({ticket.granted}, timeout=self.max_wait[ticket.kind])
+        if ticket.granted.cancelled():
+            # Displaced by a higher-priority request while queued
+            raise Overloaded("displaced", self.retry_after())
+        if not ticket.granted.done():
+            self.shed(ticket.kind, "timeout")
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - ticket.enqueued, kind=ticket.kind)
+
+    def abandon(self, ticket: Ticket):
+        """Cleans up after a request that timed out, was displaced or whose connection closed."""
+        if ticket.granted.done() and not ticket.granted.cancelled():
+            # The slot was granted just before the request gave up
+            self.release(ticket)
+            return
+        self.dequeue(ticket)
+
+    def dispatch(self):
+        """Grants free slots, questions first and notebooks in turn."""
+        while self.running < self.slots:
+            ticket = self.next_ticket()
+            if ticket is None:
+                break
+            decrement(self.queued_by_notebook, ticket.notebook)
+            self.running += 1
+            self.running_by_kind[ticket.kind] += 1
+            self.running_by_notebook[ticket.notebook] += 1
+            ticket.granted.set_result(None)
+        self.update_gauges()
+
+    def next_ticket(self) -> Optional[Ticket]:
+        for kind in KINDS:
+            if self.running_by_kind[kind] >= self.kind_slots[kind]:
+                continue
+            notebooks = self.waiting[kind]
+            for notebook in list(notebooks):
+                if self.running_by_notebook[notebook] >= self.notebook_slots:
+                    continue
+                tickets = notebooks[notebook]
+                ticket = tickets.popleft()
+                # Move the notebook to the back so the others go next
+                del notebooks[notebook]
+                if tickets:
+                    notebooks[notebook] = tickets
+                return ticket
+        return None
+
+    def release(self, ticket: Ticket):
+        self.running -= 1
+        decrement(self.running_by_kind, ticket.kind)
+        decrement(self.running_by_notebook, ticket.notebook)
+        self.dispatch()
+
+    def dequeue(self, ticket: Ticket):
+        tickets = self.waiting[ticket.kind].get(ticket.notebook)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self.waiting[ticket.kind][ticket.notebook]
+            decrement(self.queued_by_notebook, ticket.notebook)
+        self.update_gauges()
+
+    def displace(self, kind: str) -> bool:
+        """Drops the most recently queued request of the lowest kind below `kind` to make room."""
+        for lower in reversed(KINDS[KINDS.index(kind) + 1:]):
+            queued = [ticket for tickets in self.waiting[lower].values() for ticket in tickets]
+            if not queued:
+                continue
+            newest = max(queued, key=lambda ticket: ticket.enqueued)
+            self.dequeue(newest)
+            newest.granted.cancel()
+            REQUESTS_SHED.inc(kind=lower, reason="displaced")
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        # Rough time for the queue ahead to drain, assuming a few seconds per request
+        return round(max(1.0, self.queued / max(self.slots, 1) * QUERY_MAX_WAIT_SECONDS / 4), 1)
+
+    def shed(self, kind: str, reason: str):
+        REQUESTS_SHED.inc(kind=kind, reason=reason)
+        logger.warning("Shedding %s request: %s (%d queued, %d running)", kind, reason, self.queued, self.running)
+        raise Overloaded(reason, self.retry_after())
+
+    def update_gauges(self):
+        for kind in KINDS:
+            QUEUE_DEPTH.set(sum(len(tickets) for tickets in self.waiting[kind].values()), kind=kind)
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "queued": {kind: sum(len(tickets) for tickets in self.waiting[kind].values()) for kind in KINDS},
+            "running_by_kind": dict(self.running_by_kind),
+            "slots": self.slots,
+            "kind_slots": self.kind_slots,
+        }
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def get_scheduler() -> Scheduler:
+    """Returns the process-wide scheduler; only used from the event loop thread."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
@@ -0,0 +1,147 @@
+"""Multi-process server that loads models once and forks workers sharing them.
+
+The embedding model and heavy libraries are loaded in the parent before forking,
+so their memory pages are shared copy-on-write by every worker instead of being
+loaded once per process. Workers accept connections from one shared listening
+socket; conversation history is kept in SQLite (see sessions.py) and notebook
+writes are coordinated through per-notebook lock and version files, so any worker
+can serve any request. Run from the backend directory:
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+Provider quotas are per API key and a local LLM server is shared, so each worker gets
+an equal share of every per-minute budget. GET /metrics on any worker reports all of
+them: workers publish their metrics to a directory created for the run (see metrics.py).
+"""
+import argparse
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict
+
+from dotenv import load_dotenv
+
+from embeddings import EMBEDDING_THREADS, configure_threads
+from llm_gateway import configure_rate_limits
+from metrics import registry
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger("serve")
+
+# Constants
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0")) or os.cpu_count() or 1
+# A worker that dies sooner than this after starting is not restarted, to avoid crash loops
+MIN_WORKER_LIFETIME_SECONDS = 5.0
+# Compress websocket messages for clients that offer permessage-deflate (see protocol.py)
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, threads: int, log_level: str, metrics_directory: str):
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Workers share the cores, so each one gets its slice for inference
+    configure_threads(threads)
+    registry.configure_multiprocess(metrics_directory)
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE))
+    server.run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks the workers, restarts any that die and stops them all on SIGTERM/SIGINT."""
+
+    def __init__(self, app, sock: socket.socket, workers: int, log_level: str, metrics_directory: str):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.metrics_directory = metrics_directory
+        self.threads = EMBEDDING_THREADS or max(1, (os.cpu_count() or 1) // workers)
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.sock, self.threads, self.log_level, self.metrics_directory)
+            except Exception:
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        logger.info("Started worker %d", pid)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logger.warning("Worker %d exited with status %d", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started >= MIN_WORKER_LIFETIME_SECONDS:
+                self.spawn()
+        logger.info("All workers stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the backend from several worker processes sharing loaded models.")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="warning", help="uvicorn log level for the workers.")
+    args = parser.parse_args()
+
+    # Before importing main, so every gateway is created with this worker's share
+    configure_rate_limits(1 / args.workers)
+    import main as server
+
+    started = time.perf_counter()
+    server.preload()
+    logger.info("Loaded models in %.1fs, forking %d workers", time.perf_counter() - started, args.workers)
+
+    sock = bind_socket(args.host, args.port)
+    metrics_directory = tempfile.mkdtemp(prefix="exam-ai-metrics-")
+    try:
+        Supervisor(server.app, sock, args.workers, args.log_level, metrics_directory).run()
+    finally:
+        sock.close()
+        shutil.rmtree(metrics_directory, ignore_errors=True)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Conversation history kept in SQLite so every worker process sees the same sessions."""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "data/sessions.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id TEXT PRIMARY KEY,
+    worker_pid INTEGER NOT NULL,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, position);
+"""
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SessionStore:
+    """One connection per thread and process; SQLite's WAL mode lets workers read while one writes."""
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, so they are keyed by pid as well as thread
+        if getattr(self.local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def open(self, conversation_id: str):
+        self.connection().execute(
+            "INSERT OR REPLACE INTO conversations (conversation_id, worker_pid, started) VALUES (?, ?, ?)",
+            (conversation_id, os.getpid(), time.time()),
+        )
+
+    def append(self, conversation_id: str, content: str):
+        self.connection().execute(
+            "INSERT INTO messages (conversation_id, content) VALUES (?, ?)",
+            (conversation_id, content),
+        )
+
+    def history(self, conversation_id: str) -> Optional[List[str]]:
+        """Returns the conversation's messages in order, or None if it is not open."""
+        connection = self.connection()
+        if connection.execute("SELECT 1 FROM conversations WHERE conversation_id = ?", (conversation_id,)).fetchone() is None:
+            return None
+        rows = connection.execute(
+            "SELECT content FROM messages WHERE conversation_id = ? ORDER BY position",
+            (conversation_id,),
+        ).fetchall()
+        return [content for (content,) in rows]
+
+    def close(self, conversation_id: str):
+        connection = self.connection()
+        connection.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+
+    def active(self) -> List[str]:
+        """Open conversations, skipping those left behind by a worker that has since died."""
+        rows = self.connection().execute("SELECT conversation_id, worker_pid FROM conversations ORDER BY started").fetchall()
+        return [conversation_id for conversation_id, pid in rows if pid_alive(pid)]
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
@@ -0,0 +1,303 @@
+"""Export and import of a notebook as a single compressed snapshot file.
+
+A snapshot holds every chunk's id, text, metadata and embedding plus the notebook's
+topic index and summary cache, so a notebook can be moved to another host without
+re-reading the sources or re-embedding anything. The file is one gzip stream of
+length-prefixed frames, written and read one batch at a time:
+
+    MAGIC, format version (u32)
+    "H" header JSON: notebook id, embedding model, dimension, chunk count, ...
+    "B" batch: JSON (ids, documents, metadatas) then float32 embeddings, repeated
+    "F" file: JSON (name) then the file's bytes, for the notebook's side files
+    "E" end JSON: chunk count and CRC32 of all frame payloads
+
+    python snapshot.py export <notebook_id> notebook.examai
+    python snapshot.py import notebook.examai [--notebook <new_id>] [--replace]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from embeddings import EMBEDDING_MODEL_NAME
+from tiering import NOTEBOOK_FILES, hot_notebook, is_archived
+from vector_stores import bump_notebook_version, close_vector_store, get_vector_store, notebook_write_lock
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MAGIC = b"EXAMAISN"
+FORMAT_VERSION = 1
+SNAPSHOT_BATCH_SIZE = 1000
+SNAPSHOT_COMPRESS_LEVEL = 1
+FRAME_HEADER = struct.Struct("<cQ")
+PART_LENGTH = struct.Struct("<Q")
+# A notebook id becomes one directory name under data/
+NOTEBOOK_ID_PATTERN = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9._-]{0,127}")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class NotebookExistsError(SnapshotError):
+    pass
+
+
+class InvalidNotebookIdError(SnapshotError):
+    pass
+
+
+class SnapshotWriter:
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.crc = 0
+        self.fileobj.write(MAGIC + struct.pack("<I", FORMAT_VERSION))
+
+    def write_frame(self, kind: bytes, *parts: bytes):
+        # Every part is length-prefixed so a frame can carry JSON and raw bytes side by side
+        payload_length = sum(PART_LENGTH.size + len(part) for part in parts)
+        self.fileobj.write(FRAME_HEADER.pack(kind, payload_length))
+        for part in parts:
+            prefix = PART_LENGTH.pack(len(part))
+            self.fileobj.write(prefix)
+            self.fileobj.write(part)
+            self.crc = zlib.crc32(part, zlib.crc32(prefix, self.crc))
+
+    def write_json(self, kind: bytes, value, data: Optional[bytes] = None):
+        parts = [json.dumps(value, ensure_ascii=False).encode("utf-8")]
+        if data is not None:
+            parts.append(data)
+        self.write_frame(kind, *parts)
+
+
+class SnapshotReader:
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.crc = 0
+        opening = self.read_exactly(len(MAGIC) + 4)
+        if opening[:len(MAGIC)] != MAGIC:
+            raise SnapshotError("Not a notebook snapshot")
+        (self.version,) = struct.unpack("<I", opening[len(MAGIC):])
+        if self.version > FORMAT_VERSION:
+            raise SnapshotError(f"Snapshot format {self.version} is newer than supported ({FORMAT_VERSION})")
+
+    def read_exactly(self, size: int) -> bytes:
+        try:
+            data = self.fileobj.read(size)
+        except (EOFError, OSError, zlib.error) as e:
+            raise SnapshotError(f"Snapshot is corrupt: {e}")
+        if len(data) != size:
+            raise SnapshotError("Snapshot is truncated")
+        return data
+
+    def frames(self) -> Iterator[Tuple[bytes, List[bytes]]]:
+        while True:
+            kind, payload_length = FRAME_HEADER.unpack(self.read_exactly(FRAME_HEADER.size))
+            parts, remaining = [], payload_length
+            while remaining:
+                prefix = self.read_exactly(PART_LENGTH.size)
+                part = self.read_exactly(PART_LENGTH.unpack(prefix)[0])
+                # The end frame's own payload is not part of the checksum it carries
+                if kind != b"E":
+                    self.crc = zlib.crc32(part, zlib.crc32(prefix, self.crc))
+                parts.append(part)
+                remaining -= len(prefix) + len(part)
+            yield kind, parts
+            if kind == b"E":
+                return
+
+
+def validate_notebook_id(notebook_id: str) -> str:
+    """Rejects ids that are not a single safe path segment, such as ".." or "a/b"."""
+    if not isinstance(notebook_id, str) or not NOTEBOOK_ID_PATTERN.fullmatch(notebook_id):
+        raise InvalidNotebookIdError(f"Invalid notebook id: {notebook_id!r}")
+    return notebook_id
+
+
+def notebook_directory(notebook_id: str, data_path: str = "data") -> str:
+    validate_notebook_id(notebook_id)
+    return f"{data_path}/{notebook_id}/chroma"
+
+
+def export_notebook(notebook_id: str, output_path: str, data_path: str = "data",
+                    batch_size: int = SNAPSHOT_BATCH_SIZE, level: int = SNAPSHOT_COMPRESS_LEVEL) -> Dict:
+    """Streams a notebook's chunks, embeddings and side files into a snapshot file."""
+    persist_directory = notebook_directory(notebook_id, data_path)
+    if not os.path.isdir(persist_directory) and not is_archived(persist_directory):
+        raise SnapshotError(f"Notebook not found: {notebook_id}")
+    started = time.perf_counter()
+    # Holding the write lock keeps ingestion from changing the notebook mid-export
+    with hot_notebook(persist_directory), notebook_write_lock(persist_directory):
+        db = get_vector_store(persist_directory)
+        ids = db.get(include=[])["ids"]
+
+        dimension = 0
+        if ids:
+            dimension = len(db.get(ids=ids[:1], include=["embeddings"])["embeddings"][0])
+
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wb", compresslevel=level) as fileobj:
+            writer = SnapshotWriter(fileobj)
+            writer.write_json(b"H", {
+                "format_version": FORMAT_VERSION,
+                "notebook_id": notebook_id,
+                "embedding_model": EMBEDDING_MODEL_NAME,
+                "dimension": dimension,
+                "count": len(ids),
+                "collection_metadata": db._collection.metadata,
+                "created": time.time(),
+            })
+            for start in range(0, len(ids), batch_size):
+                batch = db.get(ids=ids[start:start + batch_size], include=["documents", "metadatas", "embeddings"])
+                writer.write_json(b"B", {
+                    "ids": batch["ids"],
+                    "documents": batch["documents"],
+                    "metadatas": batch["metadatas"],
+                }, np.asarray(batch["embeddings"], dtype="<f4").tobytes())
+            for name in NOTEBOOK_FILES:
+                path = Path(persist_directory).parent / name
+                if path.exists():
+                    writer.write_json(b"F", {"name": name}, path.read_bytes())
+            writer.write_json(b"E", {"count": len(ids), "crc32": writer.crc})
+        os.replace(tmp_path, output_path)
+
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(output_path)
+    logger.info("Exported %s: %d chunks, %d bytes in %.2fs", notebook_id, len(ids), size, elapsed)
+    return {"notebook_id": notebook_id, "chunks": len(ids), "bytes": size, "seconds": round(elapsed, 3)}
+
+
+def import_notebook(input_path: str, notebook_id: Optional[str] = None, data_path: str = "data",
+                    replace: bool = False) -> Dict:
+    """Restores a snapshot as a notebook without re-embedding.
+
+    The chunks are written to a staging directory and swapped in only once the whole
+    snapshot has been read and verified, so readers never see a partial notebook.
+    """
+    from chromadb.errors import ChromaError
+    from langchain_community.vectorstores import Chroma
+
+    started = time.perf_counter()
+    staging_directory = None
+    created_directory = None
+    imported = 0
+    files: Dict[str, bytes] = {}
+    try:
+        with gzip.open(input_path, "rb") as fileobj:
+            reader = SnapshotReader(fileobj)
+            for kind, parts in reader.frames():
+                # Batches and side files belong to the notebook the header describes
+                if kind != b"H" and staging_directory is None:
+                    raise SnapshotError("Snapshot frame appears before its header")
+                if kind == b"H" and staging_directory is not None:
+                    raise SnapshotError("Snapshot has more than one header")
+                try:
+                    info = json.loads(parts[0])
+                    if kind == b"H":
+                        if info["embedding_model"] != EMBEDDING_MODEL_NAME:
+                            raise SnapshotError(
+                                f"Snapshot was embedded with {info['embedding_model']}, this server uses {EMBEDDING_MODEL_NAME}"
+                            )
+                        notebook_id = notebook_id or info["notebook_id"]
+                        persist_directory = notebook_directory(notebook_id, data_path)
+                        exists = is_archived(persist_directory) or (
+                            os.path.isdir(persist_directory) and os.listdir(persist_directory))
+                        if not replace and exists:
+                            raise NotebookExistsError(f"Notebook {notebook_id} already exists; pass replace to overwrite it")
+                        dimension = info["dimension"]
+                        staging_directory = f"{persist_directory}.import-{os.getpid()}"
+                        if not os.path.isdir(os.path.dirname(persist_directory)):
+                            created_directory = os.path.dirname(persist_directory)
+                        shutil.rmtree(staging_directory, ignore_errors=True)
+                        # No embedding function: every vector comes from the snapshot
+                        collection = Chroma(
+                            persist_directory=staging_directory,
+                            collection_metadata=info["collection_metadata"],
+                        )._collection
+                    elif kind == b"B":
+                        embeddings = np.frombuffer(parts[1], dtype="<f4").reshape(len(info["ids"]), dimension)
+                        collection.add(
+                            ids=info["ids"],
+                            embeddings=embeddings,
+                            documents=info["documents"],
+                            metadatas=info["metadatas"],
+                        )
+                        imported += len(info["ids"])
+                    elif kind == b"F":
+                        if info["name"] in NOTEBOOK_FILES:
+                            files[info["name"]] = parts[1]
+                    elif kind == b"E":
+                        if info["crc32"] != reader.crc or info["count"] != imported:
+                            raise SnapshotError("Snapshot checksum or chunk count does not match")
+                except (KeyError, IndexError, ValueError, TypeError, json.JSONDecodeError, ChromaError) as e:
+                    raise SnapshotError(f"Snapshot is malformed: {e!r}") from e
+        if staging_directory is None:
+            raise SnapshotError("Snapshot has no header")
+        close_vector_store(staging_directory)
+
+        # An archived notebook being replaced is restored first so its archive goes away
+        with hot_notebook(persist_directory), notebook_write_lock(persist_directory):
+            # Queries may still be reading the old chunks; they finish on the retired files
+            close_vector_store(persist_directory, stop=False)
+            retired_directory = f"{persist_directory}.retired-{os.getpid()}"
+            if os.path.isdir(persist_directory):
+                os.rename(persist_directory, retired_directory)
+            os.rename(staging_directory, persist_directory)
+            staging_directory = None
+            shutil.rmtree(retired_directory, ignore_errors=True)
+            for name in NOTEBOOK_FILES:
+                path = Path(persist_directory).parent / name
+                if name in files:
+                    path.write_bytes(files[name])
+                elif path.exists():
+                    path.unlink()
+            bump_notebook_version(persist_directory)
+    finally:
+        if staging_directory is not None:
+            close_vector_store(staging_directory)
+            shutil.rmtree(staging_directory, ignore_errors=True)
+            if created_directory is not None:
+                # A failed import of a new notebook leaves nothing behind
+                shutil.rmtree(created_directory, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    logger.info("Imported %s: %d chunks in %.2fs", notebook_id, imported, elapsed)
+    return {"notebook_id": notebook_id, "chunks": imported, "seconds": round(elapsed, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import a notebook snapshot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write a notebook to a snapshot file.")
+    export_parser.add_argument("notebook_id")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--batch-size", type=int, default=SNAPSHOT_BATCH_SIZE)
+    export_parser.add_argument("--level", type=int, default=SNAPSHOT_COMPRESS_LEVEL, help="gzip level, 1 (fastest) to 9.")
+    import_parser = subparsers.add_parser("import", help="Restore a notebook from a snapshot file.")
+    import_parser.add_argument("input")
+    import_parser.add_argument("--notebook", help="Import under a different notebook id.")
+    import_parser.add_argument("--replace", action="store_true", help="Overwrite an existing notebook.")
+    parser.add_argument("--data-path", default="data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "export":
+        result = export_notebook(args.notebook_id, args.output, args.data_path, args.batch_size, args.level)
+    else:
+        result = import_notebook(args.input, args.notebook, args.data_path, args.replace)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Background answers to the suggested follow-up questions, kept per conversation.
+
+Opt-in (SPECULATIVE_FOLLOWUPS). After each answer its three suggested questions are
+answered in the background, so clicking one is served from memory. Speculation only
+uses spare capacity: the jobs go through the scheduler as its lowest-priority kind
+(see scheduler.py), they are skipped while the query route's rate limits are more
+than SPECULATIVE_MAX_SATURATION full, and they have their own generations-per-minute
+budget. Answers that are never clicked are counted as wasted.
+
+The store lives in the worker process holding the websocket (see serve.py), and a
+conversation's entries are dropped when it moves on to another question or closes.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from llm_gateway import TokenBucket, rate_limit_share
+from metrics import CACHE_HITS, CACHE_MISSES, ERRORS, SPECULATIVE_ANSWERS
+from filters import filter_key
+from retrieval_cache import normalize_query
+from scheduler import get_scheduler
+from vector_stores import notebook_version
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+SPECULATIVE_FOLLOWUPS = os.getenv("SPECULATIVE_FOLLOWUPS", "false").lower() == "true"
+SPECULATIVE_GENERATIONS_PER_MINUTE = float(os.getenv("SPECULATIVE_GENERATIONS_PER_MINUTE", "10"))
+# Speculation stops once the query route has used this fraction of its rate limits
+SPECULATIVE_MAX_SATURATION = float(os.getenv("SPECULATIVE_MAX_SATURATION", "0.5"))
+SPECULATIVE_TTL_SECONDS = 600
+
+# (question, notebook directory, filter) -> (response, whether it was grounded in the notebook)
+Generator = Callable[[str, str, Optional[Dict]], Tuple[Dict, bool]]
+
+
+class Speculation:
+    def __init__(self, key: Tuple):
+        self.key = key
+        self.future: Optional[Future] = None
+        self.created = time.monotonic()
+        # Guarded by SpeculativeAnswers.lock: a job either starts or is cancelled, never both
+        self.started = False
+        self.cancelled = False
+
+
+class SpeculativeAnswers:
+    def __init__(self, generate: Generator, saturation: Callable[[], float],
+                 generations_per_minute: float = SPECULATIVE_GENERATIONS_PER_MINUTE):
+        self.generate = generate
+        self.saturation = saturation
+        self.budget = TokenBucket(generations_per_minute * rate_limit_share())
+        self.conversations: Dict[str, List[Speculation]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(persist_directory: str, question: str, where: Optional[Dict] = None) -> Tuple:
+        return (persist_directory, notebook_version(persist_directory), normalize_query(question), filter_key(where))
+
+    def has_headroom(self) -> bool:
+        return self.saturation() <= SPECULATIVE_MAX_SATURATION
+
+    def take(self, conversation_id: str, persist_directory: str, question: str,
+             where: Optional[Dict] = None) -> Optional[Tuple[Dict, bool]]:
+        """Returns the pre-generated answer to `question`, waiting for it if it is being generated."""
+        key = self.key(persist_directory, question, where)
+        with self.lock:
+            speculations = self.conversations.get(conversation_id, [])
+            match = next((speculation for speculation in speculations if speculation.key == key), None)
+            if match is not None:
+                speculations.remove(match)
+
+        result = None
+        if match is not None and time.monotonic() - match.created <= SPECULATIVE_TTL_SECONDS:
+            # Still queued: answering inline is no slower than waiting behind other jobs
+            if not self.cancel(match):
+                try:
+                    result = match.future.result()
+                except Exception:
+                    result = None
+        elif match is not None:
+            self.retire([match])
+
+        if result is None:
+            CACHE_MISSES.inc(cache="speculative")
+            return None
+        CACHE_HITS.inc(cache="speculative")
+        SPECULATIVE_ANSWERS.inc(outcome="used")
+        return result
+
+    def schedule(self, conversation_id: str, persist_directory: str, questions: List[str], where: Optional[Dict] = None):
+        """Starts generating answers to the follow-ups, replacing the conversation's previous ones."""
+        speculations = []
+        for question in questions:
+            if not self.has_headroom() or self.budget.available() < 1:
+                SPECULATIVE_ANSWERS.inc(outcome="skipped")
+                continue
+            speculation = Speculation(self.key(persist_directory, question, where))
+            try:
+                # Notebooks are keyed by id in the scheduler, like the requests themselves
+                speculation.future = get_scheduler().submit(
+                    "speculative", Path(persist_directory).parent.name, self.run, speculation, question,
+                    persist_directory, where)
+            except RuntimeError:
+                # Not serving, e.g. a script calling the engine directly
+                SPECULATIVE_ANSWERS.inc(outcome="skipped")
+                continue
+            self.budget.adjust(1)
+            speculations.append(speculation)
+        with self.lock:
+            previous = self.conversations.pop(conversation_id, [])
+            if speculations:
+                self.conversations[conversation_id] = speculations
+        self.retire(previous)
+
+    def discard(self, conversation_id: str):
+        with self.lock:
+            previous = self.conversations.pop(conversation_id, [])
+        self.retire(previous)
+
+    def run(self, speculation: Speculation, question: str, persist_directory: str,
+            where: Optional[Dict] = None) -> Optional[Tuple[Dict, bool]]:
+        with self.lock:
+            if speculation.cancelled:
+                return None
+            speculation.started = True
+        # Real requests may have used up the quota while this job was queued
+        if not self.has_headroom():
+            SPECULATIVE_ANSWERS.inc(outcome="skipped")
+            return None
+        try:
+            result = self.generate(question, persist_directory, where)
+        except Exception as e:
+            SPECULATIVE_ANSWERS.inc(outcome="failed")
+            ERRORS.inc(component="speculative")
+            logger.warning("Speculative answer failed: %s", e)
+            raise
+        SPECULATIVE_ANSWERS.inc(outcome="generated")
+        return result
+
+    def cancel(self, speculation: Speculation) -> bool:
+        """Cancels a job that has not started generating; False if it already has."""
+        with self.lock:
+            if speculation.started:
+                return False
+            speculation.cancelled = True
+        # Gives up its place in the scheduler's queue; refunded, as nothing was generated
+        speculation.future.cancel()
+        self.budget.adjust(-1)
+        return True
+
+    def retire(self, speculations: List[Speculation]):
+        """Cancels jobs that have not started; finished answers nobody took count as wasted."""
+        def count_wasted(future: Future):
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                SPECULATIVE_ANSWERS.inc(outcome="wasted")
+
+        for speculation in speculations:
+            if not self.cancel(speculation):
+                speculation.future.add_done_callback(count_wasted)
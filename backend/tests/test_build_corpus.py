@@ -0,0 +1,20 @@
+from build_corpus import CorpusBuilder, load_and_split
+
+
+def test_unreadable_file_reports_its_error(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf")
+    chunks, error = load_and_split(str(path))
+    assert chunks == []
+    assert error
+
+
+def test_failed_files_are_retried():
+    manifest = {"files": {
+        "ok.md": {"sha256": "a", "ids": ["x-0"]},
+        "broken.pdf": {"sha256": "b", "ids": [], "error": "PdfStreamError: Stream has ended unexpectedly"},
+        "gone.md": {"sha256": "c", "ids": ["y-0"]},
+    }}
+    removed, changed = CorpusBuilder.changes(manifest, {"ok.md": "a", "broken.pdf": "b", "new.md": "d"})
+    assert removed == ["gone.md"]
+    assert changed == ["broken.pdf", "new.md"]
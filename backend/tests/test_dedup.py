@@ -0,0 +1,54 @@
+import json
+from types import SimpleNamespace
+
+from dedup import DedupIndex, minhash_signatures
+
+TEXT = "A binary heap is a complete binary tree in which every parent orders before its children."
+OTHER = "Dijkstra's algorithm finds shortest paths from one vertex when no edge weight is negative."
+
+
+class FakeStore:
+    """Just enough of a Chroma vector store for DedupIndex.deduplicate."""
+
+    def __init__(self, metadatas):
+        self.metadatas = metadatas
+        self._collection = self
+
+    def get(self, ids, include):
+        found = [chunk_id for chunk_id in ids if chunk_id in self.metadatas]
+        return {"ids": found, "metadatas": [self.metadatas[chunk_id] for chunk_id in found]}
+
+    def update(self, ids, metadatas):
+        self.metadatas.update(zip(ids, metadatas))
+
+
+def chunk(source: str, page: int, text: str = TEXT):
+    return SimpleNamespace(page_content=text, metadata={"source": source, "page": page})
+
+
+def test_missing_indexed_chunk_does_not_double_count_merges(tmp_path):
+    index = DedupIndex(str(tmp_path / "chroma"))
+    # Indexed but since deleted from the store
+    index.add(["deleted"], minhash_signatures([TEXT]))
+    chunks = [chunk("slides.pdf", 1, OTHER), chunk("handout.pdf", 4, OTHER), chunk("slides.pdf", 2)]
+
+    kept, signatures, stats = index.deduplicate(FakeStore({}), chunks)
+
+    assert kept == [chunks[0], chunks[2]]
+    assert len(signatures) == 2
+    assert stats["merged_in_upload"] == 1
+    assert kept[0].metadata["duplicates"] == 1
+    assert json.loads(kept[0].metadata["also_in"]) == [{"source": "handout.pdf", "page": 4}]
+    assert index.table.keys == []
+
+
+def test_duplicate_of_stored_chunk_updates_its_metadata(tmp_path):
+    index = DedupIndex(str(tmp_path / "chroma"))
+    index.add(["stored"], minhash_signatures([TEXT]))
+    store = FakeStore({"stored": {"source": "slides.pdf", "page": 1}})
+
+    kept, _, stats = index.deduplicate(store, [chunk("handout.pdf", 4)])
+
+    assert kept == []
+    assert stats["merged_into_existing"] == 1
+    assert store.metadatas["stored"]["duplicates"] == 1
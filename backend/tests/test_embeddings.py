@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from embeddings import (
+    EMBEDDING_MODEL_NAME,
+    ONNX_FP32_MIN_COSINE,
+    ONNX_MODEL_DIR,
+    ONNX_PARITY_MIN_COSINE,
+    ONNX_QUANTIZE,
+    PARITY_SENTENCES,
+    OnnxEmbeddings,
+)
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("tokenizers")
+sentence_transformers = pytest.importorskip("sentence_transformers")
+
+MIN_COSINE = ONNX_PARITY_MIN_COSINE if ONNX_QUANTIZE else ONNX_FP32_MIN_COSINE
+
+
+@pytest.fixture(scope="module")
+def reference() -> np.ndarray:
+    try:
+        model = sentence_transformers.SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+    except Exception as e:
+        pytest.skip(f"{EMBEDDING_MODEL_NAME} is unavailable: {e}")
+    return np.asarray(model.encode(PARITY_SENTENCES, normalize_embeddings=True), dtype=np.float32)
+
+
+@pytest.fixture(scope="module")
+def model_dir(reference, tmp_path_factory) -> str:
+    # Reuse the server's export when there is one; exporting needs torch and takes a while
+    exported = Path(__file__).resolve().parents[1] / ONNX_MODEL_DIR
+    if (exported / "tokenizer.json").exists():
+        return str(exported)
+    pytest.importorskip("torch")
+    return str(tmp_path_factory.mktemp("onnx"))
+
+
+@pytest.mark.parametrize("batch_size", [
+    # Everything in one batch, padded to the longest sentence
+    len(PARITY_SENTENCES),
+    # Mixed-length batches after sorting by token count
+    3,
+    # No padding at all
+    1,
+])
+def test_onnx_matches_sentence_transformers(reference, model_dir, batch_size):
+    embeddings = OnnxEmbeddings(EMBEDDING_MODEL_NAME, model_dir, batch_size=batch_size)
+    # Reversed so the output has to be put back in input order
+    candidate = embeddings.encode(PARITY_SENTENCES[::-1])[::-1]
+    cosines = (reference * candidate).sum(axis=1)
+    assert cosines.min() >= MIN_COSINE, dict(zip(PARITY_SENTENCES, cosines.round(6)))
+
+
+def test_onnx_query_matches_its_documents(model_dir):
+    embeddings = OnnxEmbeddings(EMBEDDING_MODEL_NAME, model_dir)
+    documents = np.asarray(embeddings.embed_documents(PARITY_SENTENCES), dtype=np.float32)
+    queries = np.asarray([embeddings.embed_query(sentence) for sentence in PARITY_SENTENCES], dtype=np.float32)
+    assert (documents * queries).sum(axis=1).min() >= MIN_COSINE
@@ -0,0 +1,63 @@
+import time
+
+import httpx
+import pytest
+
+from llm_gateway import LLMGateway, LLMGatewayError, configure_rate_limits, get_gateway
+from llm_router import Backend, Route
+
+
+def gateway(name: str, handler) -> LLMGateway:
+    backend = LLMGateway(name, base_url=f"http://{name}", api_key="test")
+    backend.client = httpx.Client(base_url=f"http://{name}", transport=httpx.MockTransport(handler))
+    return backend
+
+
+def answer(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"choices": [{"message": {"content": "fallback"}}], "usage": {}})
+
+
+def rate_limited(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(429, headers={"retry-after": "5"}, text="slow down")
+
+
+def test_rate_limited_backend_falls_back_within_the_slo():
+    route = Route("query", [Backend("primary", gateway("primary", rate_limited)),
+                            Backend("fallback", gateway("fallback", answer))], slo_seconds=2)
+    started = time.monotonic()
+    assert route.invoke("What is a heap?").content == "fallback"
+    assert time.monotonic() - started < 1
+    assert route.stats()["served_by"] == {"primary": 0, "fallback": 1}
+
+
+def test_gateway_does_not_wait_for_quota_past_the_deadline():
+    backend = gateway("primary", answer)
+    backend.request_bucket.tokens = 0
+    started = time.monotonic()
+    with pytest.raises(LLMGatewayError):
+        backend.invoke("What is a heap?", deadline=started + 0.5)
+    assert time.monotonic() - started < 0.1
+    # Nothing was taken from the quota
+    assert backend.request_bucket.available() < 1
+
+
+def test_batch_calls_leave_the_reserve_to_interactive_ones():
+    backend = gateway("primary", answer)
+    backend.request_bucket.tokens = backend.request_bucket.capacity * 0.2
+    assert backend.is_saturated("Summarise this.", batch=True)
+    assert not backend.is_saturated("What is a heap?")
+    with pytest.raises(LLMGatewayError):
+        backend.invoke("Summarise this.", deadline=time.monotonic() + 0.5, batch=True)
+    assert backend.invoke("What is a heap?", deadline=time.monotonic() + 0.5).content == "fallback"
+
+
+def test_rate_limit_share_applies_to_existing_and_new_gateways():
+    existing = get_gateway("share-test", base_url="http://share", requests_per_minute=30, tokens_per_minute=6000)
+    try:
+        configure_rate_limits(0.25)
+        assert existing.request_bucket.capacity == 7.5
+        assert existing.token_bucket.capacity == 1500
+        assert LLMGateway("new", base_url="http://share", requests_per_minute=40).request_bucket.capacity == 10
+    finally:
+        configure_rate_limits(1.0)
+    assert existing.request_bucket.capacity == 30
@@ -0,0 +1,81 @@
+import json
+import random
+import time
+
+import numpy as np
+
+from map_reduce import (MAX_CLUSTER_CHARS, MAX_MAP_CALLS, SUMMARY_CACHE_FILE, MapReduceGenerator, SummaryCache,
+                        map_call_shares, split_groups)
+
+
+def notebook(chunks: int, mean_chars: int, topics: int = 12, seed: int = 0):
+    """Chunks spread over `topics` clusters, with their texts, metadatas and embeddings."""
+    rng = random.Random(seed)
+    centres = np.random.default_rng(seed).standard_normal((topics, 16))
+    texts, metadatas, vectors = [], [], []
+    for position in range(chunks):
+        topic = rng.randrange(topics)
+        texts.append(f"{position:05d} " + "x" * rng.randint(mean_chars // 2, mean_chars * 3 // 2))
+        metadatas.append({"source": f"handout_{position // 100:02d}.pdf", "page": position % 100})
+        vectors.append(centres[topic] + np.random.default_rng(position).standard_normal(16) * 0.1)
+    return texts, metadatas, np.asarray(vectors, dtype=np.float32)
+
+
+def test_every_chunk_is_mapped_within_budget():
+    texts, metadatas, embeddings = notebook(3000, 60)
+    assert sum(len(text) for text in texts) < (MAX_MAP_CALLS - 12) * MAX_CLUSTER_CHARS
+    groups = MapReduceGenerator(llm=None).build_cluster_texts(texts, metadatas, embeddings)
+
+    assert len(groups) <= MAX_MAP_CALLS
+    assert sorted(text for group in groups for text in group) == sorted(texts)
+
+
+def test_over_budget_uses_every_call():
+    texts, metadatas, embeddings = notebook(3000, 200)
+    groups = MapReduceGenerator(llm=None).build_cluster_texts(texts, metadatas, embeddings)
+
+    assert len(groups) == MAX_MAP_CALLS
+    mapped = sum(len(text) for group in groups for text in group)
+    # Only a partial chunk per call is lost to cluster boundaries
+    assert mapped > MAX_MAP_CALLS * (MAX_CLUSTER_CHARS - 300)
+    assert max(sum(len(text) for text in group) for group in groups) <= MAX_CLUSTER_CHARS + 300
+
+
+def test_shares_use_the_whole_budget():
+    texts = ["x" * 1000] * 700
+    clusters = [list(range(start, start + 70)) for start in range(0, 700, 70)]
+    shares = map_call_shares(clusters, texts, max_calls=48)
+    assert sum(shares) == 48
+
+
+def test_split_groups_keeps_reading_order():
+    texts = ["x" * length for length in (500, 4000, 800, 3000, 2500, 100, 1200)]
+    groups = split_groups(list(range(len(texts))), texts, 3)
+    assert len(groups) <= 3
+    assert [i for group in groups for i in group] == list(range(len(texts)))
+
+
+def test_summary_cache_keeps_the_most_recently_used(tmp_path):
+    persist_directory = str(tmp_path / "notebook" / "chroma")
+    (tmp_path / "notebook").mkdir()
+    for generation in range(5):
+        # Every source change produces new content keys
+        cache = SummaryCache(persist_directory)
+        if generation:
+            # A cluster whose chunks did not change is served from the cache each time
+            assert cache.get("generation-0-0") == "summary"
+        for group in range(8):
+            cache.put(f"generation-{generation}-{group}", "summary")
+        cache.save(max_entries=12)
+        time.sleep(0.01)
+
+    entries = json.loads((tmp_path / "notebook" / SUMMARY_CACHE_FILE).read_text(encoding="utf-8"))
+    assert len(entries) == 12
+    assert "generation-0-0" in entries and "generation-0-1" not in entries
+    assert all(f"generation-4-{group}" in entries for group in range(8))
+
+
+def test_summary_cache_reads_files_without_use_times(tmp_path):
+    (tmp_path / SUMMARY_CACHE_FILE).write_text(json.dumps({"old": "summary"}), encoding="utf-8")
+    cache = SummaryCache(str(tmp_path / "chroma"))
+    assert cache.get("old") == "summary"
@@ -0,0 +1,30 @@
+import json
+import os
+
+from metrics import Registry
+
+
+def test_workers_metrics_are_merged(tmp_path):
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.")
+    depth = registry.gauge("queue_depth", "Queue depth.")
+    latency = registry.histogram("seconds", "Latency.", buckets=(1.0,))
+    requests.inc(2, endpoint="ws")
+    depth.set(3, kind="query")
+    latency.observe(0.5)
+    # Another worker that has since exited
+    (tmp_path / "999999999.json").write_text(json.dumps({
+        requests.name: [[[["endpoint", "ws"]], 5.0]],
+        depth.name: [[[["kind", "query"]], 7.0]],
+        latency.name: [[[], [[0], 2.0, 1]]],
+    }))
+    registry.directory = str(tmp_path)
+
+    lines = registry.render().splitlines()
+
+    assert f'{requests.name}{{endpoint="ws"}} 7.0' in lines
+    assert f'{depth.name}{{kind="query",worker="{os.getpid()}"}} 3' in lines
+    assert not any('worker="999999999"' in line for line in lines)
+    assert f'{latency.name}_bucket{{le="1.0"}} 1' in lines
+    assert f"{latency.name}_count 2" in lines
+    assert f"{latency.name}_sum 2.5" in lines
@@ -0,0 +1,42 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from embeddings import EMBEDDING_MODEL_NAME
+from snapshot import SnapshotError, SnapshotWriter, import_notebook
+
+HEADER = {
+    "notebook_id": "course",
+    "embedding_model": EMBEDDING_MODEL_NAME,
+    "dimension": 4,
+    "count": 1,
+    "collection_metadata": None,
+}
+BATCH = {"ids": ["a"], "documents": ["A heap is a tree."], "metadatas": [{"source": "notes.pdf"}]}
+
+
+def write_snapshot(path, *frames):
+    with gzip.open(path, "wb") as fileobj:
+        writer = SnapshotWriter(fileobj)
+        for kind, value, data in frames:
+            writer.write_json(kind, value, data)
+    return str(path)
+
+
+@pytest.mark.parametrize("frames", [
+    # A batch before the header
+    [(b"B", BATCH, np.zeros((1, 4), dtype="<f4").tobytes())],
+    # Header missing a field
+    [(b"H", {key: value for key, value in HEADER.items() if key != "dimension"}, None)],
+    # Embeddings that do not match the header's dimension
+    [(b"H", HEADER, None), (b"B", BATCH, np.zeros((1, 3), dtype="<f4").tobytes())],
+    # Metadata Chroma cannot store
+    [(b"H", HEADER, None), (b"B", {**BATCH, "metadatas": [{"source": ["notes.pdf"]}]},
+                           np.zeros((1, 4), dtype="<f4").tobytes())],
+])
+def test_malformed_snapshot_is_rejected_and_leaves_nothing_behind(tmp_path, frames):
+    data_path = tmp_path / "data"
+    with pytest.raises(SnapshotError):
+        import_notebook(write_snapshot(tmp_path / "bad.examai", *frames), data_path=str(data_path))
+    assert not (data_path / "course").exists()
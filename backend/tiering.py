@@ -0,0 +1,317 @@
+"""Hot and cold storage tiers for notebooks.
+
+A notebook is hot while its Chroma directory is expanded under data/<notebook>/.
+Notebooks nobody has opened for TIERING_COLD_AFTER_DAYS are compacted by `sweep`
+into data/<notebook>/cold.tar.gz (the chroma directory plus the side files in
+NOTEBOOK_FILES) and rehydrated the next time a request opens them through
+`hot_notebook`. The sweep also closes stores this process has not used for
+TIERING_CLOSE_IDLE_SECONDS, so their index no longer sits in memory.
+
+Every request on a notebook holds a shared lock on data/<notebook>/tier.lock for
+its duration. Rehydration takes it exclusively, and eviction only proceeds if it
+can take it exclusively without waiting, so a notebook in use by any worker
+process is never archived under it. Access times are the mtime of
+data/<notebook>/access, touched at most once per TIERING_ACCESS_INTERVAL_SECONDS.
+
+    python tiering.py sweep [--cold-after-days 30]
+    python tiering.py status
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from dedup import DEDUP_INDEX_FILE
+from map_reduce import SUMMARY_CACHE_FILE
+from metrics import ERRORS, REHYDRATION_SECONDS, TIERING_BYTES, TIERING_BYTES_SAVED, TIERING_EVICTIONS, TIERING_NOTEBOOKS
+from topic_index import TOPIC_INDEX_FILE
+from vector_stores import bump_notebook_version, close_vector_store, notebook_path, notebook_write_lock, open_vector_stores
+
+# Load environment variables
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Constants
+TIERING_COLD_AFTER_DAYS = float(os.getenv("TIERING_COLD_AFTER_DAYS", "30"))
+# How often the server sweeps; 0 disables archiving and idle-store closing
+TIERING_SWEEP_SECONDS = float(os.getenv("TIERING_SWEEP_SECONDS", "3600"))
+TIERING_CLOSE_IDLE_SECONDS = float(os.getenv("TIERING_CLOSE_IDLE_SECONDS", "1800"))
+TIERING_ACCESS_INTERVAL_SECONDS = float(os.getenv("TIERING_ACCESS_INTERVAL_SECONDS", "300"))
+# gzip level of the archives, 1 (fastest) to 9
+TIERING_COMPRESS_LEVEL = int(os.getenv("TIERING_COMPRESS_LEVEL", "6"))
+ARCHIVE_FILE = "cold.tar.gz"
+# Sizes recorded at eviction, for reporting savings without opening the archive
+ARCHIVE_INFO_FILE = "cold.json"
+ACCESS_FILE = "access"
+TIER_LOCK_FILE = "tier.lock"
+# Side files that belong to a notebook, moved along with its chunks
+NOTEBOOK_FILES = [TOPIC_INDEX_FILE, SUMMARY_CACHE_FILE, DEDUP_INDEX_FILE]
+
+# persist directory -> last time this process touched its access file (wall clock)
+_recorded: Dict[str, float] = {}
+# persist directory -> last time a request in this process used it (monotonic)
+_last_used: Dict[str, float] = {}
+_access_lock = threading.Lock()
+
+
+def record_access(persist_directory: str):
+    if not notebook_exists(persist_directory):
+        return
+    with _access_lock:
+        _last_used[persist_directory] = time.monotonic()
+        now = time.time()
+        if now - _recorded.get(persist_directory, 0.0) < TIERING_ACCESS_INTERVAL_SECONDS:
+            return
+        _recorded[persist_directory] = now
+    notebook_path(persist_directory, ACCESS_FILE).touch()
+
+
+def last_access(persist_directory: str) -> float:
+    """Wall-clock time the notebook was last opened, or last written if never tracked."""
+    for path in (notebook_path(persist_directory, ACCESS_FILE),
+                 Path(persist_directory) / "chroma.sqlite3",
+                 Path(persist_directory)):
+        try:
+            return path.stat().st_mtime
+        except FileNotFoundError:
+            continue
+    return 0.0
+
+
+def is_archived(persist_directory: str) -> bool:
+    return notebook_path(persist_directory, ARCHIVE_FILE).exists()
+
+
+def notebook_exists(persist_directory: str) -> bool:
+    return Path(persist_directory).is_dir() or is_archived(persist_directory)
+
+
+def directory_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(entry.stat().st_size for entry in path.rglob("*") if entry.is_file())
+
+
+@contextmanager
+def tier_lock(persist_directory: str):
+    """The notebook's tier lock file, unlocked; only for notebooks that exist."""
+    with open(notebook_path(persist_directory, TIER_LOCK_FILE), "a") as lock_file:
+        try:
+            yield lock_file
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def hot_notebook(persist_directory: str):
+    """Keeps a notebook hot for the duration of the block, restoring it first if archived."""
+    if not notebook_exists(persist_directory):
+        # Nothing stored yet, so nothing to restore or protect from eviction
+        yield
+        return
+    record_access(persist_directory)
+    with tier_lock(persist_directory) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        if is_archived(persist_directory):
+            # Let go before locking exclusively: two holders upgrading at once would deadlock
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if is_archived(persist_directory):
+                rehydrate(persist_directory)
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+        yield
+
+
+def rehydrate(persist_directory: str) -> Dict:
+    """Expands an archived notebook in place; the caller holds its tier lock exclusively."""
+    started = time.perf_counter()
+    chroma = Path(persist_directory)
+    archive = notebook_path(persist_directory, ARCHIVE_FILE)
+    staging = chroma.parent / f"rehydrate-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        with tarfile.open(archive, "r:gz") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(staging, filter="data")
+            else:
+                tar.extractall(staging)
+        close_vector_store(persist_directory)
+        if chroma.is_dir() and any(chroma.iterdir()):
+            # Written to without going through hot_notebook; keep it rather than lose it
+            orphaned = chroma.with_name(f"{chroma.name}.orphaned-{time.time_ns()}")
+            logger.warning("%s was written while archived, moving it to %s", chroma, orphaned)
+            os.rename(chroma, orphaned)
+        elif chroma.exists():
+            chroma.rmdir()
+        os.rename(staging / "chroma", chroma)
+        for name in NOTEBOOK_FILES:
+            if (staging / name).exists():
+                os.replace(staging / name, chroma.parent / name)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    archive.unlink()
+    notebook_path(persist_directory, ARCHIVE_INFO_FILE).unlink(missing_ok=True)
+    bump_notebook_version(persist_directory)
+
+    elapsed = time.perf_counter() - started
+    REHYDRATION_SECONDS.observe(elapsed)
+    logger.info("Rehydrated %s in %.2fs", persist_directory, elapsed)
+    return {"persist_directory": persist_directory, "seconds": round(elapsed, 3)}
+
+
+def evict_notebook(persist_directory: str, cold_after: float = TIERING_COLD_AFTER_DAYS * 86400) -> Optional[Dict]:
+    """Archives a notebook untouched for `cold_after` seconds; None if it is not cold or in use."""
+    chroma = Path(persist_directory)
+    # Stores built by build_corpus.py are served through a symlink and stay hot
+    if chroma.is_symlink() or not chroma.is_dir() or is_archived(persist_directory):
+        return None
+    with tier_lock(persist_directory) as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        if time.time() - last_access(persist_directory) < cold_after or is_archived(persist_directory):
+            return None
+        with notebook_write_lock(persist_directory):
+            started = time.perf_counter()
+            close_vector_store(persist_directory)
+            members = [chroma] + [chroma.parent / name for name in NOTEBOOK_FILES if (chroma.parent / name).exists()]
+            hot_bytes = sum(directory_size(member) for member in members)
+            archive = notebook_path(persist_directory, ARCHIVE_FILE)
+            tmp_path = archive.with_name(f"{archive.name}.{os.getpid()}.tmp")
+            with tarfile.open(tmp_path, "w:gz", compresslevel=TIERING_COMPRESS_LEVEL) as tar:
+                for member in members:
+                    tar.add(member, arcname=member.name)
+            cold_bytes = tmp_path.stat().st_size
+            info = {"archived": time.time(), "hot_bytes": hot_bytes, "cold_bytes": cold_bytes}
+            notebook_path(persist_directory, ARCHIVE_INFO_FILE).write_text(json.dumps(info), encoding="utf-8")
+            os.replace(tmp_path, archive)
+            shutil.rmtree(chroma)
+            for member in members[1:]:
+                member.unlink()
+            # Workers that still have the store open reopen it (after rehydration) on next use
+            bump_notebook_version(persist_directory)
+
+    elapsed = time.perf_counter() - started
+    TIERING_EVICTIONS.inc()
+    TIERING_BYTES_SAVED.inc(hot_bytes - cold_bytes)
+    logger.info("Archived %s: %d -> %d bytes in %.2fs", persist_directory, hot_bytes, cold_bytes, elapsed)
+    return {"persist_directory": persist_directory, "seconds": round(elapsed, 3), **info}
+
+
+def close_unless_busy(persist_directory: str) -> bool:
+    """Closes the store unless a request holds the notebook; True if it was closed."""
+    if notebook_exists(persist_directory):
+        with tier_lock(persist_directory) as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            close_vector_store(persist_directory)
+    else:
+        # Deleted from under the open store; there is no lock file to take
+        close_vector_store(persist_directory, stop=False)
+    return True
+
+
+def close_idle_stores(idle_seconds: float = TIERING_CLOSE_IDLE_SECONDS) -> List[str]:
+    """Closes this process's open stores that no request has used for `idle_seconds`."""
+    closed = []
+    now = time.monotonic()
+    for persist_directory in open_vector_stores():
+        with _access_lock:
+            # Stores opened outside hot_notebook get a full idle period from when they are first seen
+            last_used = _last_used.setdefault(persist_directory, now)
+        if now - last_used < idle_seconds:
+            continue
+        if not close_unless_busy(persist_directory):
+            continue
+        with _access_lock:
+            _last_used.pop(persist_directory, None)
+        closed.append(persist_directory)
+    if closed:
+        logger.info("Closed %d idle vector stores", len(closed))
+    return closed
+
+
+def notebook_directories(data_path: str = "data") -> List[str]:
+    root = Path(data_path)
+    if not root.is_dir():
+        return []
+    return [str(path / "chroma") for path in sorted(root.iterdir())
+            if path.is_dir() and ((path / "chroma").is_dir() or (path / ARCHIVE_FILE).exists())]
+
+
+def tier_stats(data_path: str = "data") -> Dict:
+    """Notebook counts and bytes on disk per tier; also updates the tiering gauges."""
+    stats = {
+        "hot": {"notebooks": 0, "bytes": 0},
+        "cold": {"notebooks": 0, "bytes": 0, "hot_bytes": 0},
+    }
+    for persist_directory in notebook_directories(data_path):
+        if is_archived(persist_directory):
+            stats["cold"]["notebooks"] += 1
+            stats["cold"]["bytes"] += notebook_path(persist_directory, ARCHIVE_FILE).stat().st_size
+            try:
+                info = json.loads(notebook_path(persist_directory, ARCHIVE_INFO_FILE).read_text(encoding="utf-8"))
+                stats["cold"]["hot_bytes"] += info["hot_bytes"]
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+        else:
+            chroma = Path(persist_directory)
+            stats["hot"]["notebooks"] += 1
+            stats["hot"]["bytes"] += directory_size(chroma) + sum(
+                directory_size(chroma.parent / name) for name in NOTEBOOK_FILES if (chroma.parent / name).exists()
+            )
+    stats["saved_bytes"] = stats["cold"]["hot_bytes"] - stats["cold"]["bytes"]
+    for tier in ("hot", "cold"):
+        TIERING_NOTEBOOKS.set(stats[tier]["notebooks"], tier=tier)
+        TIERING_BYTES.set(stats[tier]["bytes"], tier=tier)
+    return stats
+
+
+def sweep(data_path: str = "data", cold_after: float = TIERING_COLD_AFTER_DAYS * 86400) -> Dict:
+    """Closes idle stores and archives every cold notebook under `data_path`."""
+    closed = close_idle_stores()
+    evicted = []
+    for persist_directory in notebook_directories(data_path):
+        try:
+            result = evict_notebook(persist_directory, cold_after)
+        except Exception as e:
+            ERRORS.inc(component="tiering")
+            logger.exception("Error archiving %s: %s", persist_directory, e)
+            continue
+        if result is not None:
+            evicted.append(result)
+    return {"closed_stores": len(closed), "evicted": evicted, **tier_stats(data_path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive cold notebooks or report storage per tier.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sweep_parser = subparsers.add_parser("sweep", help="Archive notebooks not opened recently.")
+    sweep_parser.add_argument("--cold-after-days", type=float, default=TIERING_COLD_AFTER_DAYS)
+    subparsers.add_parser("status", help="Notebooks and bytes on disk per tier.")
+    parser.add_argument("--data-path", default="data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "sweep":
+        result = sweep(args.data_path, args.cold_after_days * 86400)
+    else:
+        result = tier_stats(args.data_path)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
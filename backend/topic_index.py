@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from map_reduce import (
+    CHUNKS_PER_CLUSTER,
+    MapReduceGenerator,
+    SummaryCache,
+    chunk_position,
+    cluster_chunks,
+    cluster_count,
+    select_representatives,
+)
+
+logger = logging.getLogger(__name__)
+
+# Constants
+TOPIC_INDEX_FILE = "topics.json"
+# Serialises updates of one notebook's index, which run after the upload has been acknowledged
+TOPIC_LOCK_FILE = "topics.lock"
+# New chunks less similar than this to every topic wait for the next rebuild
+TOPIC_ASSIGN_THRESHOLD = 0.35
+# Rebuild from scratch once the notebook has grown by this fraction since the last build
+TOPIC_REBUILD_GROWTH = 0.5
+TOPIC_QUERY_K = 1
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class TopicIndex:
+    """Compact per-notebook index of topic clusters built while sources are ingested.
+
+    Each topic keeps its centroid, size, a few representative chunks and an LLM summary
+    of them, so queries can use pre-digested context instead of raw chunks.
+    The index lives in data/<notebook>/topics.json next to the vector store.
+    """
+
+    def __init__(self, persist_directory: str):
+        self.path = Path(persist_directory).parent / TOPIC_INDEX_FILE
+        self.persist_directory = persist_directory
+        self.topics: List[Dict] = []
+        self.chunk_count = 0
+        self.built_at_count = 0
+        self.pending: List[str] = []
+
+    @classmethod
+    def load(cls, persist_directory: str) -> "TopicIndex":
+        index = cls(persist_directory)
+        if index.path.exists():
+            try:
+                data = json.loads(index.path.read_text(encoding="utf-8"))
+                index.topics = data.get("topics", [])
+                index.chunk_count = data.get("chunk_count", 0)
+                index.built_at_count = data.get("built_at_count", 0)
+                index.pending = data.get("pending", [])
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning("Ignoring unreadable topic index %s: %s", index.path, e)
+        return index
+
+    def save(self):
+        data = {
+            "chunk_count": self.chunk_count,
+            "built_at_count": self.built_at_count,
+            "pending": self.pending,
+            "topics": self.topics,
+        }
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    @property
+    def summaries(self) -> List[str]:
+        return [topic["summary"] for topic in self.topics if topic.get("summary")]
+
+    def centroid_matrix(self) -> np.ndarray:
+        return normalize_rows(np.asarray([topic["centroid"] for topic in self.topics], dtype=np.float32))
+
+    def is_current(self, chunk_count: int) -> bool:
+        """True when the index covers exactly the chunks currently in the vector store."""
+        return bool(self.topics) and self.chunk_count == chunk_count and not self.pending
+
+    def nearest_topics(self, query_embedding: List[float], k: int = TOPIC_QUERY_K) -> List[Dict]:
+        """Returns the k topics whose centroids are most similar to the query."""
+        if not self.topics:
+            return []
+        query_vector = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        similarities = self.centroid_matrix() @ query_vector
+        order = np.argsort(-similarities)[:k]
+        return [self.topics[i] for i in order]
+
+    def update(self, db, new_ids: List[str], generator: MapReduceGenerator):
+        """Folds newly ingested chunks into the index, rebuilding it when it drifts too far."""
+        self.chunk_count += len(new_ids)
+        grown = self.chunk_count - self.built_at_count
+        if not self.topics or grown > self.built_at_count * TOPIC_REBUILD_GROWTH:
+            self.rebuild(db, generator)
+            return
+
+        ids, texts, metadatas, embeddings = generator.load_chunks(db, ids=new_ids)
+        if not ids:
+            self.save()
+            return
+
+        similarities = normalize_rows(embeddings) @ self.centroid_matrix().T
+        dirty = set()
+        for row, chunk_id in enumerate(ids):
+            best = int(np.argmax(similarities[row]))
+            if similarities[row, best] < TOPIC_ASSIGN_THRESHOLD:
+                self.pending.append(chunk_id)
+                continue
+            topic = self.topics[best]
+            size = topic["size"]
+            centroid = np.asarray(topic["centroid"], dtype=np.float32)
+            topic["centroid"] = ((centroid * size + embeddings[row]) / (size + 1)).tolist()
+            topic["size"] = size + 1
+            topic["representatives"].append(self.representative(chunk_id, texts[row], metadatas[row], float(similarities[row, best])))
+            dirty.add(best)
+
+        if len(self.pending) >= CHUNKS_PER_CLUSTER:
+            # Enough unmatched material to form new topics of its own
+            self.rebuild(db, generator)
+            return
+
+        for i in dirty:
+            topic = self.topics[i]
+            ranked = sorted(topic["representatives"], key=lambda rep: -rep["similarity"])
+            keep = select_representatives(list(range(len(ranked))), [rep["text"] for rep in ranked])
+            topic["representatives"] = sorted((ranked[j] for j in keep), key=chunk_position)
+        self.summarise([self.topics[i] for i in dirty], generator)
+        self.save()
+        logger.info("Topic index updated: %d chunks, %d topics refreshed, %d pending.", len(ids), len(dirty), len(self.pending))
+
+    def rebuild(self, db, generator: MapReduceGenerator):
+        """Clusters every chunk of the notebook into a fresh set of topics."""
+        ids, texts, metadatas, embeddings = generator.load_chunks(db)
+        self.topics = []
+        for members in cluster_chunks(embeddings, cluster_count(len(texts))):
+            centroid = embeddings[members].mean(axis=0)
+            similarities = normalize_rows(embeddings[members]) @ normalize_rows(centroid)
+            # cluster_chunks orders members by distance, so the first ones are the representatives
+            selected = select_representatives(members, texts)
+            representatives = [
+                self.representative(ids[i], texts[i], metadatas[i], float(similarities[position]))
+                for position, i in enumerate(selected)
+            ]
+            self.topics.append({
+                "centroid": centroid.tolist(),
+                "size": len(members),
+                "representatives": sorted(representatives, key=chunk_position),
+                "summary": "",
+            })
+        # Keep topics in the order they first appear in the material
+        self.topics.sort(key=lambda topic: chunk_position(topic["representatives"][0]))
+
+        self.chunk_count = len(ids)
+        self.built_at_count = len(ids)
+        self.pending = []
+        self.summarise(self.topics, generator)
+        self.save()
+        logger.info("Topic index rebuilt: %d chunks in %d topics.", len(ids), len(self.topics))
+
+    def summarise(self, topics: List[Dict], generator: MapReduceGenerator):
+        """Summarises topics concurrently, sharing the notebook's summary cache with map-reduce."""
+        if not topics:
+            return
+        cache = SummaryCache(self.persist_directory)
+        groups = [[rep["text"] for rep in topic["representatives"]] for topic in topics]
+        for topic, summary in zip(topics, generator.summarise_all(groups, cache)):
+            topic["summary"] = summary
+        cache.save()
+
+    @staticmethod
+    def representative(chunk_id: str, text: str, metadata: Dict, similarity: float) -> Dict:
+        return {
+            "id": chunk_id,
+            "text": text,
+            "source": metadata.get("source", "Unknown"),
+            "page": metadata.get("page", 0),
+            "start_index": metadata.get("start_index", 0),
+            "similarity": similarity,
+        }
@@ -0,0 +1,123 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Tuple
+
+from embeddings import get_embeddings
+
+logger = logging.getLogger(__name__)
+
+# Constants
+# Bumped after every write so other worker processes know to reopen their copy of the index
+VERSION_FILE = "version"
+LOCK_FILE = "write.lock"
+
+# persist directory -> (store, notebook version it was opened at)
+_stores: Dict[str, Tuple[object, str]] = {}
+_stores_lock = threading.Lock()
+
+
+def notebook_path(persist_directory: str, name: str) -> Path:
+    """Files that describe a notebook live next to its chroma directory."""
+    return Path(persist_directory).parent / name
+
+
+def notebook_version(persist_directory: str) -> str:
+    try:
+        return notebook_path(persist_directory, VERSION_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return "0"
+
+
+def bump_notebook_version(persist_directory: str) -> str:
+    version = f"{time.time_ns()}-{os.getpid()}"
+    path = notebook_path(persist_directory, VERSION_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(version, encoding="utf-8")
+    os.replace(tmp_path, path)
+    return version
+
+
+@contextmanager
+def notebook_lock(persist_directory: str, name: str):
+    """Exclusive lock on one of a notebook's lock files, across threads and worker processes."""
+    path = notebook_path(persist_directory, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def notebook_write_lock(persist_directory: str):
+    """Serialises writes to one notebook across threads and worker processes."""
+    return notebook_lock(persist_directory, LOCK_FILE)
+
+
+def get_vector_store(persist_directory: str):
+    """Returns the open Chroma store for a notebook, opening it on first use.
+
+    A store opened before another worker wrote to the notebook is reopened, since
+    Chroma keeps its vector index in process memory.
+    """
+    version = notebook_version(persist_directory)
+    with _stores_lock:
+        entry = _stores.get(persist_directory)
+        if entry is not None and entry[1] != version:
+            logger.debug("Notebook at %s changed, reopening", persist_directory)
+            # Other threads may still be querying the old store, so it is left for GC to close
+            release_system(persist_directory, stop=False)
+            entry = None
+        if entry is None:
+            from langchain_community.vectorstores import Chroma
+
+            logger.debug("Opening ChromaDB at %s", persist_directory)
+            store = Chroma(
+                persist_directory=persist_directory,
+                embedding_function=get_embeddings()
+            )
+            entry = (store, version)
+            _stores[persist_directory] = entry
+        return entry[0]
+
+
+def mark_vector_store_written(persist_directory: str):
+    """Records a write made through this process's store so it is not needlessly reopened."""
+    version = bump_notebook_version(persist_directory)
+    with _stores_lock:
+        entry = _stores.get(persist_directory)
+        if entry is not None:
+            _stores[persist_directory] = (entry[0], version)
+
+
+def release_system(persist_directory: str, stop: bool = True):
+    # Chroma shares one client system per path; drop it so the next open reads from disk
+    from chromadb.api.shared_system_client import SharedSystemClient
+
+    system = SharedSystemClient._identifier_to_system.pop(persist_directory, None)
+    if system is not None and stop:
+        system.stop()
+    _stores.pop(persist_directory, None)
+
+
+def close_vector_store(persist_directory: str, stop: bool = True):
+    """Closes an open store, e.g. before its directory is moved or deleted.
+
+    Stopping releases the index right away but breaks queries still running on the
+    store, so only callers that hold the notebook exclusively (its tier lock) stop it;
+    the others just drop this process's references and leave the rest to GC.
+    """
+    with _stores_lock:
+        release_system(persist_directory, stop)
+
+
+def open_vector_stores():
+    with _stores_lock:
+        return list(_stores)